@@ -0,0 +1,203 @@
+"""
+Сквозной бенчмарк YoutubeParser на записанных сессиях.
+
+Запуск: python -m benchmarks.crawl sessions/<serial> [...] --output bench.json
+С --baseline сравнивает links/hour и ads/hour с прошлым результатом и
+завершается с кодом 1 при падении больше допуска.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from src.core import YoutubeParser
+from src.link_queue import LinkQueue, LinkTask
+from src.replay import ReplayDevice, ReplayLatency
+
+
+STAGES = {
+    "open_link": ("app", "open_link"),
+    "wait_load_video": (None, "wait_load_video"),
+    "stop_video": (None, "stop_video"),
+    "preparing_video": (None, "preparing_video"),
+    "swipe": (None, "swipe_to_next_content"),
+    "swipe_half": (None, "swipe_half_content"),
+    "reposition": (None, "reposition_content"),
+    "scroll_check": (None, "_get_scroll_signature"),
+    "parse_ad": (None, "parse_ad"),
+    "get_ad_url": (None, "get_ad_url"),
+    "save_ad_info": (None, "save_ad_info"),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк парсера на записанных сессиях")
+    parser.add_argument("sessions", nargs="+", type=Path, help="Папки сессий, записанных через --record")
+    parser.add_argument("--links", type=int, default=None, help="Количество ссылок на сессию")
+    parser.add_argument("--rpc-latency", type=float, default=0.0, help="Задержка любого RPC, с")
+    parser.add_argument("--dump-latency", type=float, default=0.0, help="Дополнительная задержка dump_hierarchy, с")
+    parser.add_argument("--screenshot-latency", type=float, default=0.0, help="Дополнительная задержка скриншота, с")
+    parser.add_argument("--gestures", action="store_true", help="Учитывать длительность свайпов")
+    parser.add_argument("--output", type=Path, default=None, help="Файл для JSON результата")
+    parser.add_argument("--baseline", type=Path, default=None, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Допустимое падение производительности")
+    return parser.parse_args()
+
+
+class TimedLinkQueue(LinkQueue):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.durations: List[float] = []
+        self._started: Dict[int, float] = {}
+
+    def get(self, *args: Any, **kwargs: Any) -> Optional[LinkTask]:
+        task = super().get(*args, **kwargs)
+        if task is not None:
+            self._started[id(task)] = time.perf_counter()
+        return task
+
+    def done(self, task: LinkTask) -> None:
+        started = self._started.pop(id(task), None)
+        if started is not None:
+            self.durations.append(time.perf_counter() - started)
+        super().done(task=task)
+
+
+def instrument(target: Any, name: str, timings: List[float], on_result: Callable[[Any], None] = None) -> None:
+    original = getattr(target, name)
+
+    def wrapped(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            result = original(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start)
+        if on_result:
+            on_result(result)
+        return result
+
+    setattr(target, name, wrapped)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def count_links(device: ReplayDevice) -> int:
+    return max(1, sum(
+        1 for epoch in device.epochs
+        if epoch.event and epoch.event["action"] == "shell" and "am start" in epoch.event["args"][0]
+    ))
+
+
+def run_session(path: Path, args: argparse.Namespace, timings: Dict[str, List[float]]) -> Dict[str, Any]:
+    latency = ReplayLatency(
+        rpc=args.rpc_latency, dump=args.dump_latency,
+        screenshot=args.screenshot_latency, gestures=args.gestures
+    )
+    device = ReplayDevice(path=path, latency=latency)
+    parser = YoutubeParser(device=device)
+
+    ads = []
+    for stage, (owner, name) in STAGES.items():
+        target = getattr(parser, owner) if owner else parser
+        on_result = (lambda result: ads.append(result) if result else None) if stage == "parse_ad" else None
+        instrument(target=target, name=name, timings=timings[stage], on_result=on_result)
+
+    links = args.links or count_links(device=device)
+    link_queue = TimedLinkQueue(max_retries=0)
+    link_queue.extend(f"https://www.youtube.com/watch?v=replay{index}" for index in range(links))
+
+    start = time.perf_counter()
+    parser.run(link_queue=link_queue)
+    elapsed = time.perf_counter() - start
+    timings["link"].extend(link_queue.durations)
+
+    return {
+        "session": str(path),
+        "links": links,
+        "ads": len(ads),
+        "elapsed": round(elapsed, 3),
+        "rpc_count": device.rpc_count,
+        "dump_count": device.dump_count,
+        "screenshot_count": device.screenshot_count,
+        "swipes": parser.swipe_total,
+        "ad_blocks": parser.ad_block_total,
+    }
+
+
+def summarize(sessions: List[Dict[str, Any]], timings: Dict[str, List[float]]) -> Dict[str, Any]:
+    elapsed = sum(session["elapsed"] for session in sessions)
+    links = sum(session["links"] for session in sessions)
+    ads = sum(session["ads"] for session in sessions)
+    screenshots = sum(session["screenshot_count"] for session in sessions)
+    swipes = sum(session["swipes"] for session in sessions)
+    ad_blocks = sum(session["ad_blocks"] for session in sessions)
+
+    return {
+        "links_per_hour": round(links / elapsed * 3600, 1) if elapsed else 0.0,
+        "ads_per_hour": round(ads / elapsed * 3600, 1) if elapsed else 0.0,
+        "rpc_count": sum(session["rpc_count"] for session in sessions),
+        "dump_count": sum(session["dump_count"] for session in sessions),
+        "screenshot_count": screenshots,
+        "screenshots_per_ad": round(screenshots / ads, 2) if ads else None,
+        "swipes_per_ad": round(swipes / ad_blocks, 2) if ad_blocks else None,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50": round(statistics.median(values), 4) if values else 0.0,
+                "p95": round(percentile(values, 0.95), 4),
+                "total": round(sum(values), 3),
+            }
+            for stage, values in timings.items()
+        },
+        "sessions": sessions,
+    }
+
+
+def check_regression(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for metric in ("links_per_hour", "ads_per_hour"):
+        previous = baseline.get(metric) or 0.0
+        if previous and result[metric] < previous * (1 - tolerance):
+            regressions.append(f"{metric}: {result[metric]} < {previous} (-{tolerance:.0%})")
+    return regressions
+
+
+def main() -> None:
+    args = parse_args()
+    sessions = [path.resolve() for path in args.sessions]
+    output = args.output.resolve() if args.output else None
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline else None
+
+    # Результаты и состояние парсера пишутся во временную папку, а не в рабочую
+    os.chdir(tempfile.mkdtemp(prefix="youtubeparser-bench-"))
+
+    timings: Dict[str, List[float]] = defaultdict(list)
+    results = [run_session(path=path, args=args, timings=timings) for path in sessions]
+    result = summarize(sessions=results, timings=timings)
+
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    if output:
+        output.write_text(report, encoding="utf-8")
+    print(report)
+
+    if baseline:
+        regressions = check_regression(result=result, baseline=baseline, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"[ERROR] Регрессия {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
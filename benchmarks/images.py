@@ -0,0 +1,185 @@
+"""
+Сравнение вырезок и сборки карточек на массивах numpy с путем через PIL.
+
+Время - медиана на повтор, память - прирост пикового RSS процесса во время
+повторов. Каждый вариант запускается в отдельном процессе, чтобы пики не
+накладывались.
+
+Перед замерами проверяется, что вырезки и ScrollEndDetector принимают те же
+решения, что и старый путь через compare_images: для записанных скриншотов
+сравниваются соседние кадры, без них - синтетическая лента, сдвинутая на
+разное число строк.
+
+Запуск: python -m benchmarks.images [screenshots/*.png]
+"""
+import io
+import time
+import argparse
+import resource
+import statistics
+import multiprocessing
+import numpy as np
+
+from PIL import Image
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from src.core import YoutubeParser
+from src.images import as_array, compare_boxes, compare_regions, compose_vertically, crop, to_image
+from src.scroll_detector import ScrollEndDetector
+
+# Области как у карточки рекламы на экране 1080x2400: изображение и текст под ним
+IMAGE_BOX = (40, 900, 1040, 1460)
+TEXT_BOX = (40, 1460, 1040, 1700)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк операций с изображениями")
+    parser.add_argument("screenshots", nargs="*", type=Path, help="Скриншоты, по умолчанию синтетические кадры")
+    parser.add_argument("-n", "--repeat", type=int, default=50, help="Количество повторов")
+    parser.add_argument("--regions", type=int, default=32, help="Количество пар областей для сравнения")
+    return parser.parse_args()
+
+
+def load_frames(paths: List[Path]) -> List[Image.Image]:
+    if paths:
+        return [Image.open(path).convert("RGB") for path in paths]
+
+    generator = np.random.default_rng(0)
+    return [Image.fromarray(generator.integers(0, 256, (2400, 1080, 3), dtype=np.uint8)) for _ in range(2)]
+
+
+def synthetic_feed(height: int = 2400, width: int = 1080, card: int = 520) -> np.ndarray:
+    # Лента карточек: плавный фон, превью и строки текста, длиннее экрана для сдвигов
+    generator = np.random.default_rng(1)
+    rows = height * 2
+    feed = np.empty((rows, width, 3), dtype=np.uint8)
+    feed[:] = np.linspace(230, 250, rows, dtype=np.uint8)[:, None, None]
+    for top in range(0, rows - card, card):
+        feed[top + 20:top + 360, 40:width - 40] = generator.integers(0, 256, 3, dtype=np.uint8)
+        for line in range(3):
+            line_top = top + 380 + line * 40
+            length = int(generator.integers(300, width - 80))
+            feed[line_top:line_top + 24, 40:40 + length] = 40
+    return feed
+
+
+def jpeg(image: Image.Image, quality: int = 80) -> Image.Image:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return Image.open(buffer).convert("RGB")
+
+
+def scroll_pairs(paths: List[Path]) -> List[Tuple[str, Image.Image, Image.Image]]:
+    if paths:
+        frames = [Image.open(path).convert("RGB") for path in paths]
+        return [
+            (f"{first.name} -> {second.name}", frames[index], frames[index + 1])
+            for index, (first, second) in enumerate(zip(paths, paths[1:]))
+        ]
+
+    feed = synthetic_feed()
+    screen = feed[:2400]
+    pairs = []
+    for shift in (0, 0, 2, 8, 24, 60, 120, 260, 520, 1040):
+        before = jpeg(Image.fromarray(np.ascontiguousarray(screen)))
+        after = jpeg(Image.fromarray(np.ascontiguousarray(feed[shift:shift + 2400])), quality=75)
+        pairs.append((f"сдвиг {shift} строк", before, after))
+    return pairs
+
+
+def check_scroll_detector(paths: List[Path], threshold: float = 70.0) -> None:
+    detector = ScrollEndDetector(mode="pixels", threshold=threshold)
+    pairs = scroll_pairs(paths)
+    agreed = 0
+    for name, before, after in pairs:
+        old = YoutubeParser.compare_images(before, after) >= threshold
+        new = detector.is_scroll_end(detector.frame_signature(before), detector.frame_signature(after))
+        agreed += old == new
+        if old != new:
+            print(f"[ERROR] ScrollEndDetector расходится с compare_images: {name}, было {old}, стало {new}")
+    print(f"Конец списка: совпадение с compare_images {agreed} из {len(pairs)} пар")
+
+
+def region_boxes(count: int, size: Tuple[int, int] = (320, 180)) -> List[Tuple[int, int, int, int]]:
+    width, height = size
+    return [
+        (left, top, left + width, top + height)
+        for top in range(0, 2400 - height, height)
+        for left in range(0, 1080 - width, width)
+    ][:count]
+
+
+def build_cases(frames: List[Image.Image], regions: int) -> Dict[str, Callable[[], object]]:
+    first, second = frames[0], frames[-1]
+    first_array, second_array = as_array(first), as_array(second)
+    boxes = region_boxes(regions)
+    card = np.empty((
+        IMAGE_BOX[3] - IMAGE_BOX[1] + TEXT_BOX[3] - TEXT_BOX[1],
+        max(IMAGE_BOX[2] - IMAGE_BOX[0], TEXT_BOX[2] - TEXT_BOX[0]),
+        3
+    ), dtype=np.uint8)
+
+    return {
+        "card/PIL": lambda: YoutubeParser.combine_images_vertically(
+            top_img=first.crop(IMAGE_BOX), bottom_img=first.crop(TEXT_BOX)
+        ),
+        "card/numpy": lambda: to_image(compose_vertically(
+            top=crop(first_array, IMAGE_BOX), bottom=crop(first_array, TEXT_BOX)
+        )),
+        "card/numpy+buffer": lambda: compose_vertically(
+            top=crop(first_array, IMAGE_BOX), bottom=crop(first_array, TEXT_BOX), out=card
+        ),
+        "compare/PIL": lambda: [
+            YoutubeParser.compare_images(first.crop(box), second.crop(box)) for box in boxes
+        ],
+        "compare/numpy": lambda: compare_regions(
+            [(crop(first_array, box), crop(second_array, box)) for box in boxes]
+        ),
+        "compare/numpy boxes": lambda: compare_boxes(first_array, second_array, boxes),
+    }
+
+
+def max_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_case(name: str, frames: List[Image.Image], regions: int, repeat: int, connection) -> None:
+    function = build_cases(frames=frames, regions=regions)[name]
+    baseline = max_rss()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    connection.send((statistics.median(timings), max_rss() - baseline))
+
+
+def main() -> None:
+    args = parse_args()
+    frames = load_frames(args.screenshots)
+    context = multiprocessing.get_context("fork")
+
+    check_scroll_detector(paths=args.screenshots)
+
+    first, second = as_array(frames[0]), as_array(frames[-1])
+    boxes = region_boxes(args.regions)
+    expected = [YoutubeParser.compare_images(frames[0].crop(box), frames[-1].crop(box)) for box in boxes]
+    if compare_regions([(crop(first, box), crop(second, box)) for box in boxes]) != expected:
+        print("[ERROR] compare_regions расходится с compare_images")
+    if compare_boxes(first, second, boxes) != expected:
+        print("[ERROR] compare_boxes расходится с compare_images")
+
+    print(f"Кадр {frames[0].width}x{frames[0].height}, {len(boxes)} пар областей, {args.repeat} повторов")
+    for name in build_cases(frames=frames, regions=args.regions):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_case, args=(name, frames, args.regions, args.repeat, sender))
+        process.start()
+        duration, peak = receiver.recv()
+        process.join()
+        print(f"{name:<20} {duration * 1000:8.2f} мс  пик RSS +{peak / 1024 / 1024:6.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Сравнение SelectorIndex с наивным XPath на записанных дампах иерархии.
+
+Запуск: python -m benchmarks.selector_index dumps/*.xml
+"""
+import time
+import argparse
+import statistics
+from lxml import etree
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from src.selector_index import ATTRIBUTE_SELECTORS, PREFIX_SELECTORS, SelectorIndex
+from src.hierarchy import HierarchySnapshot
+from src.node_selectors import ClassNodesSelectors
+from src.nodes import AdNodes, ChromeNodes, ClassNodes, ContentNodes, LazyNode, MainNodes, PlayerNodes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк индекса селекторов")
+    parser.add_argument("dumps", nargs="+", type=Path, help="Файлы XML дампов")
+    parser.add_argument("-n", "--repeat", type=int, default=50, help="Количество повторов")
+    return parser.parse_args()
+
+
+def selector_to_xpath(selector: Dict[str, Any]) -> str:
+    predicates = []
+    for key, value in selector.items():
+        if key in ATTRIBUTE_SELECTORS:
+            predicates.append(f"@{ATTRIBUTE_SELECTORS[key]}='{value}'")
+        elif key in PREFIX_SELECTORS:
+            predicates.append(f"starts-with(@{PREFIX_SELECTORS[key]}, '{value}')")
+        else:
+            raise ValueError(f"Селектор {key} не переводится в XPath")
+    return f"//node[{' and '.join(predicates)}]" if predicates else "//node"
+
+
+def collect_chains() -> Dict[str, Tuple[Dict[str, Any], ...]]:
+    snapshot = HierarchySnapshot(device=None)
+    groups = [
+        AdNodes(device=snapshot), MainNodes(device=snapshot), ClassNodes(device=snapshot),
+        ChromeNodes(device=snapshot), PlayerNodes(device=snapshot), ContentNodes(device=snapshot),
+    ]
+
+    # Узлы групп - дескрипторы LazyNode классов, в том числе унаследованные от MainNodes
+    chains = {}
+    for group in groups:
+        for owner in type(group).__mro__:
+            for name, value in vars(owner).items():
+                key = f"{owner.__name__}.{name}"
+                if isinstance(value, LazyNode) and key not in chains:
+                    chains[key] = getattr(group, name).chain
+
+    ad_block_node = groups[-1].ad_block_node
+    chains["ad_block_node.view_group"] = ad_block_node.child(**ClassNodesSelectors.view_group).chain
+    chains["ad_block_node.image_view"] = ad_block_node.child(**ClassNodesSelectors.image_view).chain
+    return chains
+
+
+def measure(function, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    args = parse_args()
+    chains = collect_chains()
+    xpaths = {name: etree.XPath("." + "".join(selector_to_xpath(s) for s in chain)) for name, chain in chains.items()}
+
+    for dump_path in args.dumps:
+        xml = dump_path.read_text(encoding="utf-8")
+        root = etree.fromstring(xml.encode("utf-8"))
+
+        build = measure(lambda: SelectorIndex(root=root), args.repeat)
+        index = SelectorIndex(root=root)
+
+        xpath_total, index_total = [], []
+        for name, chain in chains.items():
+            expected = xpaths[name](root)
+            # XPath возвращает узлы в порядке документа, индекс должен совпадать с ним
+            if expected != index.find(chain):
+                print(f"[ERROR] {dump_path.name}: {name} расходится с XPath")
+
+            xpath_total.append(statistics.median(measure(lambda: xpaths[name](root), args.repeat)))
+            index_total.append(statistics.median(measure(lambda: index.find(chain), args.repeat)))
+
+        print(
+            f"{dump_path.name}: {len(xml) / 1024:.0f} KB, {len(index.elements)} узлов | "
+            f"построение индекса {statistics.median(build) * 1000:.2f} мс | "
+            f"{len(chains)} цепочек: XPath {sum(xpath_total) * 1000:.3f} мс, "
+            f"индекс {sum(index_total) * 1000:.3f} мс"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Разрешение ссылок через локальный сервер-заглушку с цепочками перенаправлений.
+
+Заглушка отдает /track/<hops>/<id> -> ... -> /landing/<id> с задержкой на
+каждый ответ, часть цепочек заканчивается промежуточной страницей с meta
+refresh. Сравниваются один поток, пул потоков и повторный проход из кэша.
+
+Запуск: python -m benchmarks.url_resolver --urls 200 --latency 0.05
+"""
+import time
+import argparse
+import tempfile
+import threading
+
+from pathlib import Path
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.url_resolver import RedirectCache, UrlResolver
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк разрешения ссылок")
+    parser.add_argument("--urls", type=int, default=200, help="Количество ссылок")
+    parser.add_argument("--hops", type=int, default=3, help="Перенаправлений в цепочке")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа заглушки, с")
+    parser.add_argument("--concurrency", type=int, default=32, help="Потоков в параллельном проходе")
+    return parser.parse_args()
+
+
+def stub_handler(latency: float):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _send(self, status: int, headers: dict, body: bytes = b"") -> None:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            time.sleep(latency)
+            parts = urlparse(self.path).path.strip("/").split("/")
+            if parts[0] == "track":
+                hops, video = int(parts[1]), parts[2]
+                if hops > 0:
+                    self._send(302, {"Location": f"/track/{hops - 1}/{video}"})
+                elif int(video) % 4 == 0:
+                    # Промежуточная страница трекера
+                    body = f'<html><meta http-equiv="refresh" content="0;url=/landing/{video}?utm_source=x"></html>'
+                    self._send(200, {"Content-Type": "text/html"}, body.encode())
+                else:
+                    self._send(301, {"Location": f"http://127.0.0.1:{self.server.server_port}/landing/{video}?gclid=1"})
+            elif parts[0] == "landing":
+                self._send(200, {"Content-Type": "text/html"}, b"<html>landing</html>" * 100)
+            else:
+                self._send(404, {})
+
+    return StubHandler
+
+
+def run_pass(resolver: UrlResolver, urls) -> float:
+    start = time.perf_counter()
+    futures = [resolver.submit(url) for url in urls]
+    results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    wrong = [result for result in results if not result.ok or not result.final_url.split("?")[0].endswith("/landing/" + result.url.rsplit("/", 1)[1])]
+    if wrong:
+        print(f"[ERROR] Неверно разрешено {len(wrong)} ссылок, например {wrong[0]}")
+    return elapsed
+
+
+def main() -> None:
+    args = parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stub_handler(latency=args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    urls = [f"{base}/track/{args.hops}/{index}" for index in range(args.urls)]
+
+    with tempfile.TemporaryDirectory() as folder:
+        for name, concurrency, cache_name in (
+            ("1 поток", 1, "serial"),
+            (f"{args.concurrency} потоков", args.concurrency, "parallel"),
+            ("повтор из кэша", args.concurrency, "parallel"),
+        ):
+            cache = RedirectCache(path=Path(folder).joinpath(f"{cache_name}.sqlite3"))
+            resolver = UrlResolver(cache=cache, concurrency=concurrency, max_per_host=concurrency)
+            elapsed = run_pass(resolver=resolver, urls=urls)
+            resolver.close()
+            print(
+                f"{name:<16} {elapsed:7.2f} с  {len(urls) / elapsed:8.1f} ссылок/с  "
+                f"сеть {resolver.resolved}, кэш {resolver.cached}, ошибок {resolver.failed}"
+            )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
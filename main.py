@@ -1,12 +1,19 @@
+import os
 import argparse
-from multiprocessing import Process
 from pathlib import Path
 import subprocess
-from typing import List
-import requests
+from typing import List, Optional
 from uiautomator2 import Device
 
 from src.core import YoutubeParser
+from src.link_queue import LinkQueue, LinkTask
+from src.crawl_state import CrawlState, get_video_id
+from src.supervisor import DeviceSupervisor, SupervisedLinkQueue, WorkerHeartbeat
+from src.replay import SessionRecorder
+from src.metrics import MetricsExporter
+from src.threaded_driver import ThreadedDriver
+from src.link_source import LinkFeeder, LinkSource, parse_shard
+from src.ad_history import AdHistory
 
 
 def parse_args():
@@ -15,8 +22,84 @@ def parse_args():
     parser.add_argument(
         "-s", "--serials",
         nargs="+",
-        help="Список Serials",
-        required=True
+        default=None,
+        help="Список Serials, по умолчанию используются все подключенные и подключаемые позже устройства"
+    )
+    parser.add_argument(
+        "-l", "--links",
+        nargs="+",
+        default=["links.txt"],
+        help="Файлы или папки со ссылками, - для чтения из stdin"
+    )
+    parser.add_argument(
+        "--dedup",
+        choices=("set", "bloom"),
+        default="set",
+        help="Дедупликация video_id: точное множество или фильтр Блума для очень больших списков"
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="Обрабатывать только шард k/n ссылок, например 0/3, для запуска на нескольких машинах"
+    )
+    parser.add_argument(
+        "-r", "--max-retries",
+        type=int,
+        default=3,
+        help="Максимальное количество повторов для ссылки"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Продолжить с сохраненного состояния, пропуская обработанные ссылки"
+    )
+    parser.add_argument(
+        "--telegram-token",
+        default=os.environ.get("TELEGRAM_BOT_TOKEN"),
+        help="Токен Telegram бота для оповещений"
+    )
+    parser.add_argument(
+        "--telegram-chat-id",
+        default=os.environ.get("TELEGRAM_CHAT_ID"),
+        help="Чат Telegram для оповещений"
+    )
+    parser.add_argument(
+        "--record",
+        type=Path,
+        default=None,
+        help="Папка для записи сессий устройств для офлайн воспроизведения"
+    )
+    parser.add_argument(
+        "--state",
+        type=Path,
+        default=Path("state/crawl.sqlite3"),
+        help="Путь к файлу состояния обхода"
+    )
+    parser.add_argument(
+        "--no-triage",
+        dest="triage",
+        action="store_false",
+        help="Обходить все видео без оценки по истории рекламы и признакам на странице"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Порт HTTP для метрик Prometheus, по умолчанию метрики пишутся только в metrics/youtubeparser.prom"
+    )
+    parser.add_argument(
+        "--hung-timeout",
+        type=float,
+        default=600,
+        help="Через сколько секунд без признаков работы процесс устройства перезапускается"
+    )
+    parser.add_argument(
+        "--threaded",
+        "--async",
+        dest="threaded_mode",
+        action="store_true",
+        help="Все устройства в одном процессе, по потоку на устройство, вместо процесса на устройство"
     )
 
     return parser.parse_args()
@@ -53,86 +136,158 @@ def get_adb_devices() -> None:
         return []
 
 
-def send_telegram_message(bot_token: str, chat_id: str, text: str) -> bool:
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {
-        'chat_id': chat_id,
-        'text': text
-    }
-    
-    try:
-        response = requests.post(url, data=payload, timeout=10)
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка отправки: {e}")
-        return False
+def create_parser(
+    serial: str,
+    crawl_state: CrawlState,
+    telegram_bot_api: Optional[str],
+    telegram_chat_id: Optional[str],
+    record_path: Optional[Path],
+    ad_history: Optional[AdHistory] = None,
+    heartbeat: Optional[WorkerHeartbeat] = None
+) -> YoutubeParser:
+    device = Device(serial)
+    if record_path:
+        device = SessionRecorder(device=device, path=record_path.joinpath(serial))
 
+    return YoutubeParser(
+        device=device,
+        crawl_state=crawl_state,
+        ad_history=ad_history,
+        telegram_bot_api=telegram_bot_api,
+        telegram_chat_id=telegram_chat_id,
+        heartbeat=heartbeat
+    )
 
-def worker(serial: str, links: List[str]) -> None:
-    device = Device(serial)
-    parser = YoutubeParser(device=device)
 
+def worker(
+    serial: str,
+    heartbeat: WorkerHeartbeat,
+    link_queue: LinkQueue,
+    crawl_state: CrawlState,
+    telegram_bot_api: Optional[str],
+    telegram_chat_id: Optional[str],
+    record_path: Optional[Path],
+    ad_history: Optional[AdHistory]
+) -> None:
+    parser = create_parser(
+        serial=serial,
+        crawl_state=crawl_state,
+        telegram_bot_api=telegram_bot_api,
+        telegram_chat_id=telegram_chat_id,
+        record_path=record_path,
+        ad_history=ad_history,
+        heartbeat=heartbeat
+    )
     try:
-        parser.run(links=links)
-    except Exception as e:
-        send_telegram_message(bot_token=parser.telegram_bot_api, chat_id=parser.telegram_chat_id, text=e)
-        raise e
+        parser.run(link_queue=SupervisedLinkQueue(link_queue=link_queue, heartbeat=heartbeat))
+    finally:
+        if record_path:
+            parser.device.save()
+
+
+def run_threaded(
+    args: argparse.Namespace,
+    serials: List[str],
+    link_queue: LinkQueue,
+    crawl_state: CrawlState,
+    ad_history: Optional[AdHistory]
+) -> None:
+    def parser_factory(serial: str) -> YoutubeParser:
+        return create_parser(
+            serial=serial,
+            crawl_state=crawl_state,
+            telegram_bot_api=args.telegram_token,
+            telegram_chat_id=args.telegram_chat_id,
+            record_path=args.record,
+            ad_history=ad_history
+        )
+
+    def on_stop(parser: YoutubeParser) -> None:
+        if args.record:
+            parser.device.save()
+
+    driver = ThreadedDriver(
+        serials=serials,
+        link_queue=link_queue,
+        parser_factory=parser_factory,
+        on_stop=on_stop
+    )
+    driver.run()
+
 
 if __name__ == "__main__":
     args = parse_args()
-    links_file = Path("links.txt")
-    
-    if not links_file.is_file():
-        print("Файл links.txt не найден в рабочей директории")
+    missing = [source for source in args.links if source != "-" and not Path(source).exists()]
+    if missing:
+        print(f"Источники ссылок не найдены: {missing}")
         exit()
 
     print("Запуск приложения")
     
     try:
-        phone_series = []
         attach_phone_series = get_adb_devices()
-        for serial in args.serials:
+        for serial in args.serials or []:
             if serial not in attach_phone_series:
-                print(f"Устройство {serial} не существует!")
+                print(f"Устройство {serial} не подключено, процесс будет запущен после подключения")
+
+        crawl_state = CrawlState(path=args.state)
+        if not args.resume:
+            crawl_state.reset()
+        print(f"Состояние обхода: {crawl_state.counts()}")
+        ad_history = AdHistory() if args.triage else None
+
+        # Ссылки читаются потоком, в очереди одновременно находится не больше max_pending
+        link_queue = LinkQueue(max_retries=args.max_retries)
+        link_feeder = LinkFeeder(
+            source=LinkSource(
+                sources=args.links, crawl_state=crawl_state, dedup=args.dedup, shard=args.shard,
+                history=ad_history, max_retries=args.max_retries
+            ),
+            link_queue=link_queue
+        )
+        link_feeder.start()
+
+        def on_requeue(serial: str, task: LinkTask, reason: str, exhausted: bool) -> None:
+            video_id = get_video_id(task.link)
+            if exhausted:
+                crawl_state.mark_failed(video_id=video_id, serial=serial, reason=reason)
             else:
-                phone_series.append(serial)
+                crawl_state.mark_retry(video_id=video_id, serial=serial, reason=reason)
 
-        if not phone_series:
+        serials = [serial for serial in args.serials or attach_phone_series if serial in attach_phone_series]
+        if args.threaded_mode and not serials:
             print("Не найдено ни одного устройства для работы. Выход.")
             exit()
 
-        print(f"Найденные устройства: {phone_series}")
-
+        metrics_exporter = MetricsExporter(port=args.metrics_port)
+        metrics_exporter.start()
 
-        with open(file="links.txt", mode="r") as file:
-            links = file.readlines()
-            print(f"Загружено {len(links)} ссылок из файла")
-
-        if not links:
-            print("Файл links.txt пуст")
-            exit()
+        try:
+            if args.threaded_mode:
+                print(f"Режим одного процесса, устройства: {serials}")
+                run_threaded(
+                    args=args, serials=serials, link_queue=link_queue, crawl_state=crawl_state, ad_history=ad_history
+                )
+            else:
+                supervisor = DeviceSupervisor(
+                    worker=worker,
+                    worker_args=(
+                        link_queue, crawl_state, args.telegram_token, args.telegram_chat_id, args.record, ad_history
+                    ),
+                    link_queue=link_queue,
+                    on_requeue=on_requeue,
+                    serials=args.serials,
+                    hung_timeout=args.hung_timeout
+                )
 
-        processes = []
-        for serial in phone_series:
-            print(f"Создание процесса для устройства {serial} с {len(links)} ссылками")
-
-            process = Process(
-                name=serial,
-                target=worker,
-                args=(serial, links),
-                daemon=True
-            )
-            processes.append(process)
-
-        print("Запуск процессов...")
-        for process in processes:
-            process.start()
-            print(f"Процесс {process.name} запущен")
-
-        print("Ожидание завершения процессов...")
-        for process in processes:
-            process.join()
-            print(f"Процесс {process.name} завершил работу")
+                print("Запуск процессов, ожидание устройств...")
+                try:
+                    supervisor.run()
+                finally:
+                    supervisor.stop()
+        finally:
+            link_feeder.stop()
+            metrics_exporter.stop()
 
         print("Все процессы завершены. Работа приложения завершена.")
 
@@ -0,0 +1,282 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+
+from lxml import etree
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from src.node_selectors import AdNodesSelectors, ContentNodesSelectors, MainNodesSelectors
+from src.selector_index import get_matcher
+
+
+class TriageAction:
+    scan: str = "scan"
+    quick: str = "quick"
+    skip: str = "skip"
+
+
+# Признаки на странице просмотра, видимые до остановки видео и прокрутки.
+# Признаки без рекламы ищутся только в метаданных самого видео, вне рекламных блоков
+AD_SIGNAL_PATTERNS = {
+    "sponsored": re.compile(r"^Sponsored\b"),
+    "player_ad": re.compile(r"\b(Skip ad|Skip Ad|Visit advertiser|Ad \d+ of \d+)\b"),
+}
+NO_AD_SIGNAL_PATTERNS = {
+    "made_for_kids": re.compile(r"\bMade for kids\b", re.IGNORECASE),
+}
+AD_PANEL_RESOURCE_ID = AdNodesSelectors.header_panel_node["resourceId"]
+CHANNEL_PATTERN = re.compile(r"^(?:Go to channel )?(.+?)[.,]?\s+[\d.,]+\s*[KMB]?\s+subscribers", re.IGNORECASE)
+
+
+@dataclass
+class TriageDecision:
+    action: str
+    expected_yield: float
+    channel: Optional[str] = None
+    signals: Tuple[str, ...] = ()
+    # Причина пропуска: low_yield по истории или признак без рекламы, например made_for_kids
+    reason: Optional[str] = None
+
+
+class AdHistory:
+    """
+    История рекламы по видео и каналам из прошлых запусков.
+
+    Ожидаемое количество реклам за посещение видео сглаживается к среднему
+    по каналу, а среднее по каналу - к среднему по всем посещениям, поэтому
+    у нового видео известного канала сразу есть оценка. Хранилище SQLite
+    общее для всех процессов.
+    """
+
+    def __init__(
+        self,
+        path: Path = Path("state/ad_history.sqlite3"),
+        smoothing: float = 2.0,
+        default_yield: float = 1.0,
+        skip_below: float = 0.1,
+        quick_below: float = 0.3,
+        min_video_visits: int = 2,
+        min_channel_visits: int = 5,
+        revisit_after: float = 7 * 24 * 3600
+    ) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.smoothing = smoothing
+        self.default_yield = default_yield
+        self.skip_below = skip_below
+        self.quick_below = quick_below
+        self.min_video_visits = min_video_visits
+        self.min_channel_visits = min_channel_visits
+        # Видео без рекламы периодически проверяется заново: кампании меняются
+        self.revisit_after = revisit_after
+
+        self._connections = {}
+        self._global_yield = (self.default_yield, float("-inf"))
+        self._init_schema()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_connections"] = {}
+        return state
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        owner = (os.getpid(), threading.get_ident())
+        connection = self._connections.get(owner)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections[owner] = connection
+        return connection
+
+    def _init_schema(self) -> None:
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS videos (
+                video_id TEXT PRIMARY KEY,
+                channel TEXT,
+                visits INTEGER NOT NULL DEFAULT 0,
+                ads INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS channels (
+                channel TEXT PRIMARY KEY,
+                visits INTEGER NOT NULL DEFAULT 0,
+                ads INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL
+            );
+            """
+        )
+
+    def record(self, video_id: str, ads: int, channel: Optional[str] = None) -> None:
+        now = time.time()
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            connection.execute(
+                "INSERT INTO videos (video_id, channel, visits, ads, updated_at) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT (video_id) DO UPDATE SET channel = COALESCE(excluded.channel, channel), "
+                "visits = visits + 1, ads = ads + excluded.ads, updated_at = excluded.updated_at",
+                (video_id, channel, ads, now)
+            )
+            if channel:
+                connection.execute(
+                    "INSERT INTO channels (channel, visits, ads, updated_at) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT (channel) DO UPDATE SET visits = visits + 1, ads = ads + excluded.ads, "
+                    "updated_at = excluded.updated_at",
+                    (channel, ads, now)
+                )
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def global_yield(self, max_age: float = 60.0) -> float:
+        # Полный проход по таблице не повторяется на каждой ссылке
+        value, updated_at = self._global_yield
+        if time.monotonic() - updated_at < max_age:
+            return value
+
+        visits, ads = self.connection.execute("SELECT SUM(visits), SUM(ads) FROM videos").fetchone()
+        value = self._smooth(ads, visits, self.default_yield) if visits else self.default_yield
+        self._global_yield = (value, time.monotonic())
+        return value
+
+    def _smooth(self, ads: int, visits: int, prior: float) -> float:
+        return (ads + self.smoothing * prior) / (visits + self.smoothing)
+
+    def _estimate(
+        self,
+        video: Optional[Tuple],
+        channel: Optional[Tuple],
+        prior: float
+    ) -> Tuple[float, bool]:
+        # video: (visits, ads, updated_at), channel: (visits, ads)
+        channel_yield = self._smooth(channel[1], channel[0], prior) if channel else prior
+        if video is None:
+            confident = bool(channel) and channel[0] >= self.min_channel_visits
+            return channel_yield, confident
+
+        visits, ads, updated_at = video
+        expected = self._smooth(ads, visits, channel_yield)
+        fresh = updated_at is not None and time.time() - updated_at < self.revisit_after
+        return expected, fresh and visits >= self.min_video_visits
+
+    def _channel_row(self, channel: Optional[str]) -> Optional[Tuple]:
+        if not channel:
+            return None
+        return self.connection.execute(
+            "SELECT visits, ads FROM channels WHERE channel = ?", (channel,)
+        ).fetchone()
+
+    def expected_yield(self, video_id: str, channel: Optional[str] = None) -> Tuple[float, bool]:
+        """Ожидаемое количество реклам за посещение и достаточно ли истории, чтобы ей доверять."""
+        row = self.connection.execute(
+            "SELECT channel, visits, ads, updated_at FROM videos WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        video = row[1:] if row else None
+        channel = channel or (row[0] if row else None)
+        return self._estimate(video=video, channel=self._channel_row(channel), prior=self.global_yield())
+
+    def expected_yields(self, video_ids: Iterable[str], chunk_size: int = 500) -> Dict[str, Tuple[float, bool]]:
+        """expected_yield для пачки видео за несколько запросов."""
+        video_ids = list(video_ids)
+        prior = self.global_yield()
+        rows: Dict[str, Tuple] = {}
+        for start in range(0, len(video_ids), chunk_size):
+            chunk = video_ids[start:start + chunk_size]
+            cursor = self.connection.execute(
+                "SELECT videos.video_id, videos.visits, videos.ads, videos.updated_at, "
+                "channels.visits, channels.ads FROM videos LEFT JOIN channels USING (channel) "
+                f"WHERE videos.video_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for video_id, visits, ads, updated_at, channel_visits, channel_ads in cursor:
+                channel = (channel_visits, channel_ads) if channel_visits is not None else None
+                rows[video_id] = ((visits, ads, updated_at), channel)
+
+        estimates = {}
+        for video_id in video_ids:
+            video, channel = rows.get(video_id, (None, None))
+            estimates[video_id] = self._estimate(video=video, channel=channel, prior=prior)
+        return estimates
+
+    def action(self, expected_yield: float, confident: bool) -> str:
+        if confident and expected_yield < self.skip_below:
+            return TriageAction.skip
+        if expected_yield < self.quick_below:
+            return TriageAction.quick
+        return TriageAction.scan
+
+
+def _metadata_elements(root: etree._Element) -> Iterator[etree._Element]:
+    is_metadata = get_matcher(MainNodesSelectors.video_metadata_node)
+    is_ad_block = get_matcher(ContentNodesSelectors.ad_block_node)
+    for element in root.iter("node"):
+        if not is_metadata(element):
+            continue
+        for node in element.iter("node"):
+            if not is_ad_block(node) and not any(is_ad_block(parent) for parent in node.iterancestors("node")):
+                yield node
+        return
+
+
+def page_signals(root: etree._Element) -> Tuple[Tuple[str, ...], Optional[str]]:
+    """Признаки рекламы на странице просмотра и название канала, если оно видно."""
+    signals = set()
+    channel = None
+    for element in root.iter("node"):
+        if element.get("resource-id") == AD_PANEL_RESOURCE_ID:
+            signals.add("ad_panel")
+
+        for value in (element.get("content-desc"), element.get("text")):
+            if not value:
+                continue
+            for name, pattern in AD_SIGNAL_PATTERNS.items():
+                if pattern.search(value):
+                    signals.add(name)
+            if channel is None:
+                match = CHANNEL_PATTERN.search(value)
+                if match:
+                    channel = match.group(1).strip()
+
+    for element in _metadata_elements(root=root):
+        for value in (element.get("content-desc"), element.get("text")):
+            if not value:
+                continue
+            for name, pattern in NO_AD_SIGNAL_PATTERNS.items():
+                if pattern.search(value):
+                    signals.add(name)
+    return tuple(sorted(signals)), channel
+
+
+def triage(history: AdHistory, root: etree._Element, video_id: str) -> TriageDecision:
+    """
+    Решение по первому снимку страницы: полный обход, короткий или пропуск.
+
+    Признаки рекламы на странице всегда ведут к полному обходу, пропуск
+    возможен только по достаточной истории (reason low_yield) или явному
+    признаку без рекламы (reason - имя признака).
+    """
+    signals, channel = page_signals(root=root)
+    expected_yield, confident = history.expected_yield(video_id=video_id, channel=channel)
+
+    reason = None
+    no_ad_signals = [signal for signal in signals if signal in NO_AD_SIGNAL_PATTERNS]
+    if any(signal in AD_SIGNAL_PATTERNS or signal == "ad_panel" for signal in signals):
+        action = TriageAction.scan
+    elif no_ad_signals:
+        action, reason = TriageAction.skip, no_ad_signals[0]
+    else:
+        action = history.action(expected_yield=expected_yield, confident=confident)
+        if action == TriageAction.skip:
+            reason = "low_yield"
+
+    return TriageDecision(
+        action=action, expected_yield=round(expected_yield, 3), channel=channel, signals=signals, reason=reason
+    )
@@ -0,0 +1,165 @@
+import os
+import json
+
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from PIL.Image import Image as PILImage
+
+from src.image_hash import dhash, hamming_distance
+
+
+class BKTree:
+    """BK-дерево по расстоянию Хэмминга с ленивым удалением."""
+
+    def __init__(self) -> None:
+        self._root: Optional[Tuple[int, Dict[int, tuple]]] = None
+        self.removed = set()
+        self.size = 0
+
+    def add(self, value: int) -> None:
+        self.removed.discard(value)
+        if self._root is None:
+            self._root = (value, {})
+            self.size = 1
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                self.size += 1
+                return
+            node = child
+
+    def remove(self, value: int) -> None:
+        self.removed.add(value)
+
+    def nearest(self, value: int, max_distance: int) -> Optional[int]:
+        if self._root is None:
+            return None
+
+        best, best_distance = None, max_distance + 1
+        stack = [self._root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance < best_distance and node_value not in self.removed:
+                best, best_distance = node_value, distance
+                if distance == 0:
+                    break
+
+            for child_distance, child in children.items():
+                if distance - best_distance < child_distance < distance + best_distance:
+                    stack.append(child)
+
+        return best
+
+
+class AdIndex:
+    """
+    Индекс уже встреченных рекламных креативов по перцептивному хэшу.
+
+    Ключ - dHash изображения рекламы размером hash_size * hash_size бит.
+    Текстовые карточки разных рекламодателей слишком похожи, поэтому текст
+    в ключ не входит, а порог расстояния мал относительно длины хэша.
+    В памяти хранится не более capacity хэшей с вытеснением по LRU, поиск
+    похожих выполняется по BK-дереву. Каждое устройство сохраняет свой файл,
+    при загрузке объединяются файлы всех устройств.
+    """
+
+    def __init__(
+        self,
+        serial: str,
+        root: Path = Path("state/ad_index"),
+        capacity: int = 50000,
+        hash_size: int = 16,
+        max_distance: int = 8
+    ) -> None:
+        self.serial = serial
+        self.root = Path(root)
+        self.capacity = capacity
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[int, str]" = OrderedDict()
+        self._tree = BKTree()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return round(self.hits / total * 100, 2) if total else 0.0
+
+    def key(self, image: PILImage) -> int:
+        return dhash(image, hash_size=self.hash_size)
+
+    @property
+    def _hex_width(self) -> int:
+        return self.hash_size * self.hash_size // 4
+
+    def lookup(self, phash: int) -> Optional[str]:
+        nearest = self._tree.nearest(value=phash, max_distance=self.max_distance)
+        if nearest is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(nearest)
+        return self._entries[nearest]
+
+    def add(self, phash: int, url: str) -> None:
+        self._entries[phash] = url
+        self._entries.move_to_end(phash)
+        self._tree.add(value=phash)
+
+        while len(self._entries) > self.capacity:
+            evicted, _ = self._entries.popitem(last=False)
+            self._tree.remove(value=evicted)
+
+        # Удаленные узлы остаются в дереве до перестроения
+        if len(self._tree.removed) > self.capacity:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._tree = BKTree()
+        for phash in self._entries:
+            self._tree.add(value=phash)
+
+    def load(self) -> None:
+        if not self.root.is_dir():
+            return
+
+        entries: List[Tuple[int, str]] = []
+        for index_path in sorted(self.root.glob("*.json"), key=lambda path: path.stat().st_mtime):
+            try:
+                with index_path.open("r", encoding="utf-8") as file:
+                    # Ключи другого размера (старый формат индекса) несравнимы и пропускаются
+                    entries.extend(
+                        (int(phash, 16), url) for phash, url in json.load(file)
+                        if len(phash) == self._hex_width
+                    )
+            except (OSError, ValueError) as e:
+                print(f"[ERROR] [{self.serial}] Не удалось загрузить индекс {index_path}: {e}")
+
+        for phash, url in entries[-self.capacity:]:
+            self.add(phash=phash, url=url)
+
+    def save(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        index_path = self.root.joinpath(f"{self.serial}.json")
+        temp_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+
+        with temp_path.open("w", encoding="utf-8") as file:
+            json.dump([[f"{phash:0{self._hex_width}x}", url] for phash, url in self._entries.items()], file)
+        os.replace(temp_path, index_path)
@@ -0,0 +1,366 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+import requests
+
+from pathlib import Path
+from collections import deque
+from dataclasses import dataclass, field
+from requests.adapters import HTTPAdapter
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+@dataclass
+class Alert:
+    text: str
+    photo: Optional[bytes] = None
+    document: Optional[bytes] = None
+    document_name: str = "ui_dump.xml"
+
+
+@dataclass
+class DeliveryResult:
+    ok: bool
+    retry_after: float = 0.0
+
+
+class Transport:
+    def send(self, method: str, data: Dict[str, str], files: Optional[Dict[str, Tuple[str, bytes]]] = None) -> DeliveryResult:
+        raise NotImplementedError
+
+
+class TelegramTransport(Transport):
+    """Отправка в Bot API через общий пул соединений. base_url можно заменить на локальный сервер."""
+
+    def __init__(
+        self,
+        bot_token: str,
+        base_url: str = "https://api.telegram.org",
+        timeout: float = 10,
+        pool_size: int = 4
+    ) -> None:
+        self.bot_token = bot_token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def send(self, method: str, data: Dict[str, str], files: Optional[Dict[str, Tuple[str, bytes]]] = None) -> DeliveryResult:
+        try:
+            response = self.session.post(
+                f"{self.base_url}/bot{self.bot_token}/{method}",
+                data=data,
+                files=files,
+                timeout=self.timeout
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка отправки: {e}")
+            return DeliveryResult(ok=False)
+
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json().get("parameters", {}).get("retry_after", 1))
+            except ValueError:
+                retry_after = 1.0
+            return DeliveryResult(ok=False, retry_after=retry_after)
+
+        return DeliveryResult(ok=response.status_code == 200)
+
+
+@dataclass
+class RateLimiter:
+    """Ограничения Telegram: 1 сообщение в секунду и 20 в минуту на чат, 30 в секунду всего."""
+
+    per_chat_per_second: int = 1
+    per_chat_per_minute: int = 20
+    global_per_second: int = 30
+
+    _global: Deque[float] = field(default_factory=deque)
+    _chats: Dict[str, Deque[float]] = field(default_factory=dict)
+
+    @staticmethod
+    def _window_delay(timestamps: Deque[float], limit: int, window: float, now: float) -> float:
+        while timestamps and now - timestamps[0] >= window:
+            timestamps.popleft()
+        if len(timestamps) < limit:
+            return 0.0
+        return window - (now - timestamps[-limit])
+
+    def delay(self, chat_id: str) -> float:
+        now = time.monotonic()
+        chat = self._chats.setdefault(chat_id, deque())
+        return max(
+            self._window_delay(chat, self.per_chat_per_second, 1.0, now),
+            self._window_delay(chat, self.per_chat_per_minute, 60.0, now),
+            self._window_delay(self._global, self.global_per_second, 1.0, now),
+        )
+
+    def record(self, chat_id: str) -> None:
+        now = time.monotonic()
+        self._chats.setdefault(chat_id, deque()).append(now)
+        self._global.append(now)
+
+    def acquire(self, chat_id: str) -> float:
+        """0, если отправка разрешена и уже учтена, иначе сколько подождать."""
+        delay = self.delay(chat_id=chat_id)
+        if delay <= 0:
+            self.record(chat_id=chat_id)
+        return delay
+
+    def pause(self, chat_id: str, seconds: float) -> None:
+        # В одном процессе ожидание после 429 выполняет сам отправитель
+        pass
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Те же ограничения Telegram, общие для всех процессов устройств.
+
+    Отметки отправок хранятся в SQLite, проверка и запись выполняются в одной
+    транзакции BEGIN IMMEDIATE, поэтому два процесса не займут одно окно.
+    Ответ 429 одного процесса приостанавливает отправку в чат для всех.
+    """
+
+    def __init__(self, path: Path = Path("state/telegram_rate.sqlite3"), **limits: int) -> None:
+        super().__init__(**limits)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connections = {}
+        self._init_schema()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_connections"] = {}
+        return state
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        owner = (os.getpid(), threading.get_ident())
+        connection = self._connections.get(owner)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections[owner] = connection
+        return connection
+
+    def _init_schema(self) -> None:
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sends (
+                chat_id TEXT NOT NULL,
+                timestamp REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sends_chat ON sends (chat_id, timestamp);
+            CREATE INDEX IF NOT EXISTS sends_timestamp ON sends (timestamp);
+            CREATE TABLE IF NOT EXISTS pauses (
+                chat_id TEXT PRIMARY KEY,
+                until REAL NOT NULL
+            );
+            """
+        )
+
+    def _window_delay_shared(self, chat_id: Optional[str], limit: int, window: float, now: float) -> float:
+        # Время limit-й с конца отправки в окне определяет, когда освободится место
+        if chat_id is None:
+            row = self.connection.execute(
+                "SELECT timestamp FROM sends WHERE timestamp > ? ORDER BY timestamp DESC LIMIT 1 OFFSET ?",
+                (now - window, limit - 1)
+            ).fetchone()
+        else:
+            row = self.connection.execute(
+                "SELECT timestamp FROM sends WHERE chat_id = ? AND timestamp > ? "
+                "ORDER BY timestamp DESC LIMIT 1 OFFSET ?",
+                (chat_id, now - window, limit - 1)
+            ).fetchone()
+        return window - (now - row[0]) if row else 0.0
+
+    def _delay(self, chat_id: str, now: float) -> float:
+        row = self.connection.execute("SELECT until FROM pauses WHERE chat_id = ?", (chat_id,)).fetchone()
+        return max(
+            row[0] - now if row else 0.0,
+            self._window_delay_shared(chat_id, self.per_chat_per_second, 1.0, now),
+            self._window_delay_shared(chat_id, self.per_chat_per_minute, 60.0, now),
+            self._window_delay_shared(None, self.global_per_second, 1.0, now),
+        )
+
+    def delay(self, chat_id: str) -> float:
+        return self._delay(chat_id=chat_id, now=time.time())
+
+    def record(self, chat_id: str) -> None:
+        self.connection.execute("INSERT INTO sends (chat_id, timestamp) VALUES (?, ?)", (chat_id, time.time()))
+
+    def acquire(self, chat_id: str) -> float:
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            delay = self._delay(chat_id=chat_id, now=now)
+            if delay <= 0:
+                connection.execute("INSERT INTO sends (chat_id, timestamp) VALUES (?, ?)", (chat_id, now))
+                connection.execute("DELETE FROM sends WHERE timestamp < ?", (now - 60.0,))
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return delay
+
+    def pause(self, chat_id: str, seconds: float) -> None:
+        self.connection.execute(
+            "INSERT INTO pauses (chat_id, until) VALUES (?, ?) "
+            "ON CONFLICT (chat_id) DO UPDATE SET until = MAX(until, excluded.until)",
+            (chat_id, time.time() + seconds)
+        )
+
+
+class AlertService(threading.Thread):
+    """
+    Фоновая отправка оповещений.
+
+    Вызывающий поток только кладет сообщение в очередь. Повторы одной сигнатуры
+    в пределах coalesce_window не отправляются, их количество добавляется к
+    следующему сообщению с этой сигнатурой. Текстовые сообщения, накопившиеся
+    в очереди, объединяются в одно. Ограничения Telegram по умолчанию общие
+    для всех процессов (SharedRateLimiter).
+    """
+
+    max_text_length = 4096
+    _stop_signal = object()
+
+    def __init__(
+        self,
+        transport: Transport,
+        chat_id: str,
+        max_queue: int = 100,
+        coalesce_window: float = 600.0,
+        max_attempts: int = 3,
+        rate_limiter: Optional[RateLimiter] = None
+    ) -> None:
+        super().__init__(name="AlertService", daemon=True)
+        self.transport = transport
+        self.chat_id = chat_id
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._signatures: Dict[str, List[float]] = {}
+
+    def _open(self) -> None:
+        # Соединение SQLite открывается в потоке отправки, который им пользуется
+        if self.rate_limiter is None:
+            self.rate_limiter = SharedRateLimiter()
+
+    def register(self, signature: str) -> Tuple[bool, int]:
+        """Возвращает, нужно ли отправлять оповещение, и сколько повторов было подавлено."""
+        now = time.monotonic()
+        with self._lock:
+            first_seen, suppressed = self._signatures.get(signature, (None, 0))
+            if first_seen is not None and now - first_seen < self.coalesce_window:
+                self._signatures[signature] = [first_seen, suppressed + 1]
+                self.coalesced += 1
+                return False, 0
+
+            self._signatures[signature] = [now, 0]
+            return True, suppressed
+
+    def notify(self, alert: Alert, signature: Optional[str] = None) -> bool:
+        if signature is not None:
+            should_send, suppressed = self.register(signature=signature)
+            if not should_send:
+                return False
+            if suppressed:
+                alert.text += f"\n\nПовторов за прошлый период: {suppressed}"
+
+        try:
+            self._queue.put_nowait(alert)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        self._queue.put(self._stop_signal)
+        self.join(timeout=timeout)
+
+    def _deliver(self, method: str, data: Dict[str, str], files: Optional[Dict[str, Tuple[str, bytes]]] = None) -> None:
+        for _ in range(self.max_attempts):
+            while (delay := self.rate_limiter.acquire(chat_id=self.chat_id)) > 0:
+                time.sleep(delay)
+
+            result = self.transport.send(method=method, data=data, files=files)
+            if result.ok:
+                self.sent += 1
+                return
+            if not result.retry_after:
+                break
+            self.rate_limiter.pause(chat_id=self.chat_id, seconds=result.retry_after)
+            time.sleep(result.retry_after)
+
+        self.failed += 1
+
+    def _send(self, alert: Alert) -> None:
+        data = {"chat_id": self.chat_id}
+        if alert.photo is not None:
+            self._deliver(
+                method="sendPhoto",
+                data={**data, "caption": alert.text[:1024]},
+                files={"photo": ("screenshot.jpg", alert.photo)}
+            )
+        elif alert.text:
+            self._deliver(method="sendMessage", data={**data, "text": alert.text[:self.max_text_length]})
+
+        if alert.document is not None:
+            self._deliver(
+                method="sendDocument",
+                data=data,
+                files={"document": (alert.document_name, alert.document)}
+            )
+
+    def _drain_texts(self, alert: Alert) -> Tuple[Alert, Optional[object]]:
+        # Подряд идущие текстовые сообщения отправляются одним
+        text = alert.text
+        while True:
+            try:
+                following = self._queue.get_nowait()
+            except queue.Empty:
+                return Alert(text=text), None
+
+            if (
+                following is self._stop_signal
+                or following.photo is not None
+                or following.document is not None
+                or len(text) + len(following.text) + 2 > self.max_text_length
+            ):
+                return Alert(text=text), following
+            text += "\n\n" + following.text
+
+    def run(self) -> None:
+        self._open()
+
+        pending = None
+        while True:
+            alert = pending if pending is not None else self._queue.get()
+            pending = None
+            if alert is self._stop_signal:
+                return
+
+            if alert.photo is None and alert.document is None:
+                alert, pending = self._drain_texts(alert=alert)
+
+            try:
+                self._send(alert=alert)
+            except Exception as e:
+                self.failed += 1
+                print(f"Ошибка отправки: {e}")
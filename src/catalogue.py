@@ -0,0 +1,521 @@
+"""
+Каталог результатов.
+
+Записи о рекламе хранятся в SQLite (results/catalogue.sqlite3), изображения
+дописываются в большие файлы results/packs/*.pack. Каждый блок в пакете
+начинается с заголовка (метка, SHA-256, длина), поэтому индекс изображений
+восстанавливается сканированием пакетов.
+
+Запуск: python -m src.catalogue query --group-by domain
+"""
+import os
+import sys
+import csv
+import json
+import time
+import sqlite3
+import struct
+import argparse
+import threading
+
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass
+from urllib.parse import urlparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+PACK_MAGIC = b"ADPK"
+PACK_HEADER = struct.Struct("<4s32sI")
+
+GROUPS = {
+    "domain": "final_domain",
+    "video": "video_id",
+    "serial": "serial",
+    "url": "url",
+    "layout": "layout",
+}
+COLUMNS = ("id", "serial", "video_id", "timestamp", "url", "final_domain", "phash", "image", "layout", "position", "final_url")
+
+
+def url_domain(url: str) -> Optional[str]:
+    hostname = urlparse(url).hostname
+    if not hostname:
+        return None
+    return hostname.removeprefix("www.")
+
+
+@dataclass
+class CatalogueEntry:
+    serial: str
+    video_id: str
+    timestamp: float
+    url: str
+    phash: str
+    image: str
+    layout: Optional[str] = None
+    final_domain: Optional[str] = None
+    # Глубина в watch_list в высотах блока контента
+    position: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        if self.final_domain is None:
+            self.final_domain = url_domain(self.url)
+
+
+@dataclass
+class PositionEntry:
+    """Найденный рекламный блок, в том числе не сохраненный в ads (ссылка не получена, макет пропущен)."""
+
+    serial: str
+    video_id: str
+    timestamp: float
+    position: float
+    result: str
+    # Обход без остановки и пропуска блоков, позиция годится для гистограммы SwipePlanner
+    explored: bool = False
+
+
+@dataclass
+class PackedImage:
+    sha: str
+    pack: str
+    offset: int
+    length: int
+
+
+class PackWriter:
+    """
+    Дописывание изображений в пакет одного устройства.
+
+    Каждый запуск пишет в свой файл <serial>-<time_ns>.pack: оборванный при
+    аварии хвост остается в конце файла и не мешает следующему запуску.
+    """
+
+    def __init__(self, root: Path, prefix: str, max_size: int = 1 << 30) -> None:
+        self.root = Path(root)
+        self.prefix = prefix
+        self.max_size = max_size
+
+        self._file = None
+        self._name: Optional[str] = None
+        self._size = 0
+
+    def _open(self) -> None:
+        self.close()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._name = f"{self.prefix}-{time.time_ns()}.pack"
+        self._file = self.root.joinpath(self._name).open("ab")
+        self._size = 0
+
+    def append(self, sha: str, data: bytes) -> PackedImage:
+        if self._file is None or self._size >= self.max_size:
+            self._open()
+
+        self._file.write(PACK_HEADER.pack(PACK_MAGIC, bytes.fromhex(sha), len(data)))
+        offset = self._size + PACK_HEADER.size
+        self._file.write(data)
+        self._size = offset + len(data)
+        return PackedImage(sha=sha, pack=self._name, offset=offset, length=len(data))
+
+    def sync(self) -> None:
+        # Индекс записывается только после того, как байты изображений на диске
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def scan_pack(path: Path) -> Iterator[PackedImage]:
+    """Блоки пакета по заголовкам, сканирование останавливается на оборванном хвосте."""
+    size = path.stat().st_size
+    with path.open("rb") as file:
+        position = 0
+        while position + PACK_HEADER.size <= size:
+            file.seek(position)
+            magic, digest, length = PACK_HEADER.unpack(file.read(PACK_HEADER.size))
+            offset = position + PACK_HEADER.size
+            if magic != PACK_MAGIC or offset + length > size:
+                return
+            yield PackedImage(sha=digest.hex(), pack=path.name, offset=offset, length=length)
+            position = offset + length
+
+
+class Catalogue:
+    """Каталог результатов на SQLite, общий для всех процессов и потоков."""
+
+    def __init__(self, root: Path = Path("results")) -> None:
+        self.root = Path(root)
+        self.path = self.root.joinpath("catalogue.sqlite3")
+        self.packs_path = self.root.joinpath("packs")
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._connections = {}
+        self._init_schema()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_connections"] = {}
+        return state
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        owner = (os.getpid(), threading.get_ident())
+        connection = self._connections.get(owner)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections[owner] = connection
+        return connection
+
+    def _init_schema(self) -> None:
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS ads (
+                id INTEGER PRIMARY KEY,
+                serial TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                url TEXT NOT NULL,
+                final_domain TEXT,
+                phash TEXT NOT NULL,
+                image TEXT NOT NULL,
+                layout TEXT,
+                position REAL,
+                final_url TEXT
+            );
+            CREATE INDEX IF NOT EXISTS ads_url ON ads (url, phash);
+            CREATE INDEX IF NOT EXISTS ads_video ON ads (video_id, final_domain);
+            CREATE INDEX IF NOT EXISTS ads_domain ON ads (final_domain, video_id);
+            CREATE INDEX IF NOT EXISTS ads_timestamp ON ads (timestamp);
+
+            CREATE TABLE IF NOT EXISTS images (
+                sha TEXT PRIMARY KEY,
+                pack TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+        # Каталоги, созданные до появления новых колонок
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(ads)")}
+        for column, column_type in (("position", "REAL"), ("final_url", "TEXT")):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE ads ADD COLUMN {column} {column_type}")
+        self._init_positions()
+
+    def _init_positions(self) -> None:
+        # Таблица создается и заполняется в одной транзакции, чтобы процессы не перенесли позиции дважды
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            exists = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'positions'"
+            ).fetchone()
+            if not exists:
+                connection.execute(
+                    "CREATE TABLE positions (id INTEGER PRIMARY KEY, serial TEXT NOT NULL, video_id TEXT NOT NULL, "
+                    "timestamp REAL NOT NULL, position REAL NOT NULL, result TEXT NOT NULL, explored INTEGER)"
+                )
+                # Позиции, записанные до появления таблицы, были только у сохраненных реклам
+                connection.execute(
+                    "INSERT INTO positions (serial, video_id, timestamp, position, result) "
+                    "SELECT serial, video_id, timestamp, position, 'parsed' FROM ads WHERE position IS NOT NULL"
+                )
+            elif "explored" not in {row[1] for row in connection.execute("PRAGMA table_info(positions)")}:
+                # Для старых строк неизвестно, был ли обход полным
+                connection.execute("ALTER TABLE positions ADD COLUMN explored INTEGER")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def pack_writer(self, prefix: str, max_size: int = 1 << 30) -> PackWriter:
+        return PackWriter(root=self.packs_path, prefix=prefix, max_size=max_size)
+
+    def has_image(self, sha: str) -> bool:
+        cursor = self.connection.execute("SELECT 1 FROM images WHERE sha = ?", (sha,))
+        return cursor.fetchone() is not None
+
+    def sightings(self, url: str) -> List[Tuple[str, str, str]]:
+        """(phash, изображение, video_id) всех показов рекламы с этим URL."""
+        cursor = self.connection.execute("SELECT phash, image, video_id FROM ads WHERE url = ?", (url,))
+        return cursor.fetchall()
+
+    def add(
+        self,
+        entries: Sequence[CatalogueEntry],
+        images: Sequence[PackedImage] = (),
+        positions: Sequence[PositionEntry] = ()
+    ) -> None:
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT INTO positions (serial, video_id, timestamp, position, result, explored) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (entry.serial, entry.video_id, entry.timestamp, entry.position, entry.result, int(entry.explored))
+                    for entry in positions
+                )
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO images (sha, pack, offset, length) VALUES (?, ?, ?, ?)",
+                ((image.sha, image.pack, image.offset, image.length) for image in images)
+            )
+            connection.executemany(
+                "INSERT INTO ads (serial, video_id, timestamp, url, final_domain, phash, image, layout, position) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        entry.serial, entry.video_id, entry.timestamp, entry.url,
+                        entry.final_domain, entry.phash, entry.image, entry.layout, entry.position
+                    )
+                    for entry in entries
+                )
+            )
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def set_final_url(self, url: str, final_url: Optional[str], final_domain: Optional[str]) -> None:
+        """final_url None оставляет ссылку неразрешенной, меняется только домен."""
+        self.connection.execute(
+            "UPDATE ads SET final_url = ?, final_domain = COALESCE(?, final_domain) WHERE url = ?",
+            (final_url, final_domain, url)
+        )
+
+    def read_image(self, sha: str) -> bytes:
+        row = self.connection.execute(
+            "SELECT pack, offset, length FROM images WHERE sha = ?", (sha,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"Изображение {sha} не найдено в каталоге")
+
+        pack, offset, length = row
+        with self.packs_path.joinpath(pack).open("rb") as file:
+            file.seek(offset - PACK_HEADER.size)
+            magic, digest, stored_length = PACK_HEADER.unpack(file.read(PACK_HEADER.size))
+            if magic != PACK_MAGIC or digest.hex() != sha or stored_length != length:
+                raise ValueError(f"Поврежден блок {sha} в пакете {pack}")
+            return file.read(length)
+
+    def rebuild_images(self) -> int:
+        """Восстанавливает индекс изображений по заголовкам блоков во всех пакетах."""
+        images = [image for path in sorted(self.packs_path.glob("*.pack")) for image in scan_pack(path)]
+        before = self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        self.add(entries=(), images=images)
+        return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0] - before
+
+    def import_legacy(self, root: Path) -> int:
+        """
+        Переносит записи results/index/*.jsonl, позиции results/positions/*.jsonl
+        и изображения results/images в каталог. Тот же формат у results/fallback.
+        """
+        root = Path(root)
+        imported = 0
+        pack_writer = self.pack_writer(prefix="legacy")
+        try:
+            for index_path in sorted(root.joinpath("index").glob("*.jsonl")):
+                entries, images, packed = [], [], set()
+                with index_path.open("r", encoding="utf-8") as file:
+                    for line in file:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+
+                        # Повторный перенос не дублирует записи
+                        if self.connection.execute(
+                            "SELECT 1 FROM ads WHERE url = ? AND phash = ? AND timestamp = ?",
+                            (entry["url"], entry["phash"], entry["timestamp"])
+                        ).fetchone():
+                            continue
+
+                        sha = Path(entry["image"]).stem
+                        if sha not in packed and not self.has_image(sha):
+                            data = root.joinpath(entry["image"]).read_bytes()
+                            images.append(pack_writer.append(sha=sha, data=data))
+                            packed.add(sha)
+                        entries.append(CatalogueEntry(
+                            serial=entry["serial"], video_id=entry["video_id"], timestamp=entry["timestamp"],
+                            url=entry["url"], phash=entry["phash"], image=sha,
+                            layout=entry.get("layout"), position=entry.get("position")
+                        ))
+                pack_writer.sync()
+                self.add(entries=entries, images=images)
+                imported += len(entries)
+
+            for positions_path in sorted(root.joinpath("positions").glob("*.jsonl")):
+                positions = []
+                with positions_path.open("r", encoding="utf-8") as file:
+                    for line in file:
+                        try:
+                            position = PositionEntry(**json.loads(line))
+                        except (json.JSONDecodeError, TypeError):
+                            continue
+
+                        if self.connection.execute(
+                            "SELECT 1 FROM positions WHERE serial = ? AND video_id = ? AND timestamp = ?",
+                            (position.serial, position.video_id, position.timestamp)
+                        ).fetchone():
+                            continue
+                        positions.append(position)
+                self.add(entries=(), positions=positions)
+        finally:
+            pack_writer.close()
+        return imported
+
+    @staticmethod
+    def _where(filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for column in ("serial", "video_id", "final_domain", "layout"):
+            if filters.get(column) is not None:
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        if filters.get("url") is not None:
+            clauses.append("url LIKE ?")
+            params.append(f"%{filters['url']}%")
+        if filters.get("since") is not None:
+            clauses.append("timestamp >= ?")
+            params.append(filters["since"])
+        if filters.get("until") is not None:
+            clauses.append("timestamp < ?")
+            params.append(filters["until"])
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def iter_ads(self, limit: Optional[int] = None, **filters: Any) -> Iterator[Dict[str, Any]]:
+        where, params = self._where(filters)
+        query = f"SELECT {', '.join(COLUMNS)} FROM ads {where} ORDER BY id"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        cursor = self.connection.execute(query, params)
+        while rows := cursor.fetchmany(1000):
+            for row in rows:
+                yield dict(zip(COLUMNS, row))
+
+    def group(self, by: str, limit: Optional[int] = None, **filters: Any) -> List[Tuple[Any, int, int]]:
+        """Количество реклам и различных видео (для группы video - доменов) по ключу группы."""
+        column = GROUPS[by]
+        distinct = "final_domain" if column == "video_id" else "video_id"
+        where, params = self._where(filters)
+        query = (
+            f"SELECT {column}, COUNT(*), COUNT(DISTINCT {distinct}) FROM ads {where} "
+            f"GROUP BY {column} ORDER BY COUNT(*) DESC"
+        )
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return self.connection.execute(query, params).fetchall()
+
+
+def parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Каталог результатов")
+    parser.add_argument("--root", type=Path, default=Path("results"), help="Папка результатов")
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument("--serial", help="Устройство")
+    filters.add_argument("--video", dest="video_id", help="video_id")
+    filters.add_argument("--domain", dest="final_domain", help="Конечный домен рекламы")
+    filters.add_argument("--url", help="Подстрока URL рекламы")
+    filters.add_argument("--layout", help="Сигнатура макета")
+    filters.add_argument("--since", type=parse_time, help="Начало периода: unix time или ISO дата")
+    filters.add_argument("--until", type=parse_time, help="Конец периода: unix time или ISO дата")
+    filters.add_argument("--limit", type=int, help="Максимум строк")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = commands.add_parser("query", parents=[filters], help="Записи или сводка по группам")
+    query_parser.add_argument("--group-by", choices=GROUPS, help="Сгруппировать по ключу")
+
+    export_parser = commands.add_parser("export", parents=[filters], help="Выгрузка записей в файл")
+    export_parser.add_argument("output", type=Path, help="Файл выгрузки, - для stdout")
+    export_parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    export_parser.add_argument("--images", type=Path, help="Папка для изображений выгруженных записей")
+
+    image_parser = commands.add_parser("image", help="Извлечь изображение по SHA-256")
+    image_parser.add_argument("sha")
+    image_parser.add_argument("output", type=Path)
+
+    commands.add_parser("rebuild", help="Восстановить индекс изображений по пакетам")
+
+    import_parser = commands.add_parser("import", help="Перенести results/index, results/images или results/fallback в каталог")
+    import_parser.add_argument("source", type=Path, nargs="?", help="Папка старых результатов, по умолчанию --root")
+    return parser.parse_args()
+
+
+def export(catalogue: Catalogue, rows: Iterable[Dict[str, Any]], file, format: str, images: Optional[Path]) -> int:
+    writer = None
+    if format == "csv":
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+
+    count = 0
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+        if images:
+            image_path = images.joinpath(f"{row['image']}.png")
+            if not image_path.exists():
+                image_path.write_bytes(catalogue.read_image(sha=row["image"]))
+        count += 1
+    return count
+
+
+def main() -> None:
+    args = parse_args()
+    catalogue = Catalogue(root=args.root)
+    filters = {
+        name: getattr(args, name, None)
+        for name in ("serial", "video_id", "final_domain", "url", "layout", "since", "until")
+    }
+
+    if args.command == "query":
+        if args.group_by:
+            for key, count, distinct in catalogue.group(by=args.group_by, limit=args.limit, **filters):
+                print(f"{key}\t{count}\t{distinct}")
+        else:
+            for row in catalogue.iter_ads(limit=args.limit, **filters):
+                print("\t".join(str(row[column]) for column in COLUMNS))
+
+    elif args.command == "export":
+        if args.images:
+            args.images.mkdir(parents=True, exist_ok=True)
+        rows = catalogue.iter_ads(limit=args.limit, **filters)
+        if str(args.output) == "-":
+            count = export(catalogue, rows, sys.stdout, args.format, args.images)
+        else:
+            with args.output.open("w", encoding="utf-8", newline="") as file:
+                count = export(catalogue, rows, file, args.format, args.images)
+        print(f"Выгружено записей: {count}", file=sys.stderr)
+
+    elif args.command == "image":
+        try:
+            args.output.write_bytes(catalogue.read_image(sha=args.sha))
+        except KeyError as e:
+            print(e)
+            sys.exit(1)
+
+    elif args.command == "rebuild":
+        print(f"Добавлено в индекс изображений: {catalogue.rebuild_images()}")
+
+    elif args.command == "import":
+        print(f"Перенесено записей: {catalogue.import_legacy(root=args.source or args.root)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 
 import math
 import time
-import requests
 import numpy as np
 
 from io import BytesIO
@@ -10,9 +9,27 @@ from PIL import Image, ImageChops
 from dataclasses import dataclass
 from PIL.Image import Image as PILImage
 from typing import List, Tuple, Optional
-from urllib.parse import parse_qs, urlparse
 from uiautomator2 import Device, UiObject, UiObjectNotFoundError
 
+from src.link_queue import LinkQueue, LinkTask
+from src.crawl_state import CrawlState, get_video_id
+from src.ad_history import AdHistory, TriageAction, TriageDecision, page_signals, triage
+from src.hierarchy import HierarchySnapshot
+from src.waits import Waiter
+from src.scroll_detector import ScrollEndDetector, ScrollSignature
+from src.frames import FrameCache
+from src.images import compose_vertically, to_image
+from src.result_writer import AdRecord, ResultWriter
+from src.catalogue import Catalogue, PositionEntry
+from src.swipe_planner import SwipePlanner
+from src.url_resolver import UrlResolver
+from src.ad_index import AdIndex
+from src.metrics import InstrumentedDevice, Metrics, timed
+from src.alerts import Alert, AlertService, TelegramTransport
+from src.intent_url import IntentUrlResolver
+from src.layouts import Layout, LayoutClassifier, LayoutStrategy
+from src.supervisor import WorkerHeartbeat
+from src.timing import TimingTuner
 from src.node_selectors import AdNodesSelectors, ClassNodesSelectors
 from src.nodes import (
     AdNodes, 
@@ -20,7 +37,8 @@ from src.nodes import (
     ClassNodes, 
     PlayerNodes, 
     ChromeNodes, 
-    ContentNodes
+    ContentNodes,
+    NodeRegistry
 )
 
 
@@ -34,6 +52,9 @@ class Coords:
 class AdInfo:
     url: str
     image: PILImage
+    layout: Optional[str] = None
+    position: Optional[float] = None
+    known: bool = False
 
 
 class YoutubeApp:
@@ -67,20 +88,44 @@ class MobileSettings:
 
 
 class YoutubeParser:
-    def __init__(self, device: Device) -> None:
-        self.device = device
+    def __init__(
+        self,
+        device: Device,
+        crawl_state: Optional[CrawlState] = None,
+        ad_history: Optional[AdHistory] = None,
+        telegram_bot_api: Optional[str] = None,
+        telegram_chat_id: Optional[str] = None,
+        heartbeat: Optional[WorkerHeartbeat] = None
+    ) -> None:
+        self.metrics = Metrics(serial=device.serial)
+        self.device = InstrumentedDevice(device=device, metrics=self.metrics)
+        self.crawl_state = crawl_state
+        self.ad_history = ad_history
+        self.heartbeat = heartbeat
         
         self.offset = 25
         self.max_swipe_count = 9
+        # Короткий обход видео, где по истории рекламы мало
+        self.quick_swipe_count = 3
+        self.quick_ad_wait_timeout = 1.5
         
         self.ad_wait_timeout = 5
+        # Без признаков рекламы в плеере панель ждется не дольше, чем страница остается неподвижной
+        self.ad_grace_timeout = 1.0
         self.action_timeout = 0.25
         self.video_load_timeout = 1
+        # Дедлайн загрузки видео не подстраивается: короткие ожидания успокоения экрана о нем ничего не говорят
+        self.video_load_deadline = 10
         self.player_hide_timeout = 5
         self.node_spawn_timeout = 2.5
+        self.intent_url_timeout = 1.5
         
-        self.telegram_chat_id = None
-        self.telegram_bot_api = None
+        # "intent" читает ссылку из VIEW интента и переходит к Chrome только при неудаче
+        self.ad_url_mode = "intent"
+        self.max_intent_url_failures = 5
+        
+        self.telegram_chat_id = telegram_chat_id
+        self.telegram_bot_api = telegram_bot_api
         
         self.hidden_ad_duration = 0.1
         self.next_content_swipe_duration = 0.5
@@ -89,17 +134,58 @@ class YoutubeParser:
         
         self.app = YoutubeApp(device=self.device)
         self.mobile = MobileSettings(device=self.device)
+        self.snapshot = HierarchySnapshot(device=self.device)
+        self.timing = TimingTuner(serial=self.device.serial, metrics=self.metrics)
+        self.timing.apply(self)
+        self.waiter = Waiter(snapshot=self.snapshot, metrics=self.metrics, tuner=self.timing)
+        self.scroll_detector = ScrollEndDetector(mode="pixels", threshold=70)
+        self.frames = FrameCache(device=self.device, snapshot=self.snapshot, capture_format="jpeg")
+        self.result_writer = ResultWriter(serial=self.device.serial, root=Path("results"), resolver=UrlResolver())
+        self.ad_index = AdIndex(serial=self.device.serial)
+        self.intent_url_resolver = IntentUrlResolver(device=self.device)
+        self.layout_classifier = LayoutClassifier(serial=self.device.serial)
+        self.swipe_planner = SwipePlanner(catalogue=Catalogue(root=Path("results")))
+        
+        self.alerts = None
+        if self.telegram_bot_api and self.telegram_chat_id:
+            self.alerts = AlertService(
+                transport=TelegramTransport(bot_token=self.telegram_bot_api),
+                chat_id=self.telegram_chat_id
+            )
+        
+        self.swipe_total = 0
+        self.ad_block_total = 0
+        
+        self._link_started = 0.0
+        self._link_ads = 0
+        self._link_channel = None
+        self._intent_url_failures = 0
+        self._intent_url_resolved = False
         
         self._init_nodes()
         self.mobile.notification_disable()
 
     def _init_nodes(self) -> None:
-        self.ad_nodes = AdNodes(device=self.device)
-        self.main_nodes = MainNodes(device=self.device)
-        self.class_nodes = ClassNodes(device=self.device)
-        self.chrome_nodes = ChromeNodes(device=self.device)
-        self.player_nodes = PlayerNodes(device=self.device)
-        self.content_nodes = ContentNodes(device=self.device)
+        # Группы разделяют один реестр, общие узлы вроде main_node создаются один раз
+        self.node_registry = NodeRegistry(device=self.snapshot)
+        self.ad_nodes = AdNodes(device=self.snapshot, registry=self.node_registry)
+        self.main_nodes = MainNodes(device=self.snapshot, registry=self.node_registry)
+        self.class_nodes = ClassNodes(device=self.snapshot, registry=self.node_registry)
+        self.chrome_nodes = ChromeNodes(device=self.snapshot, registry=self.node_registry)
+        self.player_nodes = PlayerNodes(device=self.snapshot, registry=self.node_registry)
+        self.content_nodes = ContentNodes(device=self.snapshot, registry=self.node_registry)
+
+    # Любое действие с экраном делает снимок иерархии неактуальным
+    def _click(self, x: int, y: int) -> None:
+        self.snapshot.click(x, y)
+
+    def _press(self, key: str) -> None:
+        self.device.press(key)
+        self.snapshot.invalidate()
+
+    def _swipe_points(self, points: List[Tuple[int, int]], duration: float) -> None:
+        self.device.swipe_points(points=points, duration=duration)
+        self.snapshot.invalidate()
         
     @staticmethod
     def combine_images_vertically(
@@ -148,27 +234,33 @@ class YoutubeParser:
         
         return round(similarity_percent, 2)
 
-    def wait_load_video(self, max_attempts: int = 10) -> bool:
-        for attempt in range(1, max_attempts + 1):
-            if self.class_nodes.relative_layouts.count == 0:
-                time.sleep(self.video_load_timeout)
-                return True
-            
-            if attempt < max_attempts:
-                time.sleep(self.video_load_timeout)
+    @timed("wait_load_video")
+    def wait_load_video(self) -> bool:
+        is_video_loaded = self.waiter.until(
+            lambda: self.class_nodes.relative_layouts.count == 0,
+            timeout=self.video_load_deadline,
+            name="load_video"
+        )
+        if is_video_loaded:
+            self.waiter.hierarchy_stable(timeout=self.video_load_timeout, name="video_settle")
         
-        return False
+        return is_video_loaded
         
+    @timed("stop_video")
     def stop_video(self) -> bool:
         try:
             if self.player_nodes.control_button.exists:
                 if self.player_nodes.control_button.info["contentDescription"] == "Play video":
                     return True
-                self.player_nodes.control_button.wait_gone(timeout=self.player_hide_timeout)
-                time.sleep(self.action_timeout)
+                self.waiter.node_gone(
+                    self.player_nodes.control_button, timeout=self.player_hide_timeout, name="player_hide"
+                )
+                self.waiter.hierarchy_stable(timeout=self.action_timeout, name="player_hide_settle")
                 
             self.main_nodes.video_player_node.click()
-            if self.player_nodes.control_button.wait(timeout=self.action_timeout):
+            if self.waiter.node_appeared(
+                self.player_nodes.control_button, timeout=self.action_timeout, name="player_controls"
+            ):
                 self.player_nodes.control_button.click()
                 return True
         
@@ -186,28 +278,27 @@ class YoutubeParser:
             bounds=self.main_nodes.main_node.bounds(), 
             center=self.main_nodes.main_node.center()
         )
-        self.device.swipe_points(
+        self._swipe_points(
             points=[
                 (drag_button_coords.center[0], drag_button_coords.bounds[3] + self.offset),
                 (drag_button_coords.center[0], main_node_coords.bounds[3] - self.offset)
             ],
             duration=self.hidden_ad_duration
         )
-        time.sleep(self.action_timeout)
         
-        return not self.ad_nodes.drag_handle_button.exists
+        return self.waiter.node_gone(
+            self.ad_nodes.drag_handle_button, timeout=self.action_timeout, name="hide_ad_panel"
+        )
     
     def _handle_close_button_case(self) -> bool:
         button = self.ad_nodes.header_panel_node.child(**AdNodesSelectors.close_ad_button)
         if button.exists and button.click_exists(timeout=1):
-            time.sleep(self.action_timeout)
-            return not button.exists
+            return self.waiter.node_gone(button, timeout=self.action_timeout, name="close_ad_panel")
 
         buttons = self.ad_nodes.header_panel_node.child(**ClassNodesSelectors.image_view)
         if buttons.count > 0 and buttons[-1].click_exists(timeout=1):
-            time.sleep(self.action_timeout)
             try:
-                return not buttons[-1].exists
+                return self.waiter.node_gone(buttons[-1], timeout=self.action_timeout, name="close_ad_panel")
             except:
                 return True
         
@@ -222,9 +313,31 @@ class YoutubeParser:
         
         return self._handle_close_button_case()
     
-    def preparing_video(self) -> bool:
-        if not self._handle_close_ad():
-            time.sleep(self.ad_wait_timeout)
+    @timed("preparing_video")
+    def preparing_video(self, timeout: Optional[float] = None, expect_panel: bool = False) -> bool:
+        # Рекламная панель может появиться не сразу, закрытие повторяется до дедлайна
+        timeout = timeout or self.ad_wait_timeout
+        grace = timeout if expect_panel else min(self.ad_grace_timeout, timeout)
+        # ad_wait_timeout учится только на ожиданиях полной длины: укороченные ожидания
+        # отбрасывают поздние панели, и оценка сползала бы к нижней границе
+        full_wait = expect_panel and timeout >= self.ad_wait_timeout
+        closed = self.waiter.until(
+            self._handle_close_ad, timeout=grace, name="close_ad" if full_wait else "close_ad_short"
+        )
+        
+        # Панель не пришла за grace: ожидание продолжается, только пока страница меняется
+        if not closed and timeout > grace:
+            previous: List[Optional[str]] = [None]
+            
+            def closed_or_settled() -> bool:
+                if self._handle_close_ad():
+                    return True
+                fingerprint = self.waiter.hierarchy_fingerprint()
+                settled = fingerprint == previous[0] and self.content_nodes.watch_list_node.exists
+                previous[0] = fingerprint
+                return settled
+            
+            self.waiter.until(closed_or_settled, timeout=timeout - grace, name="ad_panel_settle")
         
         if not self._handle_close_ad():
             if self.ad_nodes.header_panel_node.exists:
@@ -253,39 +366,59 @@ class YoutubeParser:
             )
         return watch_list_node_coords
         
-    def swipe_to_next_content(self) -> None:
-        coords = self._get_content_block_coords()
+    # Методы прокрутки возвращают пройденное расстояние в высотах блока контента
+    @timed("swipe")
+    def swipe_to_next_content(self, coords: Optional[Coords] = None) -> float:
+        coords = coords or self._get_content_block_coords()
         
-        self.device.swipe_points(
+        self._swipe_points(
             points=[
                 (coords.center[0], coords.bounds[3] - self.offset),
                 (coords.center[0], coords.bounds[1] + self.offset)
             ],
             duration=self.next_content_swipe_duration
         )
+        self.swipe_total += 1
+        return (coords.bounds[3] - coords.bounds[1] - 2 * self.offset) / max(1, coords.bounds[3] - coords.bounds[1])
         
-    def swipe_half_content(self) -> None:
+    @timed("swipe_half")
+    def swipe_half_content(self) -> float:
         coords = self._get_content_block_coords()
         distance = (coords.bounds[3] - coords.bounds[1]) // 2
         
-        self.device.swipe_points(
+        self._swipe_points(
             points=[
                 (coords.center[0], coords.bounds[3] - self.offset),
                 (coords.center[0], coords.bounds[3] - self.offset - distance)
             ],
             duration=self.half_content_swipe_duration
         )
+        self.swipe_total += 1
+        return distance / max(1, coords.bounds[3] - coords.bounds[1])
         
-    def reposition_content(self, first_point: int, second_point: int) -> None:
+    @timed("reposition")
+    def reposition_content(self, first_point: int, second_point: int) -> float:
         coords = self._get_content_block_coords()
 
-        self.device.swipe_points(
+        self._swipe_points(
             points=[
                 (coords.center[0], first_point),
                 (coords.center[0], second_point)
             ],
             duration=self.reposition_content_swipe_duration
         )
+        self.swipe_total += 1
+        return (first_point - second_point) / max(1, coords.bounds[3] - coords.bounds[1])
+
+    @timed("scroll_check")
+    def _get_scroll_signature(self) -> ScrollSignature:
+        if self.scroll_detector.mode == "hierarchy":
+            return self.scroll_detector.hierarchy_signature(
+                elements=self.content_nodes.watch_list_node.child().elements()
+            )
+        
+        coords = self._get_content_block_coords()
+        return self.scroll_detector.frame_signature(frame=self.frames.crop(box=coords.bounds))
 
     def _get_children_nodes(self, node: UiObject) -> List[Optional[UiObject]]:
         childrens = []
@@ -295,57 +428,119 @@ class YoutubeParser:
             
         return childrens
     
-    def get_node_screenshot(self, left: int, top: int, right: int, bottom: int) -> PILImage:
+    @timed("screenshot_crop")
+    def get_node_screenshot(self, left: int, top: int, right: int, bottom: int) -> np.ndarray:
         coords = self._get_content_block_coords()
         
         if coords.bounds[1] >= top:
-            return self.device.screenshot().crop(
-                box=(left, coords.bounds[1], right, bottom)
-            )
-        return self.device.screenshot().crop(
-            box=(left, top, right, bottom)
-        )
+            return self.frames.crop_array(box=(left, coords.bounds[1], right, bottom))
+        return self.frames.crop_array(box=(left, top, right, bottom))
     
-    def get_ad_url(self, point: Tuple[int, int]) -> str:
-        self.device.click(*point)
-        time.sleep(self.action_timeout)
+    def _get_ad_url_from_intent(self) -> Optional[str]:
+        url = None
+
+        def resolved() -> bool:
+            nonlocal url
+            url = self.intent_url_resolver.poll()
+            return url is not None
+
+        if not self.waiter.until(resolved, timeout=self.intent_url_timeout, name="intent_url"):
+            return None
         
+        # Назад нажимается только после открытия Chrome, иначе закроется само видео
+        self.waiter.node_appeared(
+            self.chrome_nodes.tool_bar_node, timeout=self.node_spawn_timeout, name="chrome_open"
+        )
+        self._press("back")
+        self.waiter.node_appeared(
+            self.content_nodes.watch_list_node, timeout=self.action_timeout, name="return_to_youtube"
+        )
+        return url
+    
+    def _get_ad_url_from_chrome(self) -> str:
         self.chrome_nodes.action_button.click(timeout=self.node_spawn_timeout)
-        time.sleep(self.action_timeout)
-        
         url = self.chrome_nodes.content_preview_text.get_text(timeout=self.node_spawn_timeout)
         
-        self.device.press("back")
-        time.sleep(self.action_timeout)
-        self.device.press("back")
-        time.sleep(self.action_timeout)
+        self._press("back")
+        self.waiter.node_gone(
+            self.chrome_nodes.content_preview_text, timeout=self.action_timeout, name="close_share_sheet"
+        )
+        self._press("back")
+        self.waiter.node_appeared(
+            self.content_nodes.watch_list_node, timeout=self.action_timeout, name="return_to_youtube"
+        )
         
         return url
+    
+    def _update_intent_url_mode(self, resolved: bool) -> None:
+        if resolved:
+            self._intent_url_resolved = True
+            self._intent_url_failures = 0
+            return
+        
+        # Если система скрывает ссылки в логах, ожидание интента только замедляет каждую рекламу
+        self._intent_url_failures += 1
+        if not self._intent_url_resolved and self._intent_url_failures >= self.max_intent_url_failures:
+            print(f"[INFO] [{self.device.serial}] Ссылки из интентов недоступны, используется Chrome")
+            self.ad_url_mode = "chrome"
+    
+    @timed("get_ad_url")
+    def get_ad_url(self, point: Tuple[int, int]) -> str:
+        start = time.perf_counter()
+        url = None
+        
+        if self.ad_url_mode == "intent":
+            self.intent_url_resolver.mark()
+        self._click(*point)
+        
+        if self.ad_url_mode == "intent":
+            url = self._get_ad_url_from_intent()
+            self._update_intent_url_mode(resolved=url is not None)
+        path = "intent" if url else "chrome"
+        if url is None:
+            url = self._get_ad_url_from_chrome()
+        
+        duration = time.perf_counter() - start
+        self.metrics.observe("ad_url_seconds", duration, path=path)
+        self.metrics.event("ad_url", path=path, duration=round(duration, 3))
+        return url
         
+    @timed("back_to_watch_list")
     def back_to_watch_list(self, max_attempts: int = 5) -> None:
         for _ in range(max_attempts):
             if self.content_nodes.watch_list_node.exists:
                 break
             else:
-                self.device.press("back")
-                time.sleep(self.video_load_timeout)
+                self._press("back")
+                self.waiter.node_appeared(
+                    self.content_nodes.watch_list_node, timeout=self.video_load_timeout, name="back_to_watch_list"
+                )
 
+    @timed("parse_ad")
     def parse_ad(self) -> AdInfo:
-        view_count = self.content_nodes.ad_block_node.child(**ClassNodesSelectors.view_group).count
-        image_count = self.content_nodes.ad_block_node.child(**ClassNodesSelectors.image_view).count
-        
-        print(f"[INFO] [{self.device.serial}] {view_count=} | {image_count=}")
-        
-        match (view_count, image_count):
-            case (8, 4) | (7, 4) | (8, 3) | (7, 3) | (18, 8) | (18, 7) | (18, 9) | (17, 8):
-                ...
-            case (v, i) if (v <= 2 and i <= 3): 
-                return None
-            case (8, 5):
-                return None
-            case _:
-                self.send_telegram_message()
-                return None
+        ad_block_elements = self.content_nodes.ad_block_node.elements()
+        if not ad_block_elements:
+            return None
+        
+        # Макет определяется по форме поддерева из того же снимка, без отдельных запросов
+        layout = self.layout_classifier.classify(element=ad_block_elements[0])
+        
+        print(
+            f"[INFO] [{self.device.serial}] view_count={layout.view_count} | "
+            f"image_count={layout.image_count} | signature={layout.signature}"
+        )
+        
+        if layout.strategy == LayoutStrategy.skip:
+            self.metrics.increment("ads_total", result="skipped_layout")
+            return None
+        if layout.strategy == LayoutStrategy.unknown:
+            self.metrics.increment("ads_total", result="unknown_layout")
+            self.metrics.event(
+                "unknown_layout", signature=layout.signature, cluster=layout.cluster,
+                view_count=layout.view_count, image_count=layout.image_count
+            )
+            self.send_telegram_message(layout=layout)
+            return None
         
         ad_block_node_children = self._get_children_nodes(node=self.content_nodes.ad_block_node)
         ad_block_node_coords = self.content_nodes.ad_block_node.bounds()
@@ -363,61 +558,83 @@ class YoutubeParser:
             center=self.content_nodes.watch_list_node.center()
         )
         
-        self.reposition_content(
-            first_point=ad_block_image_coords.bounds[3], 
-            second_point=watch_list_coords.bounds[3]
-        )
-        time.sleep(self.action_timeout)
+        # Если изображение уже видно целиком, оно вырезается из того же кадра без повторного свайпа
+        if ad_block_image_coords.bounds[1] <= self._get_content_block_coords().bounds[1]:
+            self.reposition_content(
+                first_point=ad_block_image_coords.bounds[3], 
+                second_point=watch_list_coords.bounds[3]
+            )
+            self.waiter.hierarchy_stable(timeout=self.action_timeout, name="reposition")
+            ad_block_node_children = self._get_children_nodes(node=self.content_nodes.ad_block_node)
                 
-        ad_block_node_children = self._get_children_nodes(node=self.content_nodes.ad_block_node)
         ad_image_block_coords = ad_block_node_children[0].bounds()
         ad_image = self.get_node_screenshot(*ad_image_block_coords)
+        # Вырезки - представления над кадрами, карточка собирается одной копией
+        image = to_image(compose_vertically(top=ad_image, bottom=ad_text))
+        
+        # Уже встреченный креатив сохраняется с известной ссылкой без дорогого получения ссылки
+        ad_hash = self.ad_index.key(to_image(ad_image))
+        known_url = self.ad_index.lookup(phash=ad_hash)
+        if known_url is not None:
+            print(f"[INFO] [{self.device.serial}] Реклама уже встречалась: {known_url}")
+            self.metrics.increment("ads_total", result="known")
+            return AdInfo(url=known_url, image=image, layout=layout.signature, known=True)
         
         try:
             ad_url = self.get_ad_url(point=ad_block_node_children[0].center())
         except Exception as e:
             print(f"[ERROR] [{self.device.serial}] {e}")
+            self.metrics.increment("ads_total", result="url_failed")
+            self.metrics.event("ad_url_failed", error=str(e))
             self.back_to_watch_list()
             return None
         
-        image = self.combine_images_vertically(top_img=ad_image, bottom_img=ad_text)
+        self.ad_index.add(phash=ad_hash, url=ad_url)
+        self.metrics.increment("ads_total", result="parsed")
+        self.metrics.event("ad_parsed", url=ad_url, signature=layout.signature)
 
         return AdInfo(
             url=ad_url,
-            image=image
+            image=image,
+            layout=layout.signature
         )
         
-    # Переделать
-    def save_ad_info(self, ad_info: AdInfo) -> None:
-        results_folder_path = Path("results")
-        phone_folder_path = results_folder_path.joinpath(self.device.serial)
-        
-        unique_name = str(int(time.time()))
-        
-        ad_folder_path = phone_folder_path.joinpath(unique_name)
-        ad_folder_path.mkdir(exist_ok=True, parents=True)
-        
-        info_path = ad_folder_path.joinpath("info.txt")
-        image_path = ad_folder_path.joinpath("image.png")
+    @timed("save_ad_info")
+    def save_ad_info(self, ad_info: AdInfo, video_id: str) -> None:
+        self.result_writer.submit(
+            record=AdRecord(
+                serial=self.device.serial,
+                video_id=video_id,
+                url=ad_info.url,
+                image=ad_info.image,
+                timestamp=time.time(),
+                layout=ad_info.layout,
+                position=ad_info.position
+            )
+        )
         
-        with info_path.open('w') as file:
-            file.write(ad_info.url)
-            
-        ad_info.image.save(image_path)
+    @timed("send_telegram_message")
+    def send_telegram_message(self, layout: Layout) -> None:
+        if self.alerts is None:
+            return
         
-    def send_telegram_message(self) -> None:
         try:
+            # Похожие неизвестные макеты отправляются не чаще раза за окно объединения
+            should_send, suppressed = self.alerts.register(signature=f"layout:{layout.cluster}")
+            if not should_send:
+                return
+            
             ad_block_node_children = self._get_children_nodes(node=self.content_nodes.ad_block_node)
-            view_count = self.content_nodes.ad_block_node.child(**ClassNodesSelectors.view_group).count
-            image_count = self.content_nodes.ad_block_node.child(**ClassNodesSelectors.image_view).count
             coords = self._get_content_block_coords()
-            image = self.device.screenshot().crop(box=coords.bounds)
-            dump = self.device.dump_hierarchy()
+            image = self.frames.crop(box=coords.bounds)
+            dump = self.snapshot.xml
 
             message_text = (
                 "📊 Анализ рекламного блока:\n"
-                f"• ViewGroup: {view_count}\n"
-                f"• ImageView: {image_count}\n\n"
+                f"• ViewGroup: {layout.view_count}\n"
+                f"• ImageView: {layout.image_count}\n"
+                f"• Сигнатура: {layout.signature}\n"
+                f"• Кластер: {layout.cluster}\n\n"
                 "🔍 Дочерние элементы:\n"
             )
 
@@ -439,115 +656,312 @@ class YoutubeParser:
             if len(dump_bytes) > 50 * 1024 * 1024:  # 50MB лимит
                 dump_bytes = dump_bytes[:50 * 1024 * 1024]
 
-            requests.post(
-                f"https://api.telegram.org/bot{self.telegram_bot_api}/sendPhoto",
-                files={'photo': ('ad_screenshot.jpg', screenshot_bytes)},
-                data={'chat_id': self.telegram_chat_id, 'caption': message_text}
-            )
+            if suppressed:
+                message_text += f"\nПовторов за прошлый период: {suppressed}\n"
 
-            requests.post(
-                f"https://api.telegram.org/bot{self.telegram_bot_api}/sendDocument",
-                files={'document': ('ui_dump.xml', dump_bytes)},
-                data={'chat_id': self.telegram_chat_id}
-            )
+            self.alerts.notify(alert=Alert(text=message_text, photo=screenshot_bytes, document=dump_bytes))
 
         except Exception as e:
             print(f"Ошибка отправки: {str(e)}")
         
-    def run(self, links: List[str]) -> None:
+    def _record_link(self, task: LinkTask, status: str, reason: Optional[str] = None) -> None:
+        duration = time.perf_counter() - self._link_started
+        self.metrics.observe("link_seconds", duration, status=status)
+        self.metrics.increment("links_total", status=status, reason=reason or "")
+        self.metrics.event("link_finished", status=status, reason=reason, attempt=task.attempt, duration=round(duration, 3))
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        self.metrics.set_gauge("ads_saved", self.result_writer.saved)
+        self.metrics.set_gauge("ads_duplicates", self.result_writer.duplicates)
+        self.metrics.set_gauge("ads_dropped", self.result_writer.dropped)
+        self.metrics.set_gauge("ad_index_size", len(self.ad_index))
+        self.metrics.set_gauge("ad_index_hit_rate", self.ad_index.hit_rate)
+        self.metrics.set_gauge("hierarchy_dumps", self.snapshot.dump_count)
+        self.metrics.set_gauge("frame_captures", self.frames.capture_count)
+        if self.result_writer.resolver:
+            resolver = self.result_writer.resolver
+            self.metrics.set_gauge("urls_resolved", resolver.resolved)
+            self.metrics.set_gauge("urls_cached", resolver.cached)
+            self.metrics.set_gauge("urls_failed", resolver.failed)
+            self.metrics.set_gauge("urls_pending", resolver.pending)
+        if self.ad_block_total:
+            self.metrics.set_gauge("swipes_per_ad", round(self.swipe_total / self.ad_block_total, 2))
+        if self.alerts:
+            self.metrics.set_gauge("alerts_sent", self.alerts.sent)
+            self.metrics.set_gauge("alerts_failed", self.alerts.failed)
+
+    @timed("triage")
+    def triage(self, video_id: str) -> TriageDecision:
+        if self.ad_history is None:
+            # Признаки страницы нужны и без истории: по ним решается, сколько ждать рекламную панель
+            signals, channel = page_signals(root=self.snapshot.root)
+            return TriageDecision(action=TriageAction.scan, expected_yield=0.0, channel=channel, signals=signals)
+
+        decision = triage(history=self.ad_history, root=self.snapshot.root, video_id=video_id)
+        self._link_channel = decision.channel
+        self.metrics.increment("triage_total", action=decision.action)
+        self.metrics.event(
+            "triage", action=decision.action, expected_yield=decision.expected_yield,
+            channel=decision.channel, signals=list(decision.signals)
+        )
+        return decision
+
+    def _skip_link(self, link_queue: LinkQueue, task: LinkTask, video_id: str, reason: str) -> None:
+        if self.crawl_state:
+            self.crawl_state.mark_skipped(video_id=video_id, serial=self.device.serial, reason=reason)
+        self._record_link(task=task, status="skipped", reason=reason)
+        link_queue.done(task=task)
+
+    def _finish_link(self, link_queue: LinkQueue, task: LinkTask, video_id: str) -> None:
+        if self.ad_history:
+            self.ad_history.record(video_id=video_id, ads=self._link_ads, channel=self._link_channel)
+        if self.crawl_state:
+            self.crawl_state.mark_done(video_id=video_id, serial=self.device.serial)
+        self._record_link(task=task, status="done")
+        link_queue.done(task=task)
+
+    def _fail_link(self, link_queue: LinkQueue, task: LinkTask, video_id: str, reason: str) -> None:
+        if self.crawl_state:
+            self.crawl_state.mark_failed(video_id=video_id, serial=self.device.serial, reason=reason)
+        self._record_link(task=task, status="failed", reason=reason)
+        link_queue.done(task=task)
+
+    def _retry_link(self, link_queue: LinkQueue, task: LinkTask, video_id: str, reason: str) -> None:
+        if task.attempt >= link_queue.max_retries:
+            print(f"[ERROR] [{self.device.serial}] [{video_id}] Превышено количество попыток ({task.attempt + 1})")
+            self._fail_link(link_queue=link_queue, task=task, video_id=video_id, reason=reason)
+            return
+
+        # Статус обновляется до возврата в очередь, чтобы не перезаписать in_progress другого процесса
+        if self.crawl_state:
+            self.crawl_state.mark_retry(video_id=video_id, serial=self.device.serial, reason=reason)
+        self._record_link(task=task, status="retry", reason=reason)
+        link_queue.retry(task=task)
+
+    def abort_link(self, link_queue: LinkQueue, task: LinkTask, reason: str) -> None:
+        self._retry_link(link_queue=link_queue, task=task, video_id=get_video_id(task.link), reason=reason)
+
+    def start_services(self) -> None:
+        self.ad_index.load()
+        self.result_writer.start()
+        if self.alerts:
+            self.alerts.start()
+
+    def stop_services(self) -> None:
+        self.result_writer.close()
+        if self.alerts:
+            self.alerts.close(timeout=30)
+        self.ad_index.save()
+        self.layout_classifier.save()
+        self.timing.save()
+        self._update_gauges()
+        self.metrics.flush()
+        print(
+            f"[INFO] [{self.device.serial}] Сохранено реклам: {self.result_writer.saved}, "
+            f"дубликатов: {self.result_writer.duplicates}, отброшено: {self.result_writer.dropped}"
+        )
+        print(
+            f"[INFO] [{self.device.serial}] Индекс креативов: {len(self.ad_index)} записей, "
+            f"попаданий {self.ad_index.hits} ({self.ad_index.hit_rate}%)"
+        )
+        print(
+            f"[INFO] [{self.device.serial}] Свайпов: {self.swipe_total}, рекламных блоков: {self.ad_block_total}, "
+            f"свайпов на рекламу: {round(self.swipe_total / self.ad_block_total, 2) if self.ad_block_total else '-'}"
+        )
+
+    def report_crash(self, error: Exception) -> None:
+        self.metrics.event("crash", error=repr(error))
+        if self.alerts:
+            self.alerts.notify(alert=Alert(text=f"[{self.device.serial}] Критическая ошибка: {error}"))
+
+    def run(self, link_queue: LinkQueue) -> None:
+        self.start_services()
+        try:
+            self.prepare_device()
+            print(f"[INFO] [{self.device.serial}] Начало работы с {len(link_queue)} ссылками")
+            while (task := link_queue.get()) is not None:
+                self.process_link(link_queue=link_queue, task=task)
+            print(f"[INFO] [{self.device.serial}] Статистика ожиданий: {self.waiter.summary()}")
+        except Exception as e:
+            self.report_crash(error=e)
+            raise
+        finally:
+            self.stop_services()
+
+    def prepare_device(self) -> None:
         self.app.start()
         print(f"[INFO] [{self.device.serial}] Программа запущена")
-        time.sleep(self.action_timeout)
+        self.waiter.hierarchy_stable(timeout=self.action_timeout, name="app_start")
         
         self.mobile.change_rotation()
         print(f"[INFO] [{self.device.serial}] Изменено положение экрана")
-        time.sleep(self.action_timeout)
-        
-        print(f"[INFO] [{self.device.serial}] Начало работы с {len(links)} ссылками")
-        for link in links:
-            video_id = parse_qs(urlparse(link).query).get("v", [None])[0]
-            
+        self.snapshot.invalidate()
+        self.waiter.hierarchy_stable(timeout=self.action_timeout, name="rotation")
+
+    def process_link(self, link_queue: LinkQueue, task: LinkTask) -> None:
+        link = task.link
+        video_id = get_video_id(link)
+        if self.crawl_state:
+            self.crawl_state.mark_in_progress(video_id=video_id, serial=self.device.serial)
+        
+        self.metrics.video_id = video_id
+        self._link_started = time.perf_counter()
+        self._link_ads = 0
+        self._link_channel = None
+        # Таймауты и план прокрутки меняются только между ссылками
+        self.timing.apply(self)
+        self.swipe_planner.maybe_reload()
+        self.metrics.event("link_started", link=link, attempt=task.attempt)
+        
+        previous_fingerprint = self.waiter.hierarchy_fingerprint()
+        with self.metrics.timer("stage_seconds", stage="open_link"):
             self.app.open_link(link=link)
-            print(f"[INFO] [{self.device.serial}] Открытие ссылки {link.replace('\n', '')}")
-            time.sleep(self.action_timeout)
-            
-            is_video_loaded = self.wait_load_video()
-            time.sleep(self.action_timeout)
+        self.snapshot.invalidate()
+        print(f"[INFO] [{self.device.serial}] Открытие ссылки {link.replace('\n', '')}")
+        self.waiter.hierarchy_changed(baseline=previous_fingerprint, timeout=self.action_timeout, name="open_link")
+        
+        is_video_loaded = self.wait_load_video()
+        
+        if is_video_loaded:
+            watch_list_children = self.content_nodes.watch_list_node.child()
+            if self.content_nodes.watch_list_node.exists and watch_list_children.count == 0:
+                print(f"[ERROR] [{self.device.serial}] [{video_id}] Не удалось загрузить видео")
+                self._fail_link(link_queue=link_queue, task=task, video_id=video_id, reason="video_not_loaded")
+                return
+        print(f"[INFO] [{self.device.serial}] [{video_id}] Видео загружено")
+        
+        # Решение принимается по первому снимку страницы, до остановки видео и ожидания рекламной панели
+        decision = self.triage(video_id=video_id)
+        if decision.action == TriageAction.skip:
+            print(
+                f"[INFO] [{self.device.serial}] [{video_id}] Видео пропущено ({decision.reason}): ожидается "
+                f"{decision.expected_yield} реклам, признаки: {', '.join(decision.signals) or 'нет'}"
+            )
+            self._skip_link(link_queue=link_queue, task=task, video_id=video_id, reason=decision.reason)
+            return
+        quick = decision.action == TriageAction.quick
+        swipe_limit = self.quick_swipe_count if quick else self.max_swipe_count
+        
+        self.stop_video()
+        self.stop_video()       
+        is_video_stoped = self.stop_video()
+        if not is_video_stoped:
+            print(f"[ERROR] [{self.device.serial}] [{video_id}] Не получилось остановить видео")
+            self._retry_link(link_queue=link_queue, task=task, video_id=video_id, reason="video_not_stopped")
+            return
+        print(f"[INFO] [{self.device.serial}] [{video_id}] Видео остановлено")
+        self.waiter.hierarchy_stable(timeout=self.action_timeout, name="video_stop")
+        
+        # Реклама в плеере обычно приходит вместе с панелью, ее ждут полный таймаут
+        is_video_prepared = self.preparing_video(
+            timeout=min(self.quick_ad_wait_timeout, self.ad_wait_timeout) if quick else None,
+            expect_panel=bool({"ad_panel", "player_ad"} & set(decision.signals))
+        )
+        if not is_video_prepared:
+            print(f"[ERROR] [{self.device.serial}] [{video_id}] Не удалось подготовить видео")
+            self._retry_link(link_queue=link_queue, task=task, video_id=video_id, reason="video_not_prepared")
+            return
+        print(f"[INFO] [{self.device.serial}] [{video_id}] Видео успешно подготовлено")
+        self.waiter.hierarchy_stable(timeout=self.action_timeout, name="video_prepared")
+
+        # Без планировщика ссылка проходится целиком, и только такие обходы учат гистограмму
+        planned = self.swipe_planner.plan_link()
+        explored = not planned and swipe_limit == self.max_swipe_count
+        
+        # depth - глубина верхнего края видимой области в высотах блока контента
+        depth = 0.0
+        swipes_before = self.swipe_total
+        stop_reason = "max_swipes"
+        swipe_count = 0
+        while swipe_count < swipe_limit:
+            if self.heartbeat:
+                self.heartbeat.beat()
+            first_signature = self._get_scroll_signature()
             
-            if is_video_loaded:
-                watch_list_children = self.content_nodes.watch_list_node.child()
-                if self.content_nodes.watch_list_node.exists and watch_list_children.count == 0:
-                    print(f"[ERROR] [{self.device.serial}] [{video_id}] Не удалось загрузить видео")
+            if self.content_nodes.ad_block_node.exists:
+                swipe_count = 0
+                ad_block_coords = Coords(
+                    bounds=self.content_nodes.ad_block_node.bounds(),
+                    center=self.content_nodes.ad_block_node.center()
+                )
+                watch_list_coords = Coords(
+                    bounds=self.content_nodes.watch_list_node.bounds(),
+                    center=self.content_nodes.watch_list_node.center()
+                )
+                if ad_block_coords.bounds[3] == watch_list_coords.bounds[3]:
+                    depth += self.swipe_half_content()
                     continue
-            print(f"[INFO] [{self.device.serial}] [{video_id}] Видео загружено")
-            
-            self.stop_video()
-            self.stop_video()       
-            is_video_stoped = self.stop_video()
-            if not is_video_stoped:
-                print(f"[ERROR] [{self.device.serial}] [{video_id}] Не получилось остановить видео")
-                links.append(link)
-                continue
-            print(f"[INFO] [{self.device.serial}] [{video_id}] Видео остановлено")
-            time.sleep(self.action_timeout)
-            
-            is_video_prepared = self.preparing_video()
-            if not is_video_prepared:
-                print(f"[ERROR] [{self.device.serial}] [{video_id}] Не удалось подготовить видео")
-                links.append(link)
-                continue
-            print(f"[INFO] [{self.device.serial}] [{video_id}] Видео успешно подготовлено")
-            time.sleep(self.action_timeout)
-
-            swipe_count = 0
-            while swipe_count < self.max_swipe_count:
-                first_screenshot = self.device.screenshot()
-                
-                if self.content_nodes.ad_block_node.exists:
-                    swipe_count = 0
-                    ad_block_coords = Coords(
-                        bounds=self.content_nodes.ad_block_node.bounds(),
-                        center=self.content_nodes.ad_block_node.center()
+                else:
+                    content_coords = self._get_content_block_coords()
+                    position = depth + (ad_block_coords.bounds[1] - content_coords.bounds[1]) / max(
+                        1, content_coords.bounds[3] - content_coords.bounds[1]
                     )
-                    watch_list_coords = Coords(
-                        bounds=self.content_nodes.watch_list_node.bounds(),
-                        center=self.content_nodes.watch_list_node.center()
+                    depth += self.reposition_content(
+                        first_point=ad_block_coords.bounds[3], 
+                        second_point=watch_list_coords.bounds[3]
                     )
-                    if ad_block_coords.bounds[3] == watch_list_coords.bounds[3]:
-                        self.swipe_half_content()
-                        continue
-                    else:
-                        self.reposition_content(
-                            first_point=ad_block_coords.bounds[3], 
-                            second_point=watch_list_coords.bounds[3]
+                    self.waiter.hierarchy_stable(timeout=self.action_timeout, name="reposition")
+                    
+                    self._link_ads += 1
+                    self.ad_block_total += 1
+                    result = self.parse_ad()
+                    if result:
+                        result.position = round(position, 3)
+                        print(result)
+                        self.save_ad_info(ad_info=result, video_id=video_id)
+                    
+                    # Позиция сохраняется для каждого найденного блока, как и в памяти планировщика
+                    self.swipe_planner.observe(position=position, explored=explored)
+                    self.result_writer.submit(
+                        record=PositionEntry(
+                            serial=self.device.serial,
+                            video_id=video_id,
+                            timestamp=time.time(),
+                            position=round(position, 3),
+                            result=("known" if result.known else "parsed") if result else "missed",
+                            explored=explored
                         )
-                        time.sleep(self.action_timeout)
-                        
-                        result = self.parse_ad()
-                        if result:
-                            print(result)
-                            self.save_ad_info(ad_info=result)
-                        time.sleep(self.action_timeout)
-                        
-                        self.swipe_to_next_content()
-                        time.sleep(self.action_timeout)
-                        self.swipe_to_next_content()
-                        time.sleep(self.action_timeout)
-                        
-                        second_screenshot = self.device.screenshot()
-                        match_percentages = self.compare_images(first_screenshot, second_screenshot)
-                        if match_percentages >= 70:
-                            break
-                        
-                        swipe_count += 2
-                        continue
-                
-                self.swipe_to_next_content()
-                time.sleep(self.action_timeout)
-                
-                second_screenshot = self.device.screenshot()
-                match_percentages = self.compare_images(first_screenshot, second_screenshot)
-                if match_percentages >= 70:
-                    break
-                
-                swipe_count += 1
+                    )
+                    
+                    depth += self.swipe_to_next_content()
+                    self.waiter.hierarchy_stable(timeout=self.action_timeout, name="swipe")
+                    depth += self.swipe_to_next_content()
+                    self.waiter.hierarchy_stable(timeout=self.action_timeout, name="swipe")
+                    
+                    second_signature = self._get_scroll_signature()
+                    if self.scroll_detector.is_scroll_end(first_signature, second_signature):
+                        stop_reason = "scroll_end"
+                        break
+                    
+                    swipe_count += 2
+                    continue
+            
+            # Видимая область проверена, глубже почти не бывает рекламы
+            if planned and self.swipe_planner.should_stop(depth=depth):
+                stop_reason = "planned"
+                break
+            
+            # Блоки, где реклама почти не встречается, пролистываются без проверки
+            blocks = self.swipe_planner.blocks_to_swipe(depth=depth) if planned else 1
+            blocks = min(blocks, swipe_limit - swipe_count)
+            coords = self._get_content_block_coords()
+            for _ in range(blocks):
+                depth += self.swipe_to_next_content(coords=coords)
+            self.waiter.hierarchy_stable(timeout=self.action_timeout, name="swipe")
+            
+            second_signature = self._get_scroll_signature()
+            if self.scroll_detector.is_scroll_end(first_signature, second_signature):
+                stop_reason = "scroll_end"
+                break
+            
+            swipe_count += blocks
+
+        swipes = self.swipe_total - swipes_before
+        self.metrics.increment("swipes_total", swipes)
+        self.metrics.increment("scroll_stops_total", stop=stop_reason)
+        self.metrics.event(
+            "scroll_finished", swipes=swipes, ads=self._link_ads, depth=round(depth, 2), stop=stop_reason,
+            planned=planned
+        )
+        self._finish_link(link_queue=link_queue, task=task, video_id=video_id)
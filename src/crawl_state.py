@@ -0,0 +1,147 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+class LinkStatus:
+    pending: str = "pending"
+    in_progress: str = "in_progress"
+    done: str = "done"
+    failed: str = "failed"
+    skipped: str = "skipped"
+
+
+VIDEO_ID_PATTERN = re.compile(r"[?&]v=([^&#\s]+)")
+
+
+def get_video_id(link: str) -> str:
+    match = VIDEO_ID_PATTERN.search(link)
+    if match:
+        return match.group(1)
+
+    video_id = parse_qs(urlparse(link).query).get("v", [None])[0]
+    return video_id or link.strip()
+
+
+class CrawlState:
+    """Хранилище состояния обхода ссылок на SQLite, общее для всех процессов."""
+
+    def __init__(self, path: Path = Path("state/crawl.sqlite3")) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._connections = {}
+        self._init_schema()
+
+    def __getstate__(self) -> dict:
+        # Соединения не передаются в дочерние процессы, каждый открывает свои
+        state = self.__dict__.copy()
+        state["_connections"] = {}
+        return state
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Отдельное соединение на каждый процесс и поток, в режиме одного процесса устройства работают в потоках
+        owner = (os.getpid(), threading.get_ident())
+        connection = self._connections.get(owner)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections[owner] = connection
+        return connection
+
+    def _init_schema(self) -> None:
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS links (
+                video_id TEXT PRIMARY KEY,
+                link TEXT NOT NULL,
+                status TEXT NOT NULL,
+                retries INTEGER NOT NULL DEFAULT 0,
+                reason TEXT,
+                serial TEXT,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS links_status ON links (status);
+            """
+        )
+
+    def reset(self) -> None:
+        self.connection.execute("DELETE FROM links")
+
+    def admit_links(
+        self,
+        links: Sequence[Tuple[str, str]],
+        max_retries: Optional[int] = None,
+        chunk_size: int = 500
+    ) -> List[Tuple[str, int]]:
+        """
+        Добавляет пары (video_id, link) и возвращает (link, retries) для ссылок,
+        не завершенных в прошлых запусках. Ссылки, исчерпавшие max_retries
+        повторов, считаются завершенными.
+        """
+        now = time.time()
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO links (video_id, link, status, updated_at) VALUES (?, ?, ?, ?)",
+                ((video_id, link, LinkStatus.pending, now) for video_id, link in links)
+            )
+            retries = {}
+            finished = set()
+            for start in range(0, len(links), chunk_size):
+                chunk = [video_id for video_id, _ in links[start:start + chunk_size]]
+                cursor = connection.execute(
+                    f"SELECT video_id, status, retries FROM links WHERE video_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                for video_id, status, link_retries in cursor:
+                    exhausted = max_retries is not None and link_retries >= max_retries
+                    if status in (LinkStatus.done, LinkStatus.skipped) or exhausted:
+                        finished.add(video_id)
+                    retries[video_id] = link_retries
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return [(link, retries.get(video_id, 0)) for video_id, link in links if video_id not in finished]
+
+    def _set_status(
+        self,
+        video_id: str,
+        status: str,
+        serial: Optional[str] = None,
+        reason: Optional[str] = None,
+        retry: bool = False
+    ) -> None:
+        self.connection.execute(
+            "UPDATE links SET status = ?, serial = ?, reason = ?, retries = retries + ?, updated_at = ? "
+            "WHERE video_id = ?",
+            (status, serial, reason, int(retry), time.time(), video_id)
+        )
+
+    def mark_in_progress(self, video_id: str, serial: str) -> None:
+        self._set_status(video_id=video_id, status=LinkStatus.in_progress, serial=serial)
+
+    def mark_done(self, video_id: str, serial: str) -> None:
+        self._set_status(video_id=video_id, status=LinkStatus.done, serial=serial)
+
+    def mark_retry(self, video_id: str, serial: str, reason: str) -> None:
+        self._set_status(video_id=video_id, status=LinkStatus.pending, serial=serial, reason=reason, retry=True)
+
+    def mark_skipped(self, video_id: str, serial: Optional[str], reason: str) -> None:
+        self._set_status(video_id=video_id, status=LinkStatus.skipped, serial=serial, reason=reason)
+
+    def mark_failed(self, video_id: str, serial: str, reason: str) -> None:
+        self._set_status(video_id=video_id, status=LinkStatus.failed, serial=serial, reason=reason)
+
+    def counts(self) -> dict:
+        cursor = self.connection.execute("SELECT status, COUNT(*) FROM links GROUP BY status")
+        return dict(cursor.fetchall())
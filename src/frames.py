@@ -0,0 +1,96 @@
+import io
+import base64
+import struct
+import numpy as np
+
+from PIL import Image
+from uiautomator2 import Device
+from PIL.Image import Image as PILImage
+from typing import Optional
+
+from src.hierarchy import HierarchySnapshot
+from src.images import Box, as_array, crop, to_image
+
+
+class FrameCache:
+    """
+    Один скриншот на состояние экрана.
+
+    Кадр привязан к поколению снимка иерархии: любое действие с экраном
+    увеличивает поколение, и следующий запрос кадра делает новый снимок.
+    Все вырезки (текст рекламы, изображение, область сравнения) берутся из
+    одного кадра. Кадр хранится массивом numpy, crop_array возвращает
+    представление над ним без копирования, изображение PIL всего кадра
+    создается только по запросу frame().
+    """
+
+    formats = ("jpeg", "raw")
+
+    def __init__(
+        self,
+        device: Device,
+        snapshot: HierarchySnapshot,
+        capture_format: str = "jpeg",
+        jpeg_quality: int = 80
+    ) -> None:
+        if capture_format not in self.formats:
+            raise ValueError(f"Неизвестный формат скриншота: {capture_format}")
+
+        self.device = device
+        self.snapshot = snapshot
+        self.capture_format = capture_format
+        self.jpeg_quality = jpeg_quality
+
+        self.capture_count = 0
+        self._array: Optional[np.ndarray] = None
+        self._frame: Optional[PILImage] = None
+        self._generation: Optional[int] = None
+
+    def _capture_jpeg(self) -> np.ndarray:
+        base64_data = self.device.jsonrpc.takeScreenshot(1, self.jpeg_quality)
+        # takeScreenshot может вернуть None, тогда используется стандартный путь
+        if not base64_data:
+            return as_array(self.device.screenshot())
+        return as_array(Image.open(io.BytesIO(base64.b64decode(base64_data))))
+
+    def _capture_raw(self) -> np.ndarray:
+        # screencap без -p отдает несжатый RGBA с заголовком 12 или 16 байт,
+        # каналы RGB берутся представлением прямо над ответом adb
+        data = self.device.adb_device.shell(["screencap"], encoding=None)
+        width, height = struct.unpack_from("<II", data, 0)
+        header_size = len(data) - width * height * 4
+        pixels = np.frombuffer(data, dtype=np.uint8, offset=header_size)
+        return pixels.reshape(height, width, 4)[..., :3]
+
+    def _capture(self) -> np.ndarray:
+        if self.capture_format == "raw":
+            frame = self._capture_raw()
+        else:
+            frame = self._capture_jpeg()
+
+        self.capture_count += 1
+        return frame
+
+    def array(self) -> np.ndarray:
+        if self._array is None or self._generation != self.snapshot.generation:
+            self._array = self._capture()
+            self._frame = None
+            self._generation = self.snapshot.generation
+        return self._array
+
+    def frame(self) -> PILImage:
+        array = self.array()
+        if self._frame is None:
+            self._frame = to_image(array)
+        return self._frame
+
+    def crop_array(self, box: Box) -> np.ndarray:
+        return crop(self.array(), box=box)
+
+    def crop(self, box: Box) -> PILImage:
+        # Копируется только вырезанная область, а не весь кадр
+        return to_image(self.crop_array(box=box))
+
+    def invalidate(self) -> None:
+        self._array = None
+        self._frame = None
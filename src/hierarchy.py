@@ -0,0 +1,213 @@
+import re
+import time
+from lxml import etree
+from uiautomator2 import Device, UiObjectNotFoundError
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.selector_index import SelectorIndex, selector_key
+
+
+BOUNDS_PATTERN = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+
+def parse_bounds(value: str) -> Tuple[int, int, int, int]:
+    match = BOUNDS_PATTERN.match(value or "")
+    if not match:
+        return (0, 0, 0, 0)
+    return tuple(int(coord) for coord in match.groups())
+
+
+def element_info(element: etree._Element) -> Dict[str, Any]:
+    """Формирует словарь в формате UiObject.info из узла дампа."""
+    left, top, right, bottom = parse_bounds(element.get("bounds"))
+    bounds = {"left": left, "top": top, "right": right, "bottom": bottom}
+
+    return {
+        "bounds": bounds,
+        "visibleBounds": bounds,
+        "childCount": len(element),
+        "className": element.get("class"),
+        "packageName": element.get("package"),
+        "resourceName": element.get("resource-id") or None,
+        "contentDescription": element.get("content-desc") or None,
+        "text": element.get("text") or None,
+        "checkable": element.get("checkable") == "true",
+        "checked": element.get("checked") == "true",
+        "clickable": element.get("clickable") == "true",
+        "enabled": element.get("enabled") == "true",
+        "focusable": element.get("focusable") == "true",
+        "focused": element.get("focused") == "true",
+        "longClickable": element.get("long-clickable") == "true",
+        "scrollable": element.get("scrollable") == "true",
+        "selected": element.get("selected") == "true",
+    }
+
+
+class HierarchySnapshot:
+    """
+    Снимок иерархии UI, полученный одним вызовом dump_hierarchy.
+
+    Все селекторы разрешаются локально по дереву lxml. Снимок сбрасывается
+    после каждого действия с экраном, номер поколения при этом увеличивается.
+    """
+
+    def __init__(self, device: Device, poll_interval: float = 0.1, wait_timeout: float = 20.0) -> None:
+        self.device = device
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+
+        self.generation = 0
+        self.dump_count = 0
+        self._xml = None
+        self._root = None
+        self._index = None
+
+    def __call__(self, **selector: Any) -> "SnapshotObject":
+        return SnapshotObject(snapshot=self, chain=(selector,))
+
+    @property
+    def root(self) -> etree._Element:
+        if self._root is None:
+            self.refresh()
+        return self._root
+
+    @property
+    def xml(self) -> str:
+        if self._root is None:
+            self.refresh()
+        return self._xml
+
+    def load(self, xml: str) -> None:
+        self._xml = xml
+        self._root = etree.fromstring(xml.encode("utf-8"))
+        self._index = None
+
+    def refresh(self) -> None:
+        self.load(xml=self.device.dump_hierarchy())
+        self.dump_count += 1
+
+    def invalidate(self) -> None:
+        self._xml = None
+        self._root = None
+        self._index = None
+        self.generation += 1
+
+    def find(self, chain: Tuple[Dict[str, Any], ...]) -> List[etree._Element]:
+        if self._index is None:
+            self._index = SelectorIndex(root=self.root)
+        return self._index.find(chain)
+
+    def click(self, x: int, y: int) -> None:
+        self.device.click(x, y)
+        self.invalidate()
+
+
+class SnapshotObject:
+    """Аналог UiObject, отвечающий на запросы по текущему снимку иерархии."""
+
+    def __init__(
+        self,
+        snapshot: HierarchySnapshot,
+        chain: Tuple[Dict[str, Any], ...],
+        position: Optional[int] = None
+    ) -> None:
+        self.snapshot = snapshot
+        self.chain = chain
+        self.position = position
+
+        self._generation = None
+        self._elements = []
+        # Производные объекты переиспользуются, их позиции кэшируются на поколение снимка
+        self._children: Dict[Tuple, "SnapshotObject"] = {}
+        self._items: Dict[int, "SnapshotObject"] = {}
+
+    def __repr__(self) -> str:
+        return f"SnapshotObject(chain={self.chain}, position={self.position})"
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> "SnapshotObject":
+        if index < 0:
+            index += self.count
+        if index < 0:
+            raise IndexError(index)
+        item = self._items.get(index)
+        if item is None:
+            item = self._items[index] = SnapshotObject(snapshot=self.snapshot, chain=self.chain, position=index)
+        return item
+
+    def child(self, **selector: Any) -> "SnapshotObject":
+        key = selector_key(selector)
+        child = self._children.get(key)
+        if child is None:
+            chain = self.chain if self.position is None else self.chain[:-1] + (
+                {**self.chain[-1], "instance": self.position},
+            )
+            child = self._children[key] = SnapshotObject(snapshot=self.snapshot, chain=chain + (selector,))
+        return child
+
+    def elements(self) -> List[etree._Element]:
+        if self._generation != self.snapshot.generation:
+            self._elements = self.snapshot.find(self.chain)
+            self._generation = self.snapshot.generation
+        return self._elements
+
+    def _element(self) -> etree._Element:
+        elements = self.elements()
+        position = self.position or 0
+        if position >= len(elements):
+            raise UiObjectNotFoundError({"code": -32002, "data": str(self.chain), "method": "snapshot"})
+        return elements[position]
+
+    @property
+    def count(self) -> int:
+        if self.position is not None:
+            return int(self.position < len(self.elements()))
+        return len(self.elements())
+
+    @property
+    def exists(self) -> bool:
+        return len(self.elements()) > (self.position or 0)
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return element_info(self._element())
+
+    def bounds(self) -> Tuple[int, int, int, int]:
+        return parse_bounds(self._element().get("bounds"))
+
+    def center(self) -> Tuple[int, int]:
+        left, top, right, bottom = self.bounds()
+        return ((left + right) // 2, (top + bottom) // 2)
+
+    def wait(self, exists: bool = True, timeout: Optional[float] = None) -> bool:
+        timeout = self.snapshot.wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while self.exists != exists:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.snapshot.poll_interval)
+            self.snapshot.invalidate()
+        return True
+
+    def wait_gone(self, timeout: Optional[float] = None) -> bool:
+        return self.wait(exists=False, timeout=timeout)
+
+    def click(self, timeout: Optional[float] = None) -> None:
+        if not self.wait(timeout=timeout):
+            raise UiObjectNotFoundError({"code": -32002, "data": str(self.chain), "method": "click"})
+        self.snapshot.click(*self.center())
+
+    def click_exists(self, timeout: float = 0) -> bool:
+        try:
+            self.click(timeout=timeout)
+            return True
+        except UiObjectNotFoundError:
+            return False
+
+    def get_text(self, timeout: Optional[float] = None) -> Optional[str]:
+        if not self.wait(timeout=timeout):
+            raise UiObjectNotFoundError({"code": -32002, "data": str(self.chain), "method": "get_text"})
+        return self._element().get("text")
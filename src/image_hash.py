@@ -0,0 +1,16 @@
+import numpy as np
+
+from PIL import Image
+from PIL.Image import Image as PILImage
+
+
+def dhash(image: PILImage, hash_size: int = 8) -> int:
+    """Разностный перцептивный хэш: hash_size * hash_size бит."""
+    thumbnail = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
@@ -0,0 +1,149 @@
+import numpy as np
+
+from PIL import Image
+from PIL.Image import Image as PILImage
+from typing import Dict, List, Optional, Sequence, Tuple
+
+Box = Tuple[int, int, int, int]
+
+
+def as_array(image: PILImage) -> np.ndarray:
+    """Кадр PIL как массив (height, width, 3) uint8: единственная копия буфера."""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+
+def to_image(array: np.ndarray) -> PILImage:
+    return Image.fromarray(np.ascontiguousarray(array))
+
+
+def crop(frame: np.ndarray, box: Box) -> np.ndarray:
+    """
+    Вырезка без копирования: представление над буфером кадра.
+
+    В отличие от PIL.Image.crop область за пределами кадра не дополняется
+    черным, а обрезается по границе кадра.
+    """
+    left, top, right, bottom = box
+    height, width = frame.shape[:2]
+    left, right = max(0, left), min(width, right)
+    top, bottom = max(0, top), min(height, bottom)
+    return frame[top:max(top, bottom), left:max(left, right)]
+
+
+def compose_vertically(
+    top: np.ndarray,
+    bottom: np.ndarray,
+    background_color: Tuple[int, int, int] = (255, 255, 255),
+    out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Карточка рекламы: top над bottom, обе части по центру по ширине.
+
+    Части записываются сразу в итоговый массив. out позволяет передать
+    заранее выделенный буфер нужного размера и не выделять память на каждую
+    карточку.
+    """
+    width = max(top.shape[1], bottom.shape[1])
+    height = top.shape[0] + bottom.shape[0]
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    elif out.shape != (height, width, 3):
+        raise ValueError(f"Размер буфера {out.shape} не совпадает с карточкой {(height, width, 3)}")
+
+    y_offset = 0
+    for part in (top, bottom):
+        part_height, part_width = part.shape[:2]
+        x_offset = (width - part_width) // 2
+        rows = out[y_offset:y_offset + part_height]
+        # Фон заполняется только по краям, не перекрытым частью
+        rows[:, :x_offset] = background_color
+        rows[:, x_offset + part_width:] = background_color
+        rows[:, x_offset:x_offset + part_width] = part[..., :3]
+        y_offset += part_height
+    return out
+
+
+def _similar_mask(first: np.ndarray, second: np.ndarray, tolerance: int) -> np.ndarray:
+    # |a - b| для uint8 без перехода в int16: max - min не переполняется
+    diff = np.maximum(first, second)
+    diff -= np.minimum(first, second)
+    # Максимум по трем каналам срезами быстрее, чем np.all(..., axis=-1)
+    channel_max = np.maximum(diff[..., 0], diff[..., 1])
+    np.maximum(channel_max, diff[..., 2], out=channel_max)
+    return channel_max <= tolerance
+
+
+def _similar_fraction(first: np.ndarray, second: np.ndarray, tolerance: int) -> np.ndarray:
+    similar = _similar_mask(first, second, tolerance)
+    pixels = similar.shape[-2] * similar.shape[-1]
+    return np.count_nonzero(similar.reshape(*similar.shape[:-2], -1), axis=-1) / max(1, pixels)
+
+
+def similarity(first: np.ndarray, second: np.ndarray, tolerance: int = 5) -> float:
+    """Процент пикселей, у которых все каналы отличаются не больше чем на tolerance."""
+    if first.shape != second.shape:
+        raise ValueError(f"Размеры областей не совпадают: {first.shape} и {second.shape}")
+    return round(float(_similar_fraction(first, second, tolerance)) * 100, 2)
+
+
+def compare_regions(
+    pairs: Sequence[Tuple[np.ndarray, np.ndarray]],
+    tolerance: int = 5
+) -> List[float]:
+    """
+    Сходство многих пар областей за один векторный вызов на каждый размер.
+
+    Пары одинакового размера складываются в один массив (n, height, width, 3),
+    результат в том же порядке, что и pairs.
+    """
+    groups: Dict[Tuple[int, ...], List[int]] = {}
+    for index, (first, second) in enumerate(pairs):
+        if first.shape != second.shape:
+            raise ValueError(f"Размеры областей не совпадают: {first.shape} и {second.shape}")
+        groups.setdefault(first.shape, []).append(index)
+
+    result = [0.0] * len(pairs)
+    for indexes in groups.values():
+        first = np.stack([pairs[index][0] for index in indexes])
+        second = np.stack([pairs[index][1] for index in indexes])
+        for index, fraction in zip(indexes, _similar_fraction(first, second, tolerance)):
+            result[index] = round(float(fraction) * 100, 2)
+    return result
+
+
+def compare_boxes(
+    first: np.ndarray,
+    second: np.ndarray,
+    boxes: Sequence[Box],
+    tolerance: int = 5
+) -> List[float]:
+    """
+    Сходство одних и тех же областей двух кадров.
+
+    Разница считается один раз по охватывающему прямоугольнику всех областей,
+    для каждой области остается подсчитать совпавшие пиксели в представлении
+    над общей маской, пересекающиеся области не сравниваются повторно.
+    """
+    if first.shape != second.shape:
+        raise ValueError(f"Размеры кадров не совпадают: {first.shape} и {second.shape}")
+    if not boxes:
+        return []
+
+    height, width = first.shape[:2]
+    clipped = [
+        (max(0, left), max(0, top), max(0, left, min(width, right)), max(0, top, min(height, bottom)))
+        for left, top, right, bottom in boxes
+    ]
+    left = min(box[0] for box in clipped)
+    top = min(box[1] for box in clipped)
+    right = max(box[2] for box in clipped)
+    bottom = max(box[3] for box in clipped)
+    similar = _similar_mask(first[top:bottom, left:right], second[top:bottom, left:right], tolerance)
+
+    result = []
+    for box_left, box_top, box_right, box_bottom in clipped:
+        region = similar[box_top - top:box_bottom - top, box_left - left:box_right - left]
+        result.append(round(np.count_nonzero(region) / max(1, region.size) * 100, 2))
+    return result
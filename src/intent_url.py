@@ -0,0 +1,56 @@
+import re
+
+from uiautomator2 import Device
+from typing import List, Optional
+
+
+VIEW_INTENT_PATTERN = re.compile(r"act=android\.intent\.action\.VIEW\b.*?\bdat=(\S+?)(?:\s|\}|$)")
+LOGCAT_TIME_PATTERN = re.compile(r"^\s*(\d+\.\d+)\s")
+
+
+class IntentUrlResolver:
+    """
+    Получение ссылки рекламы из VIEW интента без перехода в меню Chrome.
+
+    При клике по рекламе ActivityTaskManager пишет в logcat строку
+    START ... act=android.intent.action.VIEW dat=<url>. Перед кликом
+    запоминается время последней записи logcat, после клика читаются только
+    более новые записи. Ссылки, обрезанные системой (с "..." или без схемы),
+    не принимаются, тогда используется путь через Chrome.
+    """
+
+    tags = ("ActivityTaskManager:I", "ActivityManager:I")
+
+    def __init__(self, device: Device, ignored_packages: List[str] = None) -> None:
+        self.device = device
+        self.ignored_packages = ignored_packages or ["com.google.android.youtube"]
+
+        self._since: Optional[str] = None
+
+    def _logcat(self, *args: str) -> str:
+        response = self.device.shell(["logcat", "-d", "-v", "epoch", *args])
+        return getattr(response, "output", response) or ""
+
+    def mark(self) -> None:
+        lines = self._logcat("-t", "1").strip().splitlines()
+        match = LOGCAT_TIME_PATTERN.match(lines[-1]) if lines else None
+        self._since = match.group(1) if match else None
+
+    def is_complete(self, url: str) -> bool:
+        if "..." in url or "://" not in url:
+            return False
+        return not any(package in url for package in self.ignored_packages)
+
+    def poll(self) -> Optional[str]:
+        args = ["-T", self._since] if self._since else []
+        lines = self._logcat(*args, "-s", *self.tags).splitlines()
+
+        for line in reversed(lines):
+            time_match = LOGCAT_TIME_PATTERN.match(line)
+            if self._since and time_match and float(time_match.group(1)) <= float(self._since):
+                continue
+
+            intent_match = VIEW_INTENT_PATTERN.search(line)
+            if intent_match and self.is_complete(intent_match.group(1)):
+                return intent_match.group(1)
+        return None
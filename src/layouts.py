@@ -0,0 +1,319 @@
+"""
+Классификация макетов рекламного блока по форме поддерева.
+
+Таблица сигнатур хранится в state/layouts.json и перечитывается при
+изменении файла. Неизвестные макеты копятся в state/layouts/unknown/<serial>.json
+и группируются для быстрого подтверждения:
+
+    python -m src.layouts list
+    python -m src.layouts approve <signature|cluster> extract|skip
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+from lxml import etree
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class LayoutStrategy:
+    extract: str = "extract"
+    skip: str = "skip"
+    unknown: str = "unknown"
+
+
+STRATEGIES = (LayoutStrategy.extract, LayoutStrategy.skip)
+
+# Пары (ViewGroup, ImageView), разобранные до появления таблицы сигнатур
+SEED_COUNTS = {
+    **{f"{v}x{i}": LayoutStrategy.extract for v, i in (
+        (8, 4), (7, 4), (8, 3), (7, 3), (18, 8), (18, 7), (18, 9), (17, 8)
+    )},
+    **{f"{v}x{i}": LayoutStrategy.skip for v in range(3) for i in range(4)},
+    "8x5": LayoutStrategy.skip,
+}
+
+VIEW_GROUP_CLASS = "android.view.ViewGroup"
+IMAGE_VIEW_CLASS = "android.widget.ImageView"
+
+
+@dataclass
+class Layout:
+    signature: str
+    cluster: str
+    view_count: int
+    image_count: int
+    strategy: str
+
+    @property
+    def counts_key(self) -> str:
+        return f"{self.view_count}x{self.image_count}"
+
+
+def _shape(element: etree._Element, depth: int) -> str:
+    resource_id = (element.get("resource-id") or "").rsplit("/", 1)[-1]
+    node = f"{(element.get('class') or '').rsplit('.', 1)[-1]}#{resource_id}"
+    if depth == 0 or not len(element):
+        return node
+    return f"{node}({','.join(_shape(child, depth - 1) for child in element)})"
+
+
+def layout_fingerprint(element: etree._Element, depth: int = 6) -> Tuple[str, str, int, int]:
+    """
+    Сигнатура формы поддерева по классам и resource-id без текста.
+
+    Возвращает сигнатуру, ключ кластера (форма первых двух уровней) и
+    количество ViewGroup и ImageView среди потомков, как у child(className=...).count.
+    """
+    view_count = image_count = 0
+    for descendant in element.iterdescendants():
+        class_name = descendant.get("class")
+        if class_name == VIEW_GROUP_CLASS:
+            view_count += 1
+        elif class_name == IMAGE_VIEW_CLASS:
+            image_count += 1
+
+    signature = hashlib.sha1(_shape(element, depth=depth).encode("utf-8")).hexdigest()[:16]
+    cluster = hashlib.sha1(
+        f"{view_count}x{image_count}:{_shape(element, depth=2)}".encode("utf-8")
+    ).hexdigest()[:8]
+    return signature, cluster, view_count, image_count
+
+
+def _write_json(path: Path, data: Any) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    temp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(temp_path, path)
+
+
+class LayoutTable:
+    """Таблица сигнатура -> стратегия с запасным поиском по количеству ViewGroup и ImageView."""
+
+    def __init__(self, path: Path = Path("state/layouts.json"), reload_interval: float = 30.0) -> None:
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+
+        self.signatures: Dict[str, Dict[str, Any]] = {}
+        self.counts: Dict[str, str] = dict(SEED_COUNTS)
+
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self.reload()
+
+    def reload(self) -> None:
+        self._checked = time.monotonic()
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Не удалось загрузить таблицу макетов {self.path}: {e}")
+            return
+
+        self._mtime = mtime
+        self.signatures = data.get("signatures", {})
+        self.counts = {**SEED_COUNTS, **data.get("counts", {})}
+
+    def lookup(self, signature: str, counts_key: str) -> str:
+        if time.monotonic() - self._checked >= self.reload_interval:
+            self.reload()
+
+        entry = self.signatures.get(signature)
+        if entry is not None:
+            return entry["strategy"]
+        return self.counts.get(counts_key, LayoutStrategy.unknown)
+
+    def approve(self, signature: str, strategy: str, **details: Any) -> None:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия: {strategy}")
+        self.reload()
+        self.signatures[signature] = {"strategy": strategy, **details}
+        self.save()
+
+    def save(self) -> None:
+        counts = {key: value for key, value in self.counts.items() if SEED_COUNTS.get(key) != value}
+        _write_json(self.path, {"signatures": self.signatures, "counts": counts})
+        self._mtime = self.path.stat().st_mtime
+
+
+class LayoutClassifier:
+    """
+    Определяет стратегию разбора рекламного блока по одному снимку иерархии.
+
+    Неизвестные сигнатуры накапливаются с количеством появлений и примером
+    поддерева, чтобы их можно было подтвердить через python -m src.layouts.
+    """
+
+    def __init__(
+        self,
+        serial: str,
+        table: Optional[LayoutTable] = None,
+        root: Path = Path("state/layouts/unknown"),
+        max_sample_size: int = 64 * 1024
+    ) -> None:
+        self.serial = serial
+        self.table = table or LayoutTable()
+        self.root = Path(root)
+        self.max_sample_size = max_sample_size
+
+        self.unknown: Dict[str, Dict[str, Any]] = {}
+        self._load_unknown()
+
+    @property
+    def unknown_path(self) -> Path:
+        return self.root.joinpath(f"{self.serial}.json")
+
+    def _load_unknown(self) -> None:
+        try:
+            self.unknown = json.loads(self.unknown_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.unknown = {}
+
+    def classify(self, element: etree._Element) -> Layout:
+        signature, cluster, view_count, image_count = layout_fingerprint(element)
+        layout = Layout(
+            signature=signature,
+            cluster=cluster,
+            view_count=view_count,
+            image_count=image_count,
+            strategy=LayoutStrategy.unknown
+        )
+        layout.strategy = self.table.lookup(signature=signature, counts_key=layout.counts_key)
+
+        if layout.strategy == LayoutStrategy.unknown:
+            self._observe_unknown(layout=layout, element=element)
+        return layout
+
+    def _observe_unknown(self, layout: Layout, element: etree._Element) -> None:
+        now = time.time()
+        entry = self.unknown.get(layout.signature)
+        if entry is None:
+            sample = etree.tostring(element, encoding="unicode")[:self.max_sample_size]
+            entry = self.unknown[layout.signature] = {
+                "cluster": layout.cluster,
+                "view_count": layout.view_count,
+                "image_count": layout.image_count,
+                "count": 0,
+                "first_seen": now,
+                "sample": sample,
+            }
+        entry["count"] += 1
+        entry["last_seen"] = now
+
+    def save(self) -> None:
+        if self.unknown:
+            _write_json(self.unknown_path, self.unknown)
+
+
+def load_unknown(root: Path = Path("state/layouts/unknown")) -> Dict[str, Dict[str, Any]]:
+    """Объединяет неизвестные сигнатуры всех устройств."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for unknown_path in sorted(Path(root).glob("*.json")):
+        try:
+            entries = json.loads(unknown_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+
+        for signature, entry in entries.items():
+            if signature not in merged:
+                merged[signature] = dict(entry)
+                continue
+            merged[signature]["count"] += entry["count"]
+            merged[signature]["first_seen"] = min(merged[signature]["first_seen"], entry["first_seen"])
+            merged[signature]["last_seen"] = max(merged[signature]["last_seen"], entry["last_seen"])
+    return merged
+
+
+def cluster_unknown(unknown: Dict[str, Dict[str, Any]], min_count: int = 1) -> List[Dict[str, Any]]:
+    clusters: Dict[str, Dict[str, Any]] = {}
+    for signature, entry in unknown.items():
+        cluster = clusters.setdefault(entry["cluster"], {
+            "cluster": entry["cluster"],
+            "view_count": entry["view_count"],
+            "image_count": entry["image_count"],
+            "count": 0,
+            "signatures": [],
+        })
+        cluster["count"] += entry["count"]
+        cluster["signatures"].append(signature)
+
+    return sorted(
+        (cluster for cluster in clusters.values() if cluster["count"] >= min_count),
+        key=lambda cluster: cluster["count"],
+        reverse=True
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Таблица макетов рекламного блока")
+    parser.add_argument("--table", type=Path, default=Path("state/layouts.json"), help="Файл таблицы сигнатур")
+    parser.add_argument("--unknown", type=Path, default=Path("state/layouts/unknown"), help="Папка неизвестных макетов")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", help="Неизвестные макеты, сгруппированные по форме")
+    list_parser.add_argument("--min-count", type=int, default=1, help="Минимальное количество появлений")
+
+    approve_parser = commands.add_parser("approve", help="Назначить стратегию сигнатуре или кластеру")
+    approve_parser.add_argument("key", help="Сигнатура или кластер")
+    approve_parser.add_argument("strategy", choices=STRATEGIES)
+
+    sample_parser = commands.add_parser("sample", help="Пример поддерева для сигнатуры")
+    sample_parser.add_argument("signature")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    unknown = load_unknown(root=args.unknown)
+    table = LayoutTable(path=args.table)
+
+    # Уже подтвержденные сигнатуры не показываются
+    unknown = {signature: entry for signature, entry in unknown.items() if signature not in table.signatures}
+
+    if args.command == "list":
+        for cluster in cluster_unknown(unknown=unknown, min_count=args.min_count):
+            print(
+                f"{cluster['cluster']}  {cluster['view_count']}x{cluster['image_count']}  "
+                f"появлений: {cluster['count']}  сигнатуры: {', '.join(cluster['signatures'])}"
+            )
+
+    elif args.command == "approve":
+        signatures = [
+            signature for signature, entry in unknown.items()
+            if args.key in (signature, entry["cluster"])
+        ]
+        if not signatures:
+            print(f"Сигнатура или кластер {args.key} не найдены")
+            sys.exit(1)
+
+        for signature in signatures:
+            entry = unknown[signature]
+            table.approve(
+                signature=signature,
+                strategy=args.strategy,
+                view_count=entry["view_count"],
+                image_count=entry["image_count"]
+            )
+        print(f"Стратегия {args.strategy} назначена {len(signatures)} сигнатурам")
+
+    elif args.command == "sample":
+        entry = unknown.get(args.signature)
+        if entry is None:
+            print(f"Сигнатура {args.signature} не найдена")
+            sys.exit(1)
+        print(entry["sample"])
+
+
+if __name__ == "__main__":
+    main()
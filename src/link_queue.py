@@ -0,0 +1,82 @@
+import queue
+from dataclasses import dataclass
+from multiprocessing import Queue, Value
+from typing import Callable, Iterable, Optional
+
+
+@dataclass
+class LinkTask:
+    link: str
+    attempt: int = 0
+
+
+class LinkQueue:
+    """Общая для всех процессов очередь ссылок с ограничением повторов."""
+
+    def __init__(self, max_retries: int = 3, poll_timeout: float = 0.5) -> None:
+        self.max_retries = max_retries
+        self.poll_timeout = poll_timeout
+
+        self._queue = Queue()
+        self._pending = Value("i", 0)
+        self._producers = Value("i", 0)
+
+    def __len__(self) -> int:
+        return self._pending.value
+
+    @property
+    def finished(self) -> bool:
+        return self._pending.value == 0 and self._producers.value == 0
+
+    def open_producer(self) -> None:
+        with self._producers.get_lock():
+            self._producers.value += 1
+
+    def close_producer(self) -> None:
+        with self._producers.get_lock():
+            self._producers.value -= 1
+
+    def put(self, link: str, attempt: int = 0) -> None:
+        with self._pending.get_lock():
+            self._pending.value += 1
+        self._queue.put(LinkTask(link=link, attempt=attempt))
+
+    def extend(self, links: Iterable[str]) -> None:
+        self.extend_tasks(LinkTask(link=link) for link in links)
+
+    def extend_tasks(self, tasks: Iterable[LinkTask]) -> None:
+        tasks = list(tasks)
+        with self._pending.get_lock():
+            self._pending.value += len(tasks)
+        for task in tasks:
+            self._queue.put(task)
+
+    def get(
+        self,
+        on_wait: Optional[Callable[[], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> Optional[LinkTask]:
+        # None возвращается только когда не осталось ни одной незавершенной задачи и
+        # открытых поставщиков, иначе ссылка еще может прийти на повтор или из источника.
+        # on_wait вызывается между попытками, should_stop прерывает ожидание
+        while True:
+            try:
+                return self._queue.get(timeout=self.poll_timeout)
+            except queue.Empty:
+                if self.finished or (should_stop and should_stop()):
+                    return None
+                if on_wait:
+                    on_wait()
+
+    def done(self, task: LinkTask) -> None:
+        with self._pending.get_lock():
+            self._pending.value -= 1
+
+    def retry(self, task: LinkTask) -> bool:
+        if task.attempt >= self.max_retries:
+            self.done(task=task)
+            return False
+
+        self.put(link=task.link, attempt=task.attempt + 1)
+        self.done(task=task)
+        return True
@@ -0,0 +1,238 @@
+import re
+import sys
+import math
+import zlib
+import hashlib
+import threading
+
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from src.ad_history import AdHistory, TriageAction
+from src.crawl_state import CrawlState
+from src.link_queue import LinkQueue, LinkTask
+
+
+VIDEO_ID = r"[A-Za-z0-9_-]{11}"
+VIDEO_ID_PATTERNS = (
+    re.compile(rf"[?&]v=({VIDEO_ID})(?![A-Za-z0-9_-])"),
+    re.compile(rf"youtu\.be/({VIDEO_ID})(?![A-Za-z0-9_-])"),
+    re.compile(rf"/(?:shorts|embed|live|v)/({VIDEO_ID})(?![A-Za-z0-9_-])"),
+    re.compile(rf"^({VIDEO_ID})$"),
+)
+
+
+def normalize_link(line: str) -> Optional[Tuple[str, str]]:
+    """Возвращает video_id и каноническую ссылку или None, если в строке нет ссылки на видео."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+
+    for pattern in VIDEO_ID_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            video_id = match.group(1)
+            return video_id, f"https://www.youtube.com/watch?v={video_id}"
+    return None
+
+
+def iter_lines(sources: Iterable[str]) -> Iterator[str]:
+    """Построчно читает файлы, все файлы папок (рекурсивно, по имени) и stdin для "-"."""
+    for source in sources:
+        if source == "-":
+            yield from sys.stdin
+            continue
+
+        path = Path(source)
+        paths = sorted(item for item in path.rglob("*") if item.is_file()) if path.is_dir() else [path]
+        for file_path in paths:
+            with file_path.open("r", encoding="utf-8", errors="replace") as file:
+                yield from file
+
+
+class BloomFilter:
+    """Компактное множество с вероятностью ложного срабатывания error_rate при capacity элементов."""
+
+    def __init__(self, capacity: int = 10_000_000, error_rate: float = 1e-6) -> None:
+        size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.size = max(8, size)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str) -> Iterator[int]:
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for index in range(self.hash_count):
+            yield (first + index * second) % self.size
+
+    def add(self, value: str) -> bool:
+        """Добавляет значение, возвращает True, если оно уже могло быть добавлено раньше."""
+        present = True
+        for position in self._positions(value):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                present = False
+                self._bits[byte] |= 1 << bit
+        return present
+
+
+class SetFilter:
+    """Точная дедупликация, подходит, пока все video_id помещаются в память."""
+
+    def __init__(self) -> None:
+        self._seen = set()
+
+    def add(self, value: str) -> bool:
+        if value in self._seen:
+            return True
+        self._seen.add(value)
+        return False
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    index, count = (int(part) for part in value.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Неверный шард: {value}")
+    return index, count
+
+
+def in_shard(video_id: str, shard: Tuple[int, int]) -> bool:
+    # crc32 одинаков на всех машинах и запусках, в отличие от hash()
+    index, count = shard
+    return zlib.crc32(video_id.encode("utf-8")) % count == index
+
+
+@dataclass
+class SourceStats:
+    read: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    other_shard: int = 0
+    already_done: int = 0
+    low_yield: int = 0
+    queued: int = 0
+
+
+class LinkSource:
+    """
+    Поток ссылок из файлов, папок или stdin.
+
+    Строки нормализуются до video_id, повторы отбрасываются, ссылки чужого
+    шарда пропускаются. Пачки записываются в CrawlState, ссылки, завершенные
+    в прошлых запусках или исчерпавшие повторы, в очередь не попадают, а
+    остальные продолжают счет попыток с сохраненного. С историей рекламы каждая
+    пачка упорядочивается по ожидаемому количеству реклам, а видео, где по
+    достаточной истории рекламы нет, пропускаются.
+    """
+
+    def __init__(
+        self,
+        sources: Iterable[str],
+        crawl_state: Optional[CrawlState] = None,
+        dedup: str = "set",
+        shard: Optional[Tuple[int, int]] = None,
+        batch_size: int = 1000,
+        history: Optional[AdHistory] = None,
+        max_retries: Optional[int] = None
+    ) -> None:
+        self.sources = list(sources)
+        self.crawl_state = crawl_state
+        self.max_retries = max_retries
+        self.history = history
+        self.shard = shard
+        self.batch_size = batch_size
+        self.seen = BloomFilter() if dedup == "bloom" else SetFilter()
+        self.stats = SourceStats()
+
+    def _normalized(self) -> Iterator[Tuple[str, str]]:
+        for line in iter_lines(self.sources):
+            self.stats.read += 1
+            normalized = normalize_link(line)
+            if normalized is None:
+                if line.strip() and not line.lstrip().startswith("#"):
+                    self.stats.invalid += 1
+                continue
+
+            video_id = normalized[0]
+            if self.shard and not in_shard(video_id, self.shard):
+                self.stats.other_shard += 1
+                continue
+            if self.seen.add(video_id):
+                self.stats.duplicates += 1
+                continue
+            yield normalized
+
+    def batches(self) -> Iterator[List[LinkTask]]:
+        batch: List[Tuple[str, str]] = []
+        for normalized in self._normalized():
+            batch.append(normalized)
+            if len(batch) >= self.batch_size:
+                yield self._admit(batch)
+                batch = []
+        if batch:
+            yield self._admit(batch)
+
+    def _admit(self, batch: List[Tuple[str, str]]) -> List[LinkTask]:
+        admitted = batch
+        attempts = {}
+        if self.crawl_state:
+            attempts = dict(self.crawl_state.admit_links(batch, max_retries=self.max_retries))
+            admitted = [(video_id, link) for video_id, link in batch if link in attempts]
+        self.stats.already_done += len(batch) - len(admitted)
+
+        if self.history:
+            # Порядок меняется только внутри пачки, чтобы не читать весь источник заранее
+            estimates = self.history.expected_yields(video_id for video_id, _ in admitted)
+            ordered = []
+            for video_id, link in admitted:
+                expected_yield, confident = estimates[video_id]
+                if self.history.action(expected_yield=expected_yield, confident=confident) == TriageAction.skip:
+                    self.stats.low_yield += 1
+                    if self.crawl_state:
+                        self.crawl_state.mark_skipped(video_id=video_id, serial=None, reason="low_yield")
+                    continue
+                ordered.append((expected_yield, video_id, link))
+            ordered.sort(key=lambda item: item[0], reverse=True)
+            admitted = [(video_id, link) for _, video_id, link in ordered]
+
+        self.stats.queued += len(admitted)
+        return [LinkTask(link=link, attempt=attempts.get(link, 0)) for _, link in admitted]
+
+
+class LinkFeeder(threading.Thread):
+    """Пополняет общую очередь из LinkSource, держа в ней не больше max_pending ссылок."""
+
+    def __init__(
+        self,
+        source: LinkSource,
+        link_queue: LinkQueue,
+        max_pending: int = 2000,
+        poll_interval: float = 0.5
+    ) -> None:
+        super().__init__(name="LinkFeeder", daemon=True)
+        self.source = source
+        self.link_queue = link_queue
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+
+        self._stopped = threading.Event()
+        # Пока поставщик открыт, процессы не завершаются на временно пустой очереди
+        self.link_queue.open_producer()
+
+    def run(self) -> None:
+        try:
+            for tasks in self.source.batches():
+                while len(self.link_queue) >= self.max_pending:
+                    if self._stopped.wait(self.poll_interval):
+                        return
+                self.link_queue.extend_tasks(tasks)
+        except Exception as e:
+            print(f"[ERROR] Ошибка чтения ссылок: {e}")
+        finally:
+            self.link_queue.close_producer()
+            print(f"Чтение ссылок завершено: {self.source.stats}")
+
+    def stop(self) -> None:
+        self._stopped.set()
@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import functools
+import threading
+
+from pathlib import Path
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "youtubeparser"
+
+LabelsKey = Tuple[Tuple[str, str], ...]
+
+
+def labels_key(labels: Dict[str, Any]) -> LabelsKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    __slots__ = ("count", "sum", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+
+
+class Metrics:
+    """
+    Счетчики, гистограммы и структурированные события одного процесса.
+
+    Значения хранятся в памяти, снимок сбрасывается в metrics/workers/<serial>.json
+    не чаще flush_interval, события пишутся пакетами в metrics/events/<serial>.jsonl.
+    """
+
+    def __init__(self, serial: str, root: Path = Path("metrics"), flush_interval: float = 10.0) -> None:
+        self.serial = serial
+        self.root = Path(root)
+        self.flush_interval = flush_interval
+        self.video_id: Optional[str] = None
+
+        self.snapshot_path = self.root.joinpath("workers", f"{serial}.json")
+        self.events_path = self.root.joinpath("events", f"{serial}.jsonl")
+
+        self.counters: Dict[Tuple[str, LabelsKey], float] = {}
+        self.gauges: Dict[Tuple[str, LabelsKey], float] = {}
+        self.histograms: Dict[Tuple[str, LabelsKey], Histogram] = {}
+
+        self._events: List[str] = []
+        self._last_flush = time.monotonic()
+
+    def increment(self, name: str, value: float = 1, /, **labels: Any) -> None:
+        key = (name, labels_key(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, /, **labels: Any) -> None:
+        self.gauges[(name, labels_key(labels))] = value
+
+    def observe(self, name: str, value: float, /, **labels: Any) -> None:
+        key = (name, labels_key(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, /, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def event(self, name: str, /, **fields: Any) -> None:
+        record = {"ts": round(time.time(), 3), "event": name, "serial": self.serial, "video_id": self.video_id}
+        record.update(fields)
+        self._events.append(json.dumps(record, ensure_ascii=False, default=str))
+        self.maybe_flush()
+
+    def maybe_flush(self) -> None:
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "serial": self.serial,
+            "counters": [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+            "gauges": [[name, dict(labels), value] for (name, labels), value in self.gauges.items()],
+            "histograms": [
+                [name, dict(labels), histogram.count, histogram.sum, histogram.buckets]
+                for (name, labels), histogram in self.histograms.items()
+            ],
+        }
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        try:
+            if self._events:
+                self.events_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.events_path.open("a", encoding="utf-8") as file:
+                    file.write("\n".join(self._events) + "\n")
+                self._events = []
+
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+            temp_path.write_text(json.dumps(self.to_dict()), encoding="utf-8")
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"[ERROR] [{self.serial}] Не удалось сохранить метрики: {e}")
+
+
+def timed(stage: str) -> Callable:
+    """Замер длительности метода YoutubeParser в гистограмме stage_seconds."""
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args: Any, **kwargs: Any) -> Any:
+            with self.metrics.timer("stage_seconds", stage=stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _InstrumentedJsonRpc:
+    def __init__(self, jsonrpc: Any, metrics: Metrics) -> None:
+        self._jsonrpc = jsonrpc
+        self._metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self._jsonrpc, name)
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with self._metrics.timer("rpc_seconds", method=name):
+                return method(*args, **kwargs)
+        return wrapper
+
+
+class InstrumentedDevice:
+    """Прокси над Device, замеряющий каждый RPC вызов."""
+
+    rpc_methods = (
+        "dump_hierarchy", "screenshot", "click", "swipe_points",
+        "press", "shell", "app_start", "app_stop",
+    )
+
+    def __init__(self, device: Any, metrics: Metrics) -> None:
+        self._device = device
+        self._metrics = metrics
+        self._wrappers: Dict[str, Callable] = {}
+        self.jsonrpc = _InstrumentedJsonRpc(jsonrpc=device.jsonrpc, metrics=metrics)
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in self.rpc_methods:
+            return getattr(self._device, name)
+
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            method = getattr(self._device, name)
+
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self._metrics.timer("rpc_seconds", method=name):
+                    return method(*args, **kwargs)
+            self._wrappers[name] = wrapper
+        return wrapper
+
+    def __call__(self, **selector: Any) -> Any:
+        return self._device(**selector)
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Dict[str, str]] = None) -> str:
+    labels = {**labels, **(extra or {})}
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in sorted(labels.items())
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus(root: Path = Path("metrics")) -> str:
+    """Объединяет снимки всех процессов в текстовый формат Prometheus."""
+    counters, gauges, histograms = {}, {}, {}
+
+    for snapshot_path in sorted(Path(root).joinpath("workers").glob("*.json")):
+        try:
+            snapshot = json.loads(snapshot_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+
+        serial = {"serial": snapshot["serial"]}
+        for name, labels, value in snapshot["counters"]:
+            counters.setdefault(name, []).append(({**labels, **serial}, value))
+        for name, labels, value in snapshot["gauges"]:
+            gauges.setdefault(name, []).append(({**labels, **serial}, value))
+        for name, labels, count, total, buckets in snapshot["histograms"]:
+            histograms.setdefault(name, []).append(({**labels, **serial}, count, total, buckets))
+
+    lines = []
+    for name, samples in sorted(counters.items()):
+        lines.append(f"# TYPE {PREFIX}_{name} counter")
+        lines.extend(f"{PREFIX}_{name}{_format_labels(labels)} {value}" for labels, value in samples)
+    for name, samples in sorted(gauges.items()):
+        lines.append(f"# TYPE {PREFIX}_{name} gauge")
+        lines.extend(f"{PREFIX}_{name}{_format_labels(labels)} {value}" for labels, value in samples)
+    for name, samples in sorted(histograms.items()):
+        lines.append(f"# TYPE {PREFIX}_{name} histogram")
+        for labels, count, total, buckets in samples:
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), buckets):
+                cumulative += bucket
+                lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, {'le': str(bound)})} {cumulative}")
+            lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter(threading.Thread):
+    """Периодически пишет metrics/youtubeparser.prom и, если задан порт, отдает его по HTTP."""
+
+    def __init__(self, root: Path = Path("metrics"), interval: float = 15.0, port: Optional[int] = None) -> None:
+        super().__init__(name="MetricsExporter", daemon=True)
+        self.root = Path(root)
+        self.interval = interval
+        self.port = port
+        self.output_path = self.root.joinpath(f"{PREFIX}.prom")
+
+        self._stopped = threading.Event()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def export(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        temp_path = self.output_path.with_suffix(".tmp")
+        temp_path.write_text(render_prometheus(root=self.root), encoding="utf-8")
+        os.replace(temp_path, self.output_path)
+
+    def _serve(self) -> None:
+        root = self.root
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = render_prometheus(root=root).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="MetricsHTTP", daemon=True).start()
+        print(f"Метрики доступны на порту {self.port}")
+
+    def run(self) -> None:
+        if self.port:
+            self._serve()
+        while not self._stopped.wait(self.interval):
+            self.export()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._server:
+            self._server.shutdown()
+        self.export()
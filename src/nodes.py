@@ -1,70 +1,104 @@
 from uiautomator2 import Device
-from typing import Any, ClassVar, Optional
+from typing import Any, ClassVar, Dict, Optional, Tuple, Union
+
+from src.hierarchy import HierarchySnapshot
+from src.selector_index import selector_key
 
 from src.node_selectors import (
-    AdNodesSelectors, 
-    MainNodesSelectors, 
-    ClassNodesSelectors, 
-    ChromeNodesSelectors, 
+    AdNodesSelectors,
+    MainNodesSelectors,
+    ClassNodesSelectors,
+    ChromeNodesSelectors,
     PlayerNodesSelectors,
-    ContentNodesSelectors, 
+    ContentNodesSelectors,
 )
 
 
+class NodeRegistry:
+    """
+    Общие для всех групп узлы, создаваемые при первом обращении.
+
+    Узел определяется родителем и селектором, поэтому main_node и его потомки
+    создаются один раз на все группы. Найденные позиции SnapshotObject хранит
+    сам и пересчитывает при смене поколения снимка. invalidate нужен только
+    для устройства без снимка, например после переключения приложения.
+    """
+
+    def __init__(self, device: Union[Device, HierarchySnapshot]) -> None:
+        self.device = device
+        self._nodes: Dict[Tuple, Any] = {}
+
+    def node(self, selector: Dict[str, Any], parent: Any = None) -> Any:
+        key = (id(parent), selector_key(selector))
+        node = self._nodes.get(key)
+        if node is None:
+            node = self.device(**selector) if parent is None else parent.child(**selector)
+            self._nodes[key] = node
+        return node
+
+    def invalidate(self) -> None:
+        self._nodes.clear()
+
+
+class LazyNode:
+    """Описание узла группы: создается через NodeRegistry при первом обращении."""
+
+    def __init__(self, selector: Dict[str, Any], parent: Optional[str] = None) -> None:
+        self.selector = selector
+        self.parent = parent
+
+    def __get__(self, instance: Optional["BaseNode"], owner: type) -> Any:
+        if instance is None:
+            return self
+        parent = getattr(instance, self.parent) if self.parent else None
+        return instance.registry.node(selector=self.selector, parent=parent)
+
+
 class BaseNode:
-    def __init__(self, device: Device) -> None:
+    def __init__(
+        self,
+        device: Union[Device, HierarchySnapshot],
+        registry: Optional[NodeRegistry] = None
+    ) -> None:
         self.device = device
-        self._init_nodes()
-        
-    def _init_nodes(self) -> None:
-        raise NotImplementedError
+        self.registry = registry or NodeRegistry(device=device)
 
 
 class MainNodes(BaseNode):
-    def _init_nodes(self) -> None:
-        self.main_node = self.device(**MainNodesSelectors.main_node)
-        self.time_bar_node = self.main_node.child(**MainNodesSelectors.time_bar_node)
-        self.video_player_node = self.main_node.child(**MainNodesSelectors.video_player_node)
-        self.video_metadata_node = self.main_node.child(**MainNodesSelectors.video_metadata_node)
-        self.engagement_panel_node = self.main_node.child(**MainNodesSelectors.engagement_panel_node)
+    main_node = LazyNode(MainNodesSelectors.main_node)
+    time_bar_node = LazyNode(MainNodesSelectors.time_bar_node, parent="main_node")
+    video_player_node = LazyNode(MainNodesSelectors.video_player_node, parent="main_node")
+    video_metadata_node = LazyNode(MainNodesSelectors.video_metadata_node, parent="main_node")
+    engagement_panel_node = LazyNode(MainNodesSelectors.engagement_panel_node, parent="main_node")
 
 
 class PlayerNodes(MainNodes):
-    def _init_nodes(self) -> None:
-        super()._init_nodes()
-        self.control_button = self.video_player_node.child(**PlayerNodesSelectors.control_button)
+    control_button = LazyNode(PlayerNodesSelectors.control_button, parent="video_player_node")
 
 
 class ContentNodes(MainNodes):
-    def _init_nodes(self) -> None:
-        super()._init_nodes()
-        self.ad_block_node = self.video_metadata_node.child(**ContentNodesSelectors.ad_block_node)
-        self.watch_list_node = self.video_metadata_node.child(**ContentNodesSelectors.watch_list_node)
-        self.relative_container_node = self.video_metadata_node.child(**ContentNodesSelectors.relative_container_node)
+    ad_block_node = LazyNode(ContentNodesSelectors.ad_block_node, parent="video_metadata_node")
+    watch_list_node = LazyNode(ContentNodesSelectors.watch_list_node, parent="video_metadata_node")
+    relative_container_node = LazyNode(ContentNodesSelectors.relative_container_node, parent="video_metadata_node")
 
 
 class AdNodes(MainNodes):
-    def _init_nodes(self) -> None:
-        super()._init_nodes()
-        self.close_button = self.engagement_panel_node.child(**AdNodesSelectors.close_ad_button)
-        self.header_panel_node = self.engagement_panel_node.child(**AdNodesSelectors.header_panel_node)
-        self.drag_handle_button = self.engagement_panel_node.child(**AdNodesSelectors.drag_handle_button)
-        
+    close_button = LazyNode(AdNodesSelectors.close_ad_button, parent="engagement_panel_node")
+    header_panel_node = LazyNode(AdNodesSelectors.header_panel_node, parent="engagement_panel_node")
+    drag_handle_button = LazyNode(AdNodesSelectors.drag_handle_button, parent="engagement_panel_node")
+
 
 class ClassNodes(MainNodes):
-    def _init_nodes(self) -> None:
-        super()._init_nodes()
-        self.relative_layouts = self.video_metadata_node.child(**ClassNodesSelectors.relative_layout)
-        
-        
+    relative_layouts = LazyNode(ClassNodesSelectors.relative_layout, parent="video_metadata_node")
+
+
 class ChromeNodes(BaseNode):
-    def _init_nodes(self) -> None:
-        self.tool_bar_node = self.device(**ChromeNodesSelectors.toolbar_node)
-        self.app_menu_list = self.device(**ChromeNodesSelectors.app_menu_list_node)
-        self.menu_button = self.tool_bar_node.child(**ChromeNodesSelectors.menu_button)
-        self.page_info_url_text = self.device(**ChromeNodesSelectors.page_info_url_text)
-        self.truncated_url_button = self.device(**ChromeNodesSelectors.truncated_url_button)
-        self.page_info_button = self.app_menu_list.child(**ChromeNodesSelectors.page_info_button)
-        
-        self.action_button = self.tool_bar_node.child(**ChromeNodesSelectors.action_button)
-        self.content_preview_text = self.device(**ChromeNodesSelectors.content_preview_text)
+    tool_bar_node = LazyNode(ChromeNodesSelectors.toolbar_node)
+    app_menu_list = LazyNode(ChromeNodesSelectors.app_menu_list_node)
+    menu_button = LazyNode(ChromeNodesSelectors.menu_button, parent="tool_bar_node")
+    page_info_url_text = LazyNode(ChromeNodesSelectors.page_info_url_text)
+    truncated_url_button = LazyNode(ChromeNodesSelectors.truncated_url_button)
+    page_info_button = LazyNode(ChromeNodesSelectors.page_info_button, parent="app_menu_list")
+
+    action_button = LazyNode(ChromeNodesSelectors.action_button, parent="tool_bar_node")
+    content_preview_text = LazyNode(ChromeNodesSelectors.content_preview_text)
@@ -0,0 +1,284 @@
+import io
+import json
+import time
+import base64
+import struct
+
+from PIL import Image
+from pathlib import Path
+from uiautomator2 import Device
+from PIL.Image import Image as PILImage
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.hierarchy import HierarchySnapshot, SnapshotObject
+
+
+@dataclass
+class ShellResponse:
+    output: str
+    exit_code: int = 0
+
+
+@dataclass
+class ReplayLatency:
+    rpc: float = 0.0
+    dump: float = 0.0
+    screenshot: float = 0.0
+    gestures: bool = False
+
+
+@dataclass
+class Epoch:
+    """Состояние экрана между двумя действиями: все дампы и кадры, полученные в нем."""
+
+    event: Optional[Dict[str, Any]] = None
+    dumps: List[str] = field(default_factory=list)
+    frames: List[str] = field(default_factory=list)
+
+
+class _ReplayJsonRpc:
+    def __init__(self, device: "ReplayDevice") -> None:
+        self._device = device
+
+    def takeScreenshot(self, scale: int = 1, quality: int = 80) -> str:
+        buffer = io.BytesIO()
+        self._device.screenshot().save(buffer, format="JPEG", quality=quality)
+        return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class _ReplayAdbDevice:
+    def __init__(self, device: "ReplayDevice") -> None:
+        self._device = device
+
+    def shell(self, cmdargs: Any, encoding: Optional[str] = "utf-8", **kwargs: Any) -> Any:
+        command = cmdargs if isinstance(cmdargs, str) else " ".join(cmdargs)
+        if command.startswith("screencap") and encoding is None:
+            frame = self._device.screenshot().convert("RGBA")
+            return struct.pack("<IIII", frame.width, frame.height, 1, 0) + frame.tobytes()
+        return self._device.shell(cmdargs).output
+
+
+class ReplayDevice:
+    """
+    Детерминированная замена uiautomator2.Device для офлайн прогона.
+
+    Сессия состоит из эпох. Каждое действие (click, swipe_points, press,
+    открытие ссылки) переводит устройство в следующую эпоху, а повторные
+    dump_hierarchy и screenshot внутри эпохи отдают записанные подряд
+    значения, последнее повторяется. Задержки RPC задаются через latency.
+    """
+
+    def __init__(self, path: Path, latency: Optional[ReplayLatency] = None, serial: Optional[str] = None) -> None:
+        self.path = Path(path)
+        self.latency = latency or ReplayLatency()
+
+        session = json.loads(self.path.joinpath("session.json").read_text(encoding="utf-8"))
+        self.serial = serial or session.get("serial", self.path.name)
+        self.epochs = [Epoch(**epoch) for epoch in session["epochs"]] or [Epoch()]
+
+        self.rpc_count = 0
+        self.dump_count = 0
+        self.screenshot_count = 0
+        self.events: List[Dict[str, Any]] = []
+
+        self.jsonrpc = _ReplayJsonRpc(device=self)
+        self.adb_device = _ReplayAdbDevice(device=self)
+
+        self._epoch = 0
+        self._dump_position = 0
+        self._frame_position = 0
+        self._cache: Dict[str, Any] = {}
+        self._snapshot = HierarchySnapshot(device=self)
+
+    def __call__(self, **selector: Any) -> SnapshotObject:
+        return self._snapshot(**selector)
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    @property
+    def finished(self) -> bool:
+        return self._epoch >= len(self.epochs) - 1
+
+    def _rpc(self, latency: float = 0.0) -> None:
+        self.rpc_count += 1
+        delay = self.latency.rpc + latency
+        if delay > 0:
+            time.sleep(delay)
+
+    def _advance(self, action: str, *args: Any) -> None:
+        self.events.append({"action": action, "args": list(args)})
+        if self._epoch < len(self.epochs) - 1:
+            self._epoch += 1
+        self._dump_position = 0
+        self._frame_position = 0
+        self._snapshot.invalidate()
+
+    def _pick(self, attribute: str, position: int) -> Optional[str]:
+        # Если в эпохе ничего не записано, берется последнее значение из предыдущих эпох
+        for epoch in range(self._epoch, -1, -1):
+            values = getattr(self.epochs[epoch], attribute)
+            if values:
+                if epoch != self._epoch:
+                    return values[-1]
+                return values[min(position, len(values) - 1)]
+        return None
+
+    def _read(self, name: str, binary: bool) -> Any:
+        if name not in self._cache:
+            file_path = self.path.joinpath(name)
+            self._cache[name] = file_path.read_bytes() if binary else file_path.read_text(encoding="utf-8")
+        return self._cache[name]
+
+    def dump_hierarchy(self, compressed: bool = False, pretty: bool = False, max_depth: Optional[int] = None) -> str:
+        self._rpc(latency=self.latency.dump)
+        self.dump_count += 1
+
+        name = self._pick("dumps", self._dump_position)
+        self._dump_position += 1
+        if name is None:
+            return '<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0"/>'
+        return self._read(name, binary=False)
+
+    def screenshot(self, filename: Optional[str] = None, format: str = "pillow") -> PILImage:
+        self._rpc(latency=self.latency.screenshot)
+        self.screenshot_count += 1
+
+        name = self._pick("frames", self._frame_position)
+        self._frame_position += 1
+        if name is None:
+            frame = Image.new("RGB", (1080, 2400))
+        else:
+            frame = Image.open(io.BytesIO(self._read(name, binary=True))).convert("RGB")
+
+        if filename:
+            frame.save(filename)
+            return None
+        return frame
+
+    def click(self, x: int, y: int) -> None:
+        self._rpc()
+        self._advance("click", x, y)
+
+    def swipe_points(self, points: List[Tuple[int, int]], duration: float = 0.5) -> None:
+        self._rpc(latency=duration if self.latency.gestures else 0.0)
+        self._advance("swipe_points", [list(point) for point in points], duration)
+
+    def press(self, key: str) -> None:
+        self._rpc()
+        self._advance("press", key)
+
+    def shell(self, cmdargs: Any, timeout: float = 60) -> ShellResponse:
+        self._rpc()
+        command = cmdargs if isinstance(cmdargs, str) else " ".join(cmdargs)
+        if command.startswith("am start"):
+            self._advance("shell", command)
+        return ShellResponse(output="")
+
+    def app_start(self, package_name: str, *args: Any, **kwargs: Any) -> None:
+        self._rpc()
+        self._advance("app_start", package_name)
+
+    def app_stop(self, package_name: str) -> None:
+        self._rpc()
+
+
+class _RecordingJsonRpc:
+    def __init__(self, recorder: "SessionRecorder") -> None:
+        self._recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._recorder.device.jsonrpc, name)
+
+    def takeScreenshot(self, scale: int = 1, quality: int = 80) -> Optional[str]:
+        base64_data = self._recorder.device.jsonrpc.takeScreenshot(scale, quality)
+        if base64_data:
+            self._recorder._record_frame(data=base64.b64decode(base64_data))
+        return base64_data
+
+
+class SessionRecorder:
+    """
+    Обертка над реальным Device, записывающая сессию для ReplayDevice.
+
+    Все вызовы передаются устройству. Действия открывают новую эпоху, каждый
+    дамп иерархии и кадр сохраняются в текущую эпоху.
+    """
+
+    def __init__(self, device: Device, path: Path) -> None:
+        self.device = device
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self.jsonrpc = _RecordingJsonRpc(recorder=self)
+        self.epochs = [Epoch()]
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.device, name)
+
+    def __call__(self, **selector: Any) -> Any:
+        return self.device(**selector)
+
+    def _name(self, extension: str) -> str:
+        epoch = len(self.epochs) - 1
+        index = len(self.epochs[-1].dumps) + len(self.epochs[-1].frames)
+        return f"{epoch:05d}-{index:03d}.{extension}"
+
+    def _new_epoch(self, action: str, *args: Any) -> None:
+        self.epochs.append(Epoch(event={"action": action, "args": list(args)}))
+        if len(self.epochs) % 20 == 0:
+            self.save()
+
+    def _record_frame(self, data: bytes) -> None:
+        name = self._name("jpg")
+        self.path.joinpath(name).write_bytes(data)
+        self.epochs[-1].frames.append(name)
+
+    def dump_hierarchy(self, *args: Any, **kwargs: Any) -> str:
+        xml = self.device.dump_hierarchy(*args, **kwargs)
+        name = self._name("xml")
+        self.path.joinpath(name).write_text(xml, encoding="utf-8")
+        self.epochs[-1].dumps.append(name)
+        return xml
+
+    def screenshot(self, *args: Any, **kwargs: Any) -> Any:
+        frame = self.device.screenshot()
+        buffer = io.BytesIO()
+        frame.convert("RGB").save(buffer, format="JPEG", quality=90)
+        self._record_frame(data=buffer.getvalue())
+
+        if args or kwargs:
+            return self.device.screenshot(*args, **kwargs)
+        return frame
+
+    def click(self, x: int, y: int) -> None:
+        self.device.click(x, y)
+        self._new_epoch("click", x, y)
+
+    def swipe_points(self, points: List[Tuple[int, int]], duration: float = 0.5) -> None:
+        self.device.swipe_points(points=points, duration=duration)
+        self._new_epoch("swipe_points", [list(point) for point in points], duration)
+
+    def press(self, key: str) -> None:
+        self.device.press(key)
+        self._new_epoch("press", key)
+
+    def shell(self, cmdargs: Any, *args: Any, **kwargs: Any) -> Any:
+        response = self.device.shell(cmdargs, *args, **kwargs)
+        command = cmdargs if isinstance(cmdargs, str) else " ".join(cmdargs)
+        if command.startswith("am start"):
+            self._new_epoch("shell", command)
+        return response
+
+    def app_start(self, package_name: str, *args: Any, **kwargs: Any) -> None:
+        self.device.app_start(package_name, *args, **kwargs)
+        self._new_epoch("app_start", package_name)
+
+    def save(self) -> None:
+        session = {
+            "serial": self.device.serial,
+            "epochs": [vars(epoch) for epoch in self.epochs],
+        }
+        self.path.joinpath("session.json").write_text(json.dumps(session, ensure_ascii=False), encoding="utf-8")
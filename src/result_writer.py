@@ -0,0 +1,265 @@
+import io
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+
+from pathlib import Path
+from dataclasses import asdict, dataclass
+from collections import defaultdict
+from PIL.Image import Image as PILImage
+from typing import Dict, List, Optional, Tuple, Union
+
+from src.catalogue import Catalogue, CatalogueEntry, PackedImage, PositionEntry
+from src.image_hash import dhash, hamming_distance
+from src.url_resolver import RedirectChain, UrlResolver, apply_to_catalogue
+
+
+@dataclass
+class AdRecord:
+    serial: str
+    video_id: str
+    url: str
+    image: PILImage
+    timestamp: float
+    layout: Optional[str] = None
+    position: Optional[float] = None
+
+
+class ResultWriter(threading.Thread):
+    """
+    Фоновая запись результатов.
+
+    Записи добавляются пакетами в каталог результатов (src.catalogue),
+    изображения PNG по SHA-256 содержимого дописываются в пакет устройства.
+    Повтор с тем же URL и почти совпадающим изображением (по dHash) на том
+    же видео не сохраняется. На другом видео сохраняется только запись о
+    показе со ссылкой на уже сохраненное изображение. Позиции всех найденных
+    рекламных блоков (PositionEntry) пишутся в той же транзакции. Ссылки сохраненных записей передаются в UrlResolver, который
+    в своих потоках дописывает в каталог конечный домен.
+
+    Неудачная запись пакета повторяется с растущей паузой. Если попытки
+    исчерпаны, пакет сохраняется в results/fallback в формате старых
+    результатов (index/*.jsonl, images/*.png, positions/*.jsonl) и
+    переносится в каталог командой python -m src.catalogue import results/fallback.
+    """
+
+    _stop_signal = object()
+
+    def __init__(
+        self,
+        serial: str,
+        root: Path = Path("results"),
+        max_queue: int = 256,
+        batch_size: int = 32,
+        flush_interval: float = 2.0,
+        max_hash_distance: int = 4,
+        resolver: Optional[UrlResolver] = None,
+        resolve_timeout: float = 10.0,
+        max_retries: int = 3,
+        retry_delay: float = 1.0
+    ) -> None:
+        super().__init__(name=f"ResultWriter-{serial}", daemon=True)
+        self.serial = serial
+        self.root = Path(root)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_hash_distance = max_hash_distance
+        self.resolver = resolver
+        self.resolve_timeout = resolve_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.fallback_root = self.root.joinpath("fallback")
+
+        self.catalogue: Optional[Catalogue] = None
+        self._pack_writer = None
+
+        self.saved = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.spilled = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        # URL -> (phash, изображение, video_id) сохраненных показов
+        self._seen: Dict[str, List[Tuple[int, str, str]]] = defaultdict(list)
+
+    def _open(self) -> None:
+        # Соединение SQLite открывается в потоке записи, который им пользуется
+        self.catalogue = Catalogue(root=self.root)
+        self._pack_writer = self.catalogue.pack_writer(prefix=self.serial)
+
+    def submit(self, record: Union[AdRecord, PositionEntry]) -> bool:
+        # Цикл устройства не должен ждать диск: при переполнении запись отбрасывается
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"[ERROR] [{self.serial}] Очередь записи переполнена, запись пропущена: {record}")
+            return False
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        self._queue.put(self._stop_signal)
+        self.join(timeout=timeout)
+        if self.resolver:
+            self.resolver.close(timeout=self.resolve_timeout)
+
+    def _on_resolved(self, result: RedirectChain) -> None:
+        apply_to_catalogue(catalogue=self.catalogue, result=result)
+
+    def similar(self, url: str, phash: int) -> List[Tuple[int, str, str]]:
+        # Показы по URL подгружаются из каталога при первой встрече, чтобы не читать весь каталог
+        if url not in self._seen:
+            self._seen[url] = [
+                (int(seen, 16), image, video_id)
+                for seen, image, video_id in self.catalogue.sightings(url=url)
+            ]
+        return [
+            seen for seen in self._seen[url]
+            if hamming_distance(phash, seen[0]) <= self.max_hash_distance
+        ]
+
+    def _store_image(self, image: PILImage, packed: Dict[str, PackedImage]) -> str:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        data = buffer.getvalue()
+
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in packed and not self.catalogue.has_image(sha=digest):
+            packed[digest] = self._pack_writer.append(sha=digest, data=data)
+        return digest
+
+    def _flush(self, batch: List[Union[AdRecord, PositionEntry]]) -> None:
+        entries = []
+        positions = []
+        packed: Dict[str, PackedImage] = {}
+        # Показы пакета попадают в self._seen только после записи, чтобы повтор пакета не счел их дубликатами
+        pending: Dict[str, List[Tuple[int, str, str]]] = defaultdict(list)
+        duplicates = 0
+        for record in batch:
+            if isinstance(record, PositionEntry):
+                positions.append(record)
+                continue
+
+            phash = dhash(record.image)
+            similar = self.similar(url=record.url, phash=phash) + [
+                seen for seen in pending[record.url]
+                if hamming_distance(phash, seen[0]) <= self.max_hash_distance
+            ]
+            if any(video_id == record.video_id for _, _, video_id in similar):
+                duplicates += 1
+                continue
+
+            # Тот же креатив на другом видео ссылается на уже сохраненное изображение
+            image = similar[0][1] if similar else self._store_image(image=record.image, packed=packed)
+            pending[record.url].append((phash, image, record.video_id))
+            entries.append(CatalogueEntry(
+                serial=record.serial,
+                video_id=record.video_id,
+                timestamp=record.timestamp,
+                url=record.url,
+                phash=f"{phash:016x}",
+                image=image,
+                layout=record.layout,
+                position=record.position
+            ))
+
+        self.duplicates += duplicates
+        if not entries and not positions:
+            return
+
+        self._pack_writer.sync()
+        self.catalogue.add(entries=entries, images=list(packed.values()), positions=positions)
+        self.saved += len(entries)
+        for url, seen in pending.items():
+            self._seen[url].extend(seen)
+
+        if self.resolver:
+            for entry in entries:
+                self.resolver.submit(url=entry.url, on_resolved=self._on_resolved)
+
+    def _spill(self, batch: List[Union[AdRecord, PositionEntry]]) -> None:
+        images_path = self.fallback_root.joinpath("images")
+        images_path.mkdir(parents=True, exist_ok=True)
+        self.fallback_root.joinpath("index").mkdir(exist_ok=True)
+        self.fallback_root.joinpath("positions").mkdir(exist_ok=True)
+
+        index_path = self.fallback_root.joinpath("index", f"{self.serial}.jsonl")
+        positions_path = self.fallback_root.joinpath("positions", f"{self.serial}.jsonl")
+        with index_path.open("a", encoding="utf-8") as index, positions_path.open("a", encoding="utf-8") as positions:
+            for record in batch:
+                if isinstance(record, PositionEntry):
+                    positions.write(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+                    continue
+
+                buffer = io.BytesIO()
+                record.image.save(buffer, format="PNG")
+                data = buffer.getvalue()
+                digest = hashlib.sha256(data).hexdigest()
+                image_path = images_path.joinpath(f"{digest}.png")
+                if not image_path.exists():
+                    image_path.write_bytes(data)
+
+                index.write(json.dumps({
+                    "serial": record.serial,
+                    "video_id": record.video_id,
+                    "timestamp": record.timestamp,
+                    "url": record.url,
+                    "phash": f"{dhash(record.image):016x}",
+                    "image": f"images/{digest}.png",
+                    "layout": record.layout,
+                    "position": record.position,
+                }, ensure_ascii=False) + "\n")
+
+            for file in (index, positions):
+                file.flush()
+                os.fsync(file.fileno())
+        self.spilled += len(batch)
+
+    def _write(self, batch: List[Union[AdRecord, PositionEntry]]) -> None:
+        delay = self.retry_delay
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self._flush(batch=batch)
+                return
+            except Exception as e:
+                print(f"[ERROR] [{self.serial}] Ошибка записи результатов (попытка {attempt}/{self.max_retries}): {e}")
+            if attempt < self.max_retries:
+                time.sleep(delay)
+                delay *= 2
+
+        try:
+            self._spill(batch=batch)
+            print(f"[INFO] [{self.serial}] Записей сохранено в {self.fallback_root}: {len(batch)}")
+        except Exception as e:
+            self.dropped += len(batch)
+            print(f"[ERROR] [{self.serial}] Записи потеряны ({len(batch)}): {e}")
+
+    def run(self) -> None:
+        self._open()
+
+        batch = []
+        last_flush = time.monotonic()
+        stopping = False
+        while not stopping:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+                if record is self._stop_signal:
+                    stopping = True
+                else:
+                    batch.append(record)
+            except queue.Empty:
+                pass
+
+            if batch and (
+                stopping
+                or len(batch) >= self.batch_size
+                or time.monotonic() - last_flush >= self.flush_interval
+            ):
+                self._write(batch=batch)
+                batch = []
+                last_flush = time.monotonic()
+
+        self._pack_writer.close()
@@ -0,0 +1,73 @@
+import hashlib
+import numpy as np
+
+from PIL import Image
+from dataclasses import dataclass
+from PIL.Image import Image as PILImage
+from typing import Iterable, Optional, Tuple, Union
+
+
+@dataclass
+class FrameSignature:
+    thumbnail: np.ndarray
+
+
+@dataclass
+class HierarchySignature:
+    fingerprint: str
+
+
+ScrollSignature = Union[FrameSignature, HierarchySignature]
+
+
+class ScrollEndDetector:
+    """
+    Определение конца списка после свайпа.
+
+    В режиме pixels сравниваются уменьшенные копии области контента в оттенках
+    серого: доля пикселей, отличающихся не больше tolerance, сравнивается с
+    threshold, как в compare_images по полному кадру. Совпадение решений с
+    compare_images проверяется в benchmarks/images.py. В режиме hierarchy сравнивается отпечаток дочерних узлов
+    watch_list_node, скриншоты при этом не нужны.
+    """
+
+    modes = ("pixels", "hierarchy")
+
+    def __init__(
+        self,
+        mode: str = "pixels",
+        threshold: float = 70.0,
+        tolerance: int = 5,
+        size: Tuple[int, int] = (108, 240)
+    ) -> None:
+        if mode not in self.modes:
+            raise ValueError(f"Неизвестный режим определения конца списка: {mode}")
+
+        self.mode = mode
+        self.threshold = threshold
+        self.tolerance = tolerance
+        self.size = size
+
+    def frame_signature(self, frame: PILImage, region: Optional[Tuple[int, int, int, int]] = None) -> FrameSignature:
+        if region:
+            frame = frame.crop(box=region)
+        thumbnail = frame.resize(self.size, Image.Resampling.BOX).convert("L")
+        return FrameSignature(thumbnail=np.asarray(thumbnail, dtype=np.int16))
+
+    @staticmethod
+    def hierarchy_signature(elements: Iterable) -> HierarchySignature:
+        digest = hashlib.md5()
+        for element in elements:
+            digest.update(f"{element.get('bounds')}|{element.get('content-desc')}\n".encode("utf-8"))
+        return HierarchySignature(fingerprint=digest.hexdigest())
+
+    def _is_frame_similar(self, first: np.ndarray, second: np.ndarray) -> bool:
+        similar = np.count_nonzero(np.abs(first - second) <= self.tolerance)
+        return similar * 100 >= first.size * self.threshold
+
+    def is_scroll_end(self, before: ScrollSignature, after: ScrollSignature) -> bool:
+        if isinstance(before, HierarchySignature) and isinstance(after, HierarchySignature):
+            return before.fingerprint == after.fingerprint
+        if isinstance(before, FrameSignature) and isinstance(after, FrameSignature):
+            return self._is_frame_similar(before.thumbnail, after.thumbnail)
+        raise TypeError("Сигнатуры должны быть получены в одном режиме")
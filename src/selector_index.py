@@ -0,0 +1,191 @@
+import re
+from lxml import etree
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+ATTRIBUTE_SELECTORS = {
+    "text": "text",
+    "className": "class",
+    "packageName": "package",
+    "resourceId": "resource-id",
+    "description": "content-desc",
+}
+PREFIX_SELECTORS = {
+    "textStartsWith": "text",
+    "descriptionStartsWith": "content-desc",
+}
+CONTAINS_SELECTORS = {
+    "textContains": "text",
+    "descriptionContains": "content-desc",
+}
+MATCHES_SELECTORS = {
+    "textMatches": "text",
+    "classNameMatches": "class",
+    "resourceIdMatches": "resource-id",
+    "descriptionMatches": "content-desc",
+}
+BOOLEAN_SELECTORS = {
+    "checked": "checked",
+    "enabled": "enabled",
+    "focused": "focused",
+    "selected": "selected",
+    "clickable": "clickable",
+    "focusable": "focusable",
+    "scrollable": "scrollable",
+    "checkable": "checkable",
+    "longClickable": "long-clickable",
+}
+
+
+def compile_selector(selector: Dict[str, Any]) -> Callable[[etree._Element], bool]:
+    checks = []
+
+    for key, value in selector.items():
+        if key in ATTRIBUTE_SELECTORS:
+            checks.append(lambda e, a=ATTRIBUTE_SELECTORS[key], v=value: e.get(a) == v)
+        elif key in PREFIX_SELECTORS:
+            checks.append(lambda e, a=PREFIX_SELECTORS[key], v=value: (e.get(a) or "").startswith(v))
+        elif key in CONTAINS_SELECTORS:
+            checks.append(lambda e, a=CONTAINS_SELECTORS[key], v=value: v in (e.get(a) or ""))
+        elif key in MATCHES_SELECTORS:
+            pattern = re.compile(value)
+            checks.append(lambda e, a=MATCHES_SELECTORS[key], p=pattern: p.fullmatch(e.get(a) or "") is not None)
+        elif key in BOOLEAN_SELECTORS:
+            checks.append(lambda e, a=BOOLEAN_SELECTORS[key], v=value: (e.get(a) == "true") == bool(v))
+        elif key == "index":
+            checks.append(lambda e, v=str(value): e.get("index") == v)
+        elif key == "instance":
+            # instance обрабатывается при выборке, а не при сравнении узла
+            continue
+        else:
+            raise ValueError(f"Неподдерживаемый селектор: {key}")
+
+    return lambda element: all(check(element) for check in checks)
+
+
+_compiled_selectors: Dict[Tuple, Callable[[etree._Element], bool]] = {}
+
+
+def selector_key(selector: Dict[str, Any]) -> Tuple:
+    return tuple(sorted(selector.items()))
+
+
+def get_matcher(selector: Dict[str, Any]) -> Callable[[etree._Element], bool]:
+    key = selector_key(selector)
+    matcher = _compiled_selectors.get(key)
+    if matcher is None:
+        matcher = _compiled_selectors[key] = compile_selector(selector)
+    return matcher
+
+
+class SelectorIndex:
+    """
+    Индекс узлов дампа для быстрого разрешения цепочек селекторов.
+
+    Строится за один обход дерева: хэш-индексы по resource-id, class и
+    content-desc, отсортированный индекс content-desc для поиска по префиксу
+    и интервалы обхода в прямом порядке для проверки вложенности узлов.
+    """
+
+    def __init__(self, root: etree._Element) -> None:
+        self.elements: List[etree._Element] = []
+        self.ends: List[int] = []
+
+        self.by_class: Dict[str, List[int]] = defaultdict(list)
+        self.by_resource_id: Dict[str, List[int]] = defaultdict(list)
+        self.by_description: Dict[str, List[int]] = defaultdict(list)
+
+        stack = []
+        for event, element in etree.iterwalk(root, events=("start", "end"), tag="node"):
+            if event == "start":
+                order = len(self.elements)
+                self.elements.append(element)
+                self.ends.append(order)
+                stack.append(order)
+
+                self.by_class[element.get("class")].append(order)
+                resource_id = element.get("resource-id")
+                if resource_id:
+                    self.by_resource_id[resource_id].append(order)
+                description = element.get("content-desc")
+                if description:
+                    self.by_description[description].append(order)
+            else:
+                order = stack.pop()
+                self.ends[order] = len(self.elements) - 1
+
+        self._description_keys = sorted(self.by_description)
+
+    @classmethod
+    def from_xml(cls, xml: str) -> "SelectorIndex":
+        return cls(root=etree.fromstring(xml.encode("utf-8")))
+
+    def _description_prefix(self, prefix: str) -> List[int]:
+        keys = self._description_keys
+        orders = []
+        for position in range(bisect_left(keys, prefix), len(keys)):
+            if not keys[position].startswith(prefix):
+                break
+            orders.extend(self.by_description[keys[position]])
+        return sorted(orders)
+
+    def _candidates(self, selector: Dict[str, Any]) -> Optional[List[int]]:
+        candidates = []
+
+        if "resourceId" in selector:
+            candidates.append(self.by_resource_id.get(selector["resourceId"], []))
+        if "description" in selector:
+            candidates.append(self.by_description.get(selector["description"], []))
+        if "descriptionStartsWith" in selector:
+            candidates.append(self._description_prefix(selector["descriptionStartsWith"]))
+        if "className" in selector:
+            candidates.append(self.by_class.get(selector["className"], []))
+
+        if not candidates:
+            return None
+        return min(candidates, key=len)
+
+    def _scope_intervals(self, scopes: List[int]) -> Tuple[List[int], List[int]]:
+        # Вложенные интервалы поглощаются интервалом предка
+        starts, ends = [], []
+        for order in scopes:
+            if ends and order <= ends[-1]:
+                continue
+            starts.append(order + 1)
+            ends.append(self.ends[order])
+        return starts, ends
+
+    def find_orders(self, chain: Tuple[Dict[str, Any], ...]) -> List[int]:
+        scopes = None
+
+        for selector in chain:
+            matcher = get_matcher(selector)
+            candidates = self._candidates(selector)
+
+            if scopes is not None:
+                # Интервалы областей не пересекаются и отсортированы: без индексируемого ключа
+                # перебираются только узлы внутри них, иначе кандидаты режутся по границам
+                starts, ends = self._scope_intervals(scopes)
+                inside = []
+                for start, end in zip(starts, ends):
+                    if candidates is None:
+                        inside.extend(range(start, end + 1))
+                    else:
+                        inside.extend(candidates[bisect_left(candidates, start):bisect_right(candidates, end)])
+                candidates = inside
+            elif candidates is None:
+                candidates = range(len(self.elements))
+
+            found = [order for order in candidates if matcher(self.elements[order])]
+
+            instance = selector.get("instance")
+            if instance is not None:
+                found = found[instance:instance + 1]
+            scopes = found
+
+        return scopes or []
+
+    def find(self, chain: Tuple[Dict[str, Any], ...]) -> List[etree._Element]:
+        return [self.elements[order] for order in self.find_orders(chain)]
@@ -0,0 +1,347 @@
+import time
+import threading
+
+from contextlib import contextmanager
+from uiautomator2 import Device
+from adbutils import AdbError, adb
+from dataclasses import dataclass, field
+from multiprocessing import Array, Lock, Process, Value
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from src.link_queue import LinkQueue, LinkTask
+
+
+class WorkerHeartbeat:
+    """
+    Общие с супервизором отметки живости процесса и текущая ссылка.
+
+    Завершение задачи в очереди и сброс текущей ссылки выполняются под lock,
+    поэтому супервизор, остановивший процесс под тем же lock, не вернет в
+    очередь уже завершенную ссылку. Пока процесс внутри операции с общей
+    очередью, in_queue выставлен: принудительная остановка в этот момент может
+    оставить занятой внутреннюю блокировку очереди для всех процессов.
+    """
+
+    max_link_size = 4096
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self._timestamp = Value("d", time.time(), lock=False)
+        self._attempt = Value("i", -1, lock=False)
+        self._link = Array("c", self.max_link_size, lock=False)
+        self._stop_requested = Value("b", False, lock=False)
+        self._in_queue = Value("b", False, lock=False)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self._timestamp.value
+
+    def beat(self) -> None:
+        self._timestamp.value = time.time()
+
+    @property
+    def stop_requested(self) -> bool:
+        return bool(self._stop_requested.value)
+
+    def request_stop(self) -> None:
+        self._stop_requested.value = True
+
+    @property
+    def in_queue(self) -> bool:
+        return bool(self._in_queue.value)
+
+    @contextmanager
+    def queue_operation(self) -> Iterator[None]:
+        self._in_queue.value = True
+        try:
+            yield
+        finally:
+            self._in_queue.value = False
+
+    def reset(self) -> None:
+        self._stop_requested.value = False
+        self._in_queue.value = False
+        self.finish_task()
+
+    def start_task(self, task: LinkTask) -> None:
+        self._link.value = task.link.encode("utf-8")[:self.max_link_size - 1]
+        self._attempt.value = task.attempt
+        self.beat()
+
+    def finish_task(self) -> None:
+        self._attempt.value = -1
+        self.beat()
+
+    def task(self) -> Optional[LinkTask]:
+        if self._attempt.value < 0:
+            return None
+        return LinkTask(link=self._link.value.decode("utf-8"), attempt=self._attempt.value)
+
+
+class SupervisedLinkQueue:
+    """Обертка над LinkQueue в процессе устройства, сообщающая супервизору текущую ссылку."""
+
+    def __init__(self, link_queue: LinkQueue, heartbeat: WorkerHeartbeat) -> None:
+        self.link_queue = link_queue
+        self.heartbeat = heartbeat
+
+    @property
+    def max_retries(self) -> int:
+        return self.link_queue.max_retries
+
+    @property
+    def finished(self) -> bool:
+        return self.link_queue.finished
+
+    def __len__(self) -> int:
+        return len(self.link_queue)
+
+    def get(self) -> Optional[LinkTask]:
+        # Ожидание в конце работы тоже отмечается, иначе простаивающий процесс сочтут зависшим.
+        # После запроса остановки новая ссылка не берется, процесс завершается сам
+        if self.heartbeat.stop_requested:
+            return None
+
+        self.heartbeat.beat()
+        with self.heartbeat.queue_operation():
+            task = self.link_queue.get(
+                on_wait=self.heartbeat.beat,
+                should_stop=lambda: self.heartbeat.stop_requested
+            )
+        if task is not None:
+            self.heartbeat.start_task(task=task)
+        return task
+
+    def done(self, task: LinkTask) -> None:
+        with self.heartbeat.lock, self.heartbeat.queue_operation():
+            self.link_queue.done(task=task)
+            self.heartbeat.finish_task()
+
+    def retry(self, task: LinkTask) -> bool:
+        with self.heartbeat.lock, self.heartbeat.queue_operation():
+            retried = self.link_queue.retry(task=task)
+            self.heartbeat.finish_task()
+        return retried
+
+
+def list_adb_devices() -> List[str]:
+    try:
+        return [device.serial for device in adb.device_list()]
+    except (AdbError, OSError) as e:
+        print(f"[ERROR] Не удалось получить список ADB устройств: {e}")
+        return []
+
+
+def check_uiautomator(serial: str, timeout: float = 15.0) -> bool:
+    """Проверяет, что uiautomator отвечает на RPC за отведенное время."""
+    result = {"ok": False}
+
+    def probe() -> None:
+        try:
+            Device(serial).info
+            result["ok"] = True
+        except Exception as e:
+            print(f"[ERROR] [{serial}] uiautomator не отвечает: {e}")
+
+    thread = threading.Thread(target=probe, name=f"HealthCheck-{serial}", daemon=True)
+    thread.start()
+    thread.join(timeout=timeout)
+    return result["ok"]
+
+
+@dataclass
+class WorkerSlot:
+    serial: str
+    heartbeat: WorkerHeartbeat = field(default_factory=WorkerHeartbeat)
+    process: Optional[Process] = None
+    restarts: int = 0
+    finished: bool = False
+    started_at: float = 0.0
+    last_check: float = 0.0
+    missing_since: Optional[float] = None
+    restart_after: float = 0.0
+
+
+class DeviceSupervisor:
+    """
+    Пул процессов по одному на устройство.
+
+    Каждые poll_interval секунд сверяет список ADB устройств. Новые устройства
+    сразу получают процесс. Упавший, зависший или потерявший устройство процесс
+    останавливается, его текущая ссылка возвращается в очередь как повтор, и
+    процесс перезапускается с нарастающей задержкой. Если отметки живости нет
+    дольше stale_after, проверяется uiautomator. Без отметок дольше hung_timeout
+    процесс считается зависшим.
+
+    Остановка сначала кооперативная: процесс получает запрос и завершается
+    при следующем обращении к очереди. Только если за stop_timeout он не
+    завершился, процесс снимается принудительно, и не во время операции с
+    общей очередью.
+    """
+
+    def __init__(
+        self,
+        worker: Callable[..., None],
+        worker_args: Iterable[Any],
+        link_queue: LinkQueue,
+        on_requeue: Optional[Callable[[str, LinkTask, str, bool], None]] = None,
+        serials: Optional[Iterable[str]] = None,
+        list_devices: Callable[[], List[str]] = list_adb_devices,
+        health_check: Callable[[str], bool] = check_uiautomator,
+        poll_interval: float = 10.0,
+        stale_after: float = 120.0,
+        hung_timeout: float = 600.0,
+        disconnect_grace: float = 30.0,
+        stop_timeout: float = 30.0,
+        queue_wait_timeout: float = 10.0,
+        restart_delay: float = 5.0,
+        max_restart_delay: float = 300.0,
+        max_restarts: int = 20
+    ) -> None:
+        self.worker = worker
+        self.worker_args = tuple(worker_args)
+        self.link_queue = link_queue
+        self.on_requeue = on_requeue
+        self.allowed: Optional[Set[str]] = set(serials) if serials else None
+        self.list_devices = list_devices
+        self.health_check = health_check
+
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.hung_timeout = hung_timeout
+        self.disconnect_grace = disconnect_grace
+        self.stop_timeout = stop_timeout
+        self.queue_wait_timeout = queue_wait_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_restarts = max_restarts
+
+        self.slots: Dict[str, WorkerSlot] = {}
+
+    def _start(self, slot: WorkerSlot) -> None:
+        slot.heartbeat.reset()
+        slot.process = Process(
+            name=slot.serial,
+            target=self.worker,
+            args=(slot.serial, slot.heartbeat, *self.worker_args),
+            daemon=True
+        )
+        slot.process.start()
+        slot.started_at = time.monotonic()
+        slot.last_check = slot.started_at
+        print(f"Процесс {slot.serial} запущен")
+
+    def _terminate(self, process: Process, heartbeat: WorkerHeartbeat) -> None:
+        # Выход из операции с очередью ограничен poll_timeout: после запроса остановки
+        # get возвращает None, а done и retry не выполняются, пока супервизор держит lock
+        deadline = time.monotonic() + self.queue_wait_timeout
+        while heartbeat.in_queue and process.is_alive() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if not process.is_alive():
+            return
+        if heartbeat.in_queue:
+            print(f"[ERROR] Процесс {process.name} не вышел из операции с очередью, остановка принудительная")
+
+        process.terminate()
+        process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def _stop(self, slot: WorkerSlot, reason: str) -> None:
+        slot.heartbeat.request_stop()
+        slot.process.join(timeout=self.stop_timeout)
+
+        # Под lock процесс не может находиться между завершением задачи и сбросом текущей ссылки
+        with slot.heartbeat.lock:
+            if slot.process.is_alive():
+                self._terminate(process=slot.process, heartbeat=slot.heartbeat)
+            task = slot.heartbeat.task()
+            slot.heartbeat.finish_task()
+
+        if task is not None:
+            # Статус обновляется до возврата в очередь, как и в YoutubeParser._retry_link
+            exhausted = task.attempt >= self.link_queue.max_retries
+            print(f"[ERROR] [{slot.serial}] Ссылка {task.link} возвращена в очередь: {reason}")
+            if self.on_requeue:
+                self.on_requeue(slot.serial, task, reason, exhausted)
+            self.link_queue.retry(task=task)
+
+        slot.restarts += 1
+        slot.process = None
+        if slot.restarts > self.max_restarts:
+            print(f"[ERROR] [{slot.serial}] Процесс остановлен ({reason}), превышено количество перезапусков")
+            return
+
+        delay = min(self.restart_delay * 2 ** (slot.restarts - 1), self.max_restart_delay)
+        slot.restart_after = time.monotonic() + delay
+        print(f"[ERROR] [{slot.serial}] Процесс остановлен ({reason}), перезапуск через {delay:.0f} с")
+
+    def _check(self, slot: WorkerSlot, attached: Set[str], now: float) -> None:
+        if slot.serial not in attached:
+            slot.missing_since = slot.missing_since or now
+            if now - slot.missing_since >= self.disconnect_grace:
+                self._stop(slot=slot, reason="device_disconnected")
+            return
+        slot.missing_since = None
+
+        if not slot.process.is_alive():
+            if slot.process.exitcode == 0:
+                slot.finished = True
+                slot.process = None
+                print(f"Процесс {slot.serial} завершил работу")
+            else:
+                self._stop(slot=slot, reason=f"exit_code_{slot.process.exitcode}")
+            return
+
+        age = slot.heartbeat.age
+        if age >= self.hung_timeout:
+            self._stop(slot=slot, reason="worker_hung")
+        elif age >= self.stale_after and now - slot.last_check >= self.stale_after:
+            slot.last_check = now
+            if not self.health_check(slot.serial):
+                self._stop(slot=slot, reason="uiautomator_unresponsive")
+
+    def _poll(self) -> None:
+        now = time.monotonic()
+        attached = set(self.list_devices())
+
+        for serial in sorted(attached):
+            if self.allowed is not None and serial not in self.allowed:
+                continue
+            if serial not in self.slots:
+                print(f"Найдено новое устройство: {serial}")
+                self.slots[serial] = WorkerSlot(serial=serial)
+
+        for slot in self.slots.values():
+            if slot.process is not None:
+                self._check(slot=slot, attached=attached, now=now)
+                continue
+
+            if (
+                slot.serial in attached
+                and not self.link_queue.finished
+                and slot.restarts <= self.max_restarts
+                and now >= slot.restart_after
+            ):
+                slot.finished = False
+                self._start(slot=slot)
+
+    def run(self) -> None:
+        # Работа заканчивается, когда очередь пуста и ни один процесс не выполняется
+        while True:
+            self._poll()
+            running = [slot for slot in self.slots.values() if slot.process is not None]
+            if not running and self.link_queue.finished:
+                return
+            time.sleep(self.poll_interval)
+
+    def stop(self) -> None:
+        running = [slot for slot in self.slots.values() if slot.process is not None and slot.process.is_alive()]
+        for slot in running:
+            slot.heartbeat.request_stop()
+        for slot in running:
+            slot.process.join(timeout=self.stop_timeout)
+            if slot.process.is_alive():
+                with slot.heartbeat.lock:
+                    self._terminate(process=slot.process, heartbeat=slot.heartbeat)
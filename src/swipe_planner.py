@@ -0,0 +1,127 @@
+import math
+import time
+import random
+
+from typing import Dict, List, Optional
+
+from src.catalogue import Catalogue
+
+
+class SwipePlanner:
+    """
+    План прокрутки watch_list по тому, где раньше встречалась реклама.
+
+    Позиция рекламы - глубина в высотах блока контента от начала списка,
+    она сохраняется в каталоге результатов. По гистограмме позиций
+    планировщик решает, сколько блоков пролистать без проверки (участки,
+    где рекламы почти не бывает) и на какой глубине остановиться (дальше
+    осталась малая доля реклам). Пока позиций меньше min_samples, прокрутка
+    идет как раньше: по одному блоку до max_swipe_count или конца списка.
+
+    Остановка и пропуск блоков отрезают глубину, которую планировщик потом
+    не увидит, поэтому гистограмма строится только по полным обходам: до
+    обучения все обходы полные, после - доля explore_rate ссылок проходится
+    без планировщика. Позиции из сокращенных обходов сохраняются, но в
+    гистограмму не попадают.
+    """
+
+    def __init__(
+        self,
+        catalogue: Optional[Catalogue] = None,
+        bin_size: float = 0.5,
+        min_samples: int = 50,
+        stop_mass: float = 0.05,
+        skip_mass: float = 0.01,
+        max_blind_swipes: int = 3,
+        reload_interval: float = 600,
+        explore_rate: float = 0.1
+    ) -> None:
+        self.catalogue = catalogue
+        self.bin_size = bin_size
+        self.min_samples = min_samples
+        # Доля реклам глубже точки остановки, которой можно пожертвовать
+        self.stop_mass = stop_mass
+        # Доля реклам в блоке, который можно пролистать без проверки
+        self.skip_mass = skip_mass
+        self.max_blind_swipes = max_blind_swipes
+        self.reload_interval = reload_interval
+        self.explore_rate = explore_rate
+
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self._loaded_at: Optional[float] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.total >= self.min_samples
+
+    def load(self) -> None:
+        self._loaded_at = time.monotonic()
+        if self.catalogue is None:
+            return
+
+        # Таблица positions содержит все найденные блоки, в гистограмму идут только полные обходы
+        cursor = self.catalogue.connection.execute(
+            "SELECT CAST(position / ? AS INTEGER), COUNT(*) FROM positions "
+            "WHERE explored = 1 AND position >= 0 GROUP BY 1",
+            (self.bin_size,)
+        )
+        self.counts = dict(cursor.fetchall())
+        self.total = sum(self.counts.values())
+
+    def maybe_reload(self) -> None:
+        # Позиции, найденные другими устройствами, подхватываются между ссылками
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_interval:
+            self.load()
+
+    def plan_link(self) -> bool:
+        """Можно ли на этой ссылке останавливаться и пропускать блоки по гистограмме."""
+        return self.trained and random.random() >= self.explore_rate
+
+    def observe(self, position: float, explored: bool) -> None:
+        if not explored:
+            return
+        self.counts[self._bin(position)] = self.counts.get(self._bin(position), 0) + 1
+        self.total += 1
+
+    def _bin(self, depth: float) -> int:
+        return int(max(0.0, depth) // self.bin_size)
+
+    def mass(self, start: float, stop: float) -> float:
+        """Доля известных реклам с позицией в [start, stop)."""
+        if not self.total or stop <= start:
+            return 0.0
+        first, last = self._bin(start), math.ceil(stop / self.bin_size)
+        return sum(self.counts.get(index, 0) for index in range(first, last)) / self.total
+
+    def remaining(self, depth: float) -> float:
+        if not self.total:
+            return 1.0
+        first = self._bin(depth)
+        return sum(count for index, count in self.counts.items() if index >= first) / self.total
+
+    def should_stop(self, depth: float) -> bool:
+        """Видимая область заканчивается на depth + 1, глубже почти не бывает рекламы."""
+        return self.trained and self.remaining(depth + 1) < self.stop_mass
+
+    def blocks_to_swipe(self, depth: float) -> int:
+        """
+        Сколько блоков пролистать подряд до следующей проверки.
+
+        После k блоков видна область [depth + k, depth + k + 1), блоки
+        [depth + 1, depth + k) проходят без проверки, поэтому каждый из них
+        должен содержать меньше skip_mass реклам.
+        """
+        if not self.trained:
+            return 1
+
+        blocks = 1
+        while blocks < self.max_blind_swipes and self.mass(depth + blocks, depth + blocks + 1) < self.skip_mass:
+            blocks += 1
+        return blocks
+
+    def histogram(self) -> List[Dict[str, float]]:
+        return [
+            {"depth": index * self.bin_size, "share": round(count / self.total, 4)}
+            for index, count in sorted(self.counts.items())
+        ]
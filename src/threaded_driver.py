@@ -0,0 +1,78 @@
+import threading
+
+from typing import Callable, Iterable, List, Optional
+
+from src.core import YoutubeParser
+from src.link_queue import LinkQueue
+
+
+class ThreadedDriver:
+    """
+    Режим одного процесса: все устройства в потоках одного процесса.
+
+    Каждое устройство - отдельный поток, который берет ссылки из общей
+    очереди и выполняет шаги YoutubeParser. RPC uiautomator2 и ожидания
+    Waiter блокирующие, поэтому поток занят устройством на все время работы,
+    и потоков всегда столько же, сколько устройств. Ошибка при обработке
+    ссылки возвращает ее в очередь как повтор, устройство подготавливается
+    заново, после max_errors ошибок подряд устройство исключается.
+    """
+
+    def __init__(
+        self,
+        serials: Iterable[str],
+        link_queue: LinkQueue,
+        parser_factory: Callable[[str], YoutubeParser],
+        on_stop: Optional[Callable[[YoutubeParser], None]] = None,
+        max_errors: int = 5
+    ) -> None:
+        self.serials = list(serials)
+        self.link_queue = link_queue
+        self.parser_factory = parser_factory
+        self.on_stop = on_stop
+        self.max_errors = max_errors
+
+    def _run_device(self, serial: str) -> None:
+        try:
+            parser = self.parser_factory(serial)
+        except Exception as e:
+            print(f"[ERROR] [{serial}] Не удалось подключиться к устройству: {e}")
+            return
+
+        parser.start_services()
+        errors = 0
+        prepared = False
+        try:
+            # None только когда не осталось незавершенных задач и открытых поставщиков
+            while (task := self.link_queue.get()) is not None:
+                try:
+                    if not prepared:
+                        parser.prepare_device()
+                        print(f"[INFO] [{serial}] Начало работы с {len(self.link_queue)} ссылками")
+                        prepared = True
+                    parser.process_link(link_queue=self.link_queue, task=task)
+                    errors = 0
+                except Exception as e:
+                    errors += 1
+                    prepared = False
+                    print(f"[ERROR] [{serial}] Ошибка при обработке ссылки {task.link}: {e}")
+                    parser.report_crash(error=e)
+                    parser.abort_link(link_queue=self.link_queue, task=task, reason="worker_error")
+                    if errors >= self.max_errors:
+                        print(f"[ERROR] [{serial}] Устройство исключено после {errors} ошибок подряд")
+                        return
+            print(f"[INFO] [{serial}] Статистика ожиданий: {parser.waiter.summary()}")
+        finally:
+            parser.stop_services()
+            if self.on_stop:
+                self.on_stop(parser)
+
+    def run(self) -> None:
+        threads: List[threading.Thread] = [
+            threading.Thread(target=self._run_device, args=(serial,), name=f"device-{serial}", daemon=True)
+            for serial in self.serials
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,132 @@
+import os
+import json
+import math
+
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from src.metrics import Metrics
+
+
+@dataclass(frozen=True)
+class TimingSpec:
+    """Настраиваемый таймаут: какие ожидания его измеряют и в каких пределах он меняется."""
+
+    name: str
+    waits: Tuple[str, ...]
+    lower: float
+    upper: float
+
+
+DEFAULT_SPECS = (
+    TimingSpec(
+        name="action_timeout",
+        waits=(
+            "app_start", "rotation", "open_link", "player_hide_settle", "player_controls", "video_stop",
+            "hide_ad_panel", "close_ad_panel", "video_prepared", "reposition", "swipe",
+            "close_share_sheet", "return_to_youtube",
+        ),
+        lower=0.1, upper=1.5
+    ),
+    TimingSpec(name="video_load_timeout", waits=("video_settle", "back_to_watch_list"), lower=0.5, upper=3.0),
+    TimingSpec(name="player_hide_timeout", waits=("player_hide",), lower=1.5, upper=8.0),
+    TimingSpec(name="node_spawn_timeout", waits=("chrome_open",), lower=1.0, upper=6.0),
+    TimingSpec(name="ad_wait_timeout", waits=("close_ad",), lower=2.0, upper=8.0),
+    TimingSpec(name="intent_url_timeout", waits=("intent_url",), lower=0.5, upper=3.0),
+)
+
+
+@dataclass
+class TimingEstimate:
+    mean: float = 0.0
+    variance: float = 0.0
+    samples: int = 0
+    value: Optional[float] = None
+
+    def update(self, sample: float, alpha: float) -> None:
+        if self.samples == 0:
+            self.mean = sample
+        else:
+            delta = sample - self.mean
+            self.mean += alpha * delta
+            self.variance = (1 - alpha) * (self.variance + alpha * delta * delta)
+        self.samples += 1
+
+
+@dataclass
+class TimingTuner:
+    """
+    Подстройка таймаутов YoutubeParser под конкретное устройство.
+
+    Длительности ожиданий Waiter сглаживаются EWMA отдельно для каждого
+    параметра. После min_samples наблюдений значение параметра равно
+    (mean + deviations * std) * safety_factor в пределах TimingSpec. Профиль
+    сохраняется в state/timing/<serial>.json и применяется при следующем запуске.
+
+    Ожидание, закончившееся по таймауту, не учитывается: его длительность
+    ограничена самим таймаутом и не меньше него, поэтому такие наблюдения
+    только поднимали бы оценку. Для close_ad таймаут к тому же обычен
+    (рекламы нет) и ничего не говорит о скорости устройства. Ожидания,
+    укороченные вызывающим кодом, идут под другими именами и не учитываются.
+    """
+
+    serial: str
+    root: Path = Path("state/timing")
+    specs: Tuple[TimingSpec, ...] = DEFAULT_SPECS
+    alpha: float = 0.1
+    deviations: float = 3.0
+    safety_factor: float = 1.2
+    min_samples: int = 20
+    metrics: Optional[Metrics] = None
+
+    estimates: Dict[str, TimingEstimate] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self.root = Path(self.root)
+        self._specs_by_wait = {wait: spec for spec in self.specs for wait in spec.waits}
+        self.estimates = {spec.name: TimingEstimate() for spec in self.specs}
+        self.load()
+
+    @property
+    def profile_path(self) -> Path:
+        return self.root.joinpath(f"{self.serial}.json")
+
+    def observe(self, wait: str, duration: float, timed_out: bool) -> None:
+        spec = self._specs_by_wait.get(wait)
+        if spec is None or timed_out:
+            return
+
+        estimate = self.estimates[spec.name]
+        estimate.update(sample=duration, alpha=self.alpha)
+        if estimate.samples >= self.min_samples:
+            value = (estimate.mean + self.deviations * math.sqrt(estimate.variance)) * self.safety_factor
+            estimate.value = round(min(max(value, spec.lower), spec.upper), 3)
+
+    def apply(self, target: Any) -> None:
+        for spec in self.specs:
+            value = self.estimates[spec.name].value
+            if value is not None:
+                # Профиль мог быть сохранен с другими пределами
+                setattr(target, spec.name, min(max(value, spec.lower), spec.upper))
+            if self.metrics is not None:
+                self.metrics.set_gauge("timing_seconds", getattr(target, spec.name), parameter=spec.name)
+
+    def load(self) -> None:
+        try:
+            profile = json.loads(self.profile_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+
+        for name, values in profile.items():
+            if name in self.estimates:
+                self.estimates[name] = TimingEstimate(**values)
+
+    def save(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        temp_path = self.profile_path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_text(
+            json.dumps({name: vars(estimate) for name, estimate in self.estimates.items()}, indent=2),
+            encoding="utf-8"
+        )
+        os.replace(temp_path, self.profile_path)
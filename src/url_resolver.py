@@ -0,0 +1,364 @@
+"""
+Фоновое разрешение ссылок рекламы до конечного домена.
+
+Ссылка из get_ad_url обычно ведет на трекер (googleadservices, doubleclick),
+который перенаправляет на страницу рекламодателя. Цепочки перенаправлений
+проходятся в пуле потоков с общим пулом соединений requests и кэшируются на
+диске (LRU в SQLite), конечный домен записывается в каталог результатов.
+
+Дозаполнение каталога: python -m src.url_resolver --root results
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import requests
+
+from pathlib import Path
+from dataclasses import dataclass, field
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+
+from src.catalogue import Catalogue, url_domain
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# Параметры трекеров, в которых лежит адрес назначения
+DESTINATION_PARAMS = ("adurl", "url", "q", "dest", "destination")
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|gclid|gclsrc|dclid|fbclid|msclkid|yclid|_ga)$")
+META_REFRESH_PATTERN = re.compile(
+    rb"""<meta[^>]+http-equiv=["']?refresh["']?[^>]+content=["']?\s*\d+\s*;\s*url=([^"'>\s]+)""",
+    re.IGNORECASE
+)
+
+
+def canonical_url(url: str) -> str:
+    """Ссылка без фрагмента и параметров отслеживания, хост в нижнем регистре."""
+    parts = urlparse(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(key)]
+    return urlunparse(parts._replace(netloc=parts.netloc.lower(), query=urlencode(query), fragment=""))
+
+
+def embedded_destination(url: str) -> Optional[str]:
+    """Адрес назначения из параметров трекера, если он там есть."""
+    for key, value in parse_qsl(urlparse(url).query):
+        if key.lower() in DESTINATION_PARAMS and value.startswith(("http://", "https://")):
+            return value
+    return None
+
+
+@dataclass
+class RedirectChain:
+    url: str
+    chain: List[str] = field(default_factory=list)
+    final_url: Optional[str] = None
+    final_domain: Optional[str] = None
+    status: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def apply_to_catalogue(catalogue: Catalogue, result: RedirectChain) -> None:
+    if result.ok:
+        catalogue.set_final_url(url=result.url, final_url=result.final_url, final_domain=result.final_domain)
+    elif len(result.chain) > 1:
+        # При ошибке известен только промежуточный адрес, ссылка будет разрешена повторно
+        catalogue.set_final_url(url=result.url, final_url=None, final_domain=result.final_domain)
+
+
+class RedirectCache:
+    """
+    Кэш цепочек перенаправлений на диске с вытеснением давно не читанных.
+
+    Неудачные разрешения хранятся меньше удачных, чтобы временная ошибка
+    сайта не закрепилась в каталоге.
+    """
+
+    def __init__(
+        self,
+        path: Path = Path("state/redirects.sqlite3"),
+        max_entries: int = 200_000,
+        ttl: float = 7 * 24 * 3600,
+        error_ttl: float = 3600
+    ) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+
+        self._connections = {}
+        self._writes = 0
+        self._init_schema()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_connections"] = {}
+        return state
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        owner = (os.getpid(), threading.get_ident())
+        connection = self._connections.get(owner)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections[owner] = connection
+        return connection
+
+    def _init_schema(self) -> None:
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chains (
+                url TEXT PRIMARY KEY,
+                chain TEXT NOT NULL,
+                final_url TEXT,
+                final_domain TEXT,
+                status INTEGER,
+                error TEXT,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chains_accessed ON chains (accessed_at);
+            """
+        )
+
+    def get(self, url: str) -> Optional[RedirectChain]:
+        row = self.connection.execute(
+            "SELECT chain, final_url, final_domain, status, error, created_at FROM chains WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        chain, final_url, final_domain, status, error, created_at = row
+        now = time.time()
+        if now - created_at >= (self.error_ttl if error else self.ttl):
+            return None
+        self.connection.execute("UPDATE chains SET accessed_at = ? WHERE url = ?", (now, url))
+        return RedirectChain(
+            url=url, chain=json.loads(chain), final_url=final_url,
+            final_domain=final_domain, status=status, error=error
+        )
+
+    def put(self, result: RedirectChain) -> None:
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO chains (url, chain, final_url, final_domain, status, error, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                result.url, json.dumps(result.chain), result.final_url, result.final_domain,
+                result.status, result.error, now, now
+            )
+        )
+        # Вытеснение пачками, а не на каждой записи
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        count = self.connection.execute("SELECT COUNT(*) FROM chains").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM chains WHERE url IN (SELECT url FROM chains ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+
+class UrlResolver:
+    """
+    Разрешение ссылок в пуле из concurrency потоков.
+
+    submit не блокирует: ссылка, уже стоящая в очереди, не добавляется
+    повторно, при max_pending ожидающих ссылка отбрасывается. Соединения
+    переиспользуются пулом requests по хостам, одновременных запросов к
+    одному хосту не больше max_per_host.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[RedirectCache] = None,
+        concurrency: int = 16,
+        max_per_host: int = 4,
+        max_pending: int = 10_000,
+        max_redirects: int = 10,
+        timeout: Tuple[float, float] = (5.0, 10.0),
+        deadline: float = 30.0,
+        user_agent: str = "Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 (KHTML, like Gecko) Mobile Safari/537.36"
+    ) -> None:
+        self.cache = cache or RedirectCache()
+        self.max_per_host = max_per_host
+        self.max_pending = max_pending
+        self.max_redirects = max_redirects
+        self.timeout = timeout
+        self.deadline = deadline
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        adapter = HTTPAdapter(pool_connections=64, pool_maxsize=max(concurrency, max_per_host))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="UrlResolver")
+
+        self.resolved = 0
+        self.cached = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._hosts: Dict[str, threading.Semaphore] = {}
+
+    def _host_slot(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.Semaphore(self.max_per_host)
+            return self._hosts[host]
+
+    def _request(self, url: str) -> requests.Response:
+        # GET, а не HEAD: часть трекеров отвечает на HEAD 405 или без Location
+        with self._host_slot(url):
+            return self.session.get(url, allow_redirects=False, stream=True, timeout=self.timeout)
+
+    def _follow(self, url: str) -> RedirectChain:
+        result = RedirectChain(url=url, chain=[url])
+        started = time.monotonic()
+        current = url
+        try:
+            for _ in range(self.max_redirects + 1):
+                if time.monotonic() - started > self.deadline:
+                    raise TimeoutError(f"Цепочка не разрешилась за {self.deadline} с")
+
+                response = self._request(current)
+                try:
+                    result.status = response.status_code
+                    location = response.headers.get("Location")
+                    if response.status_code in REDIRECT_STATUSES and location:
+                        following = urljoin(current, location)
+                    elif response.status_code == 200 and "html" in response.headers.get("Content-Type", ""):
+                        # Промежуточные страницы трекеров перенаправляют через meta refresh
+                        head = response.raw.read(65536, decode_content=True) or b""
+                        match = META_REFRESH_PATTERN.search(head)
+                        following = urljoin(current, match.group(1).decode("utf-8", "replace")) if match else None
+                    else:
+                        following = None
+                finally:
+                    response.close()
+
+                if not following or following in result.chain:
+                    break
+                result.chain.append(following)
+                current = following
+            else:
+                raise RuntimeError(f"Больше {self.max_redirects} перенаправлений")
+        except Exception as e:
+            result.error = repr(e)
+            # Без сети назначение берется из параметров трекера, если оно там есть
+            destination = embedded_destination(current)
+            if destination:
+                result.chain.append(destination)
+                current = destination
+
+        result.final_url = canonical_url(current)
+        result.final_domain = url_domain(result.final_url)
+        return result
+
+    def resolve(self, url: str) -> RedirectChain:
+        """Синхронное разрешение с кэшем, вызывается из потоков пула."""
+        cached = self.cache.get(url)
+        if cached is not None:
+            self.cached += 1
+            return cached
+
+        result = self._follow(url)
+        self.cache.put(result)
+        if result.ok:
+            self.resolved += 1
+        else:
+            self.failed += 1
+        return result
+
+    def _run(self, url: str, on_resolved: Optional[Callable[[RedirectChain], None]]) -> RedirectChain:
+        try:
+            result = self.resolve(url)
+            if on_resolved:
+                try:
+                    on_resolved(result)
+                except Exception as e:
+                    print(f"[ERROR] Ошибка сохранения конечного адреса {url}: {e}")
+            return result
+        finally:
+            with self._lock:
+                self._pending.pop(url, None)
+
+    def submit(self, url: str, on_resolved: Optional[Callable[[RedirectChain], None]] = None) -> Optional[Future]:
+        with self._lock:
+            if url in self._pending:
+                return self._pending[url]
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return None
+            future = self.executor.submit(self._run, url, on_resolved)
+            self._pending[url] = future
+            return future
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        # Незавершенные ссылки остаются в каталоге без final_url и дозаполняются позже
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._pending and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.1)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Разрешение ссылок рекламы в каталоге результатов")
+    parser.add_argument("--root", type=Path, default=Path("results"), help="Папка результатов")
+    parser.add_argument("--cache", type=Path, default=Path("state/redirects.sqlite3"), help="Файл кэша перенаправлений")
+    parser.add_argument("--concurrency", type=int, default=32, help="Количество одновременных запросов")
+    parser.add_argument("--all", action="store_true", help="Разрешить заново и уже разрешенные ссылки")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    catalogue = Catalogue(root=args.root)
+    where = "" if args.all else "WHERE final_url IS NULL"
+    urls = [row[0] for row in catalogue.connection.execute(f"SELECT DISTINCT url FROM ads {where}")]
+    print(f"Ссылок для разрешения: {len(urls)}")
+    resolver = UrlResolver(
+        cache=RedirectCache(path=args.cache), concurrency=args.concurrency, max_pending=max(1, len(urls))
+    )
+
+    # Каталог обновляется из основного потока, потоки пула только ходят в сеть и в кэш
+    futures = [resolver.submit(url) for url in urls]
+    started = time.monotonic()
+    for index, future in enumerate(futures, 1):
+        if future is None:
+            continue
+        result = future.result()
+        apply_to_catalogue(catalogue=catalogue, result=result)
+        if index % 1000 == 0:
+            print(f"Разрешено {index}/{len(urls)} за {time.monotonic() - started:.0f} с")
+
+    resolver.close()
+    print(
+        f"Готово: разрешено {resolver.resolved}, из кэша {resolver.cached}, "
+        f"ошибок {resolver.failed}, отброшено {resolver.dropped}"
+    )
+
+
+if __name__ == "__main__":
+    main()
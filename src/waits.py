@@ -0,0 +1,111 @@
+import time
+import hashlib
+from dataclasses import dataclass, field
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from src.hierarchy import HierarchySnapshot
+from src.metrics import Metrics
+from src.timing import TimingTuner
+
+
+@dataclass
+class WaitStats:
+    durations: List[float] = field(default_factory=list)
+    timeouts: int = 0
+
+    def summary(self) -> Dict[str, Any]:
+        durations = sorted(self.durations)
+        return {
+            "count": len(durations),
+            "timeouts": self.timeouts,
+            "mean": round(sum(durations) / len(durations), 3) if durations else 0.0,
+            "max": round(durations[-1], 3) if durations else 0.0,
+        }
+
+
+class Waiter:
+    """
+    Ожидание условий вместо фиксированных пауз.
+
+    Условие проверяется сразу, затем с нарастающим интервалом до жесткого
+    дедлайна. Перед каждой повторной проверкой снимок иерархии сбрасывается.
+    Фактическое время ожидания сохраняется по имени ожидания и, если передан
+    metrics, в гистограмму wait_seconds. Через tuner длительности подстраивают
+    таймауты устройства.
+    """
+
+    def __init__(
+        self,
+        snapshot: HierarchySnapshot,
+        initial_interval: float = 0.05,
+        max_interval: float = 0.5,
+        backoff: float = 1.5,
+        metrics: Optional[Metrics] = None,
+        tuner: Optional[TimingTuner] = None
+    ) -> None:
+        self.snapshot = snapshot
+        self.metrics = metrics
+        self.tuner = tuner
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self.stats: Dict[str, WaitStats] = defaultdict(WaitStats)
+
+    def until(self, condition: Callable[[], bool], timeout: float, name: str) -> bool:
+        start = time.monotonic()
+        deadline = start + timeout
+        interval = self.initial_interval
+
+        while not condition():
+            now = time.monotonic()
+            if now >= deadline:
+                self._record(name=name, duration=now - start, timed_out=True)
+                return False
+
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * self.backoff, self.max_interval)
+            self.snapshot.invalidate()
+
+        self._record(name=name, duration=time.monotonic() - start, timed_out=False)
+        return True
+
+    def _record(self, name: str, duration: float, timed_out: bool) -> None:
+        self.stats[name].durations.append(duration)
+        if timed_out:
+            self.stats[name].timeouts += 1
+
+        if self.metrics is not None:
+            self.metrics.observe("wait_seconds", duration, wait=name)
+            if timed_out:
+                self.metrics.increment("wait_timeouts_total", wait=name)
+        if self.tuner is not None:
+            self.tuner.observe(wait=name, duration=duration, timed_out=timed_out)
+
+    def hierarchy_fingerprint(self) -> str:
+        return hashlib.md5(self.snapshot.xml.encode("utf-8")).hexdigest()
+
+    def hierarchy_changed(self, baseline: str, timeout: float, name: str) -> bool:
+        return self.until(lambda: self.hierarchy_fingerprint() != baseline, timeout=timeout, name=name)
+
+    def hierarchy_stable(self, timeout: float, name: str) -> bool:
+        # Экран считается остановившимся, когда два подряд снимка иерархии совпадают
+        previous: List[Optional[str]] = [None]
+
+        def is_stable() -> bool:
+            fingerprint = self.hierarchy_fingerprint()
+            stable = fingerprint == previous[0]
+            previous[0] = fingerprint
+            return stable
+
+        return self.until(is_stable, timeout=timeout, name=name)
+
+    def node_appeared(self, node: Any, timeout: float, name: str) -> bool:
+        return self.until(lambda: node.exists, timeout=timeout, name=name)
+
+    def node_gone(self, node: Any, timeout: float, name: str) -> bool:
+        return self.until(lambda: not node.exists, timeout=timeout, name=name)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stats.summary() for name, stats in self.stats.items()}